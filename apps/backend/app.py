@@ -1,110 +1,390 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import boto3
-import time
-from datetime import datetime
-from typing import List, Dict, Any
-import uuid
+import json
 import os
-from dotenv import load_dotenv
-from caption_generator import CaptionGenerator
-from videofunctions import generate_hooks, runwayml_login, grab_video, generate_files_array
-from apps.backend.bulk_overlay import bulk_add_caption_to_video
-from apps.backend import stitch
+import threading
+import time
 
-from text_overlay import text_overlay
+import click
+from flask import Blueprint, Flask, Response, request, jsonify
+from flask_cors import CORS
+from dotenv import load_dotenv
 
-from prisma import Prisma
+from jobs import FAILED, SUCCEEDED, JobQueue, JobStore
+import encoding
+import rate_limit
+import render_cache
+import services
+import storage
+import tracing
 
 # Load environment variables
 load_dotenv()
-app = Flask(__name__)
-CORS(app)
-
-# Initialize Prisma client
-prisma = Prisma()
-prisma.connect()
-
-AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
-AWS_SECRET_KEY = os.getenv("AWS_SECRET_KEY")
-BUCKET_NAME = os.getenv("S3_BUCKET")
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_KEY
-)
-
-# Initialize services
-caption_generator = CaptionGenerator()
-
-@app.route("/api/generate-videos", methods=["POST"])
-def generate_videos():
-    try:
-        prompt = request.json.get("prompt", "")
-        num_captions = request.json.get("num_captions", 3)  # Default to 3 captions
-        
-        # Generate captions using the prompt
+
+# Routes live on a blueprint so importing this module does no work; create_app() builds the app.
+# Clients (Prisma, OpenAI, S3, the job queue) are created per process on first use.
+api = Blueprint("api", __name__)
+
+# seconds between two reads of a running job's events by /api/jobs/<id>/events
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", 0.25))
+
+def run_generation_pipeline(payload, progress):
+    # interactive requests get OpenAI/RunwayML rate limit tokens before background batch jobs
+    with rate_limit.priority(payload.get("priority", "interactive")):
+        return _generate(payload, progress)
+
+def _generate(payload, progress):
+    # heavy imports (runwayml, moviepy, numpy) are paid by the job worker, not at startup
+    import pipeline
+    from bulk_overlay import OVERLAY_WORKERS
+    from videofunctions import iter_hooks, runwayml_login, generate_files_array
+
+    prompt = payload.get("prompt", "")
+    num_captions = payload.get("num_captions", 3)  # Default to 3 captions
+    profile = payload.get("profile")  # Encoding profile of the captioned videos
+    hook_index = services.get_hook_index()
+    files_array = generate_files_array()
+
+    # Streaming: every hook goes to the database and into the caption overlay as soon as its RunwayML
+    # task finishes, and each finished video is published as a job event, so the first captioned video
+    # is ready after one generation and one render instead of after the slowest hook.
+    #   captions (alongside the hooks) | hooks -> database -> overlay
+    captions = []
+    videos = {}  # hook position in files_array -> video
+    rendered = []  # (pairing index, overlay result)
+    previewed = set()  # ids of the hooks whose poster and preview clip are stored
+    lock = threading.Lock()
+
+    def generate_captions():
         try:
-            captions = caption_generator.generate_captions_from_prompt(prompt, num_captions)
+            captions.extend(services.get_caption_generator().generate_captions_from_prompt(prompt, num_captions))
         except Exception as e:
             # If caption generation fails, propagate the error
             raise Exception(f"Caption generation failed: {str(e)}")
+        progress.emit("captions", captions=captions)
+        return ()
+
+    def generate():
+        # Generate videos, reusing hooks already generated for the same image and prompt
+        return iter_hooks(runwayml_login(), prompt, files_array, hook_index=hook_index)
 
-        # Generate videos
-        client = runwayml_login()
-        files_array = generate_files_array()
-        videos_to_add = generate_hooks(client, prompt, files_array)
-        uploaded_videos = []
-
-        for video_url in videos_to_add:
-            filename = video_url.split("/")[-1]
-            
-            # Create video using Prisma
-            new_video = prisma.video.create({
-                'data': {
-                    'filename': filename,
-                    'prompt': prompt,
-                    's3_url': video_url
-                }
-            })
-            
-            uploaded_videos.append({
-                "filename": filename,
-                "s3_url": video_url,
+    def record(hooks):
+        # Cached hooks already have their row, new ones are written with one insert per batch
+        records = hook_index.record_many([hook for hook in hooks if not hook["cached"]], prompt)
+        for hook in hooks:
+            row = hook["record"] if hook["cached"] else records[hook["image_hash"]]
+            video = {
+                "id": row.id,
+                "filename": hook["filename"],
+                "s3_url": hook["s3_url"],
                 "prompt": prompt,
-                "created": new_video.created.isoformat()
-            })
-        
-        # Apply text overlay to videos
-        videos_with_caption = textoverlay(captions, [video["s3_url"] for video in uploaded_videos])
-        
-        # Return both videos and captions
+                "cached": hook["cached"],
+                "poster_url": row.poster_url,
+                "preview_url": row.preview_url,
+                "created": row.created.isoformat()
+            }
+            with lock:
+                videos[hook["index"]] = video
+            progress.emit("hook", video=video)
+            yield hook["index"], video
+
+    def overlay(item):
+        # the hook's captions, paired with the hooks round-robin by their position in files_array
+        position, video = item
+        caption_stage.join()
+        if caption_stage.error is not None:
+            raise caption_stage.error
+        assigned = pipeline.assign_captions(len(captions), len(files_array))[position]
+        # ordered like the pairs of textoverlay: the k-th caption of a hook is pair position + k * hooks
+        render_videos([(position + k * len(files_array), video, captions[c]) for k, c in enumerate(assigned)])
+        return ()
+
+    def render_videos(items):
+        # Apply text overlay to one hook, on its share of the cores
+        results = caption_items([(video["s3_url"], caption) for _, video, caption in items], profile,
+                                threads=max(1, (os.cpu_count() or 1) // OVERLAY_WORKERS))
+        # Keep the hook's poster and preview clip next to its row, so the gallery can show it without the MP4;
+        # the first successful variant of each hook stands for it in the gallery
+        previews = {}
+        for (_, video, _), result in zip(items, results):
+            with lock:
+                if result["error"] or video["id"] in previewed:
+                    continue
+                previewed.add(video["id"])
+                video.update(poster_url=result["poster_url"], preview_url=result["preview_url"])
+            previews[video["id"]] = result
+        hook_index.record_previews(previews)
+        for (order, _, _), result in zip(items, results):
+            with lock:
+                rendered.append((order, result))
+            progress.emit("video", **result)
+
+    hooks_queue = pipeline.make_queue()
+    videos_queue = pipeline.make_queue()
+    caption_stage = pipeline.Stage("captions", generate_captions, progress=progress)
+    pipeline.run([
+        caption_stage,
+        pipeline.Stage("hooks", generate, outbox=hooks_queue, progress=progress),
+        pipeline.Stage("database", record, inbox=hooks_queue, outbox=videos_queue, batch=True, progress=progress),
+        pipeline.Stage("overlay", overlay, inbox=videos_queue, workers=OVERLAY_WORKERS, progress=progress),
+    ])
+
+    # captions planned for hooks that failed are rendered on the hooks that made it, so none is left out
+    assigned = pipeline.assign_captions(len(captions), len(files_array))
+    ready = [videos[position] for position in sorted(videos)]
+    orphans = [captions[c] for position, caption_indexes in enumerate(assigned) if position not in videos
+               for c in caption_indexes]
+    if orphans and ready:
+        with progress.stage("overlay.orphans"):
+            render_videos([(len(files_array) + len(captions) + i, ready[i % len(ready)], caption)
+                           for i, caption in enumerate(orphans)])
+
+    return {
+        "videos": ready,
+        "videos_with_captions": [result for _, result in sorted(rendered, key=lambda item: item[0])],
+        "captions": captions
+    }
+
+def run_stitch(payload, progress):
+    import stitch
+
+    with progress.stage("stitch"):
+        return stitch.process_videos(services.get_prisma(), pairs=payload.get("pairs"),
+                                     backend=payload.get("backend", "moviepy"),
+                                     hook_ids=payload.get("hook_ids"), demo_ids=payload.get("demo_ids"),
+                                     profile=payload.get("profile"))
+
+def run_render(payload, progress):
+    # full quality render of one variant, typically after its preview was picked
+    from text_overlay import render_overlay
+
+    with progress.stage("overlay"):
+        if payload.get("captions"):
+            # every caption variant of the video, rendered from one download and decode
+            variants = textoverlay(payload["captions"], [payload["s3_url"]], payload.get("profile"))
+            return {"variants": variants, "profile": payload.get("profile")}
+        render = render_overlay(storage.get_client(), storage.S3_BUCKET, payload["s3_url"], payload["caption"],
+                                profile=payload.get("profile"))
+    return dict(render, caption=payload["caption"], profile=payload.get("profile"))
+
+def hook_ids_for_job(job_id):
+    # ids of the hooks a finished generation job produced or reused
+    job = job_queue.get().store.get(job_id)
+    if job is None:
+        raise LookupError(f"Job {job_id} not found")
+    if job["kind"] != "generate-videos" or job["status"] != "succeeded" or not job["result"]:
+        raise ValueError(f"Job {job_id} is not a finished video generation job")
+    return [video["id"] for video in job["result"]["videos"]]
+
+def _build_job_queue():
+    # Background job queue, the pipeline runs on its workers instead of inside the request
+    queue = JobQueue(JobStore())
+    queue.register("generate-videos", run_generation_pipeline)
+    queue.register("stitch", run_stitch)
+    queue.register("render", run_render)
+    if queue.num_workers > 0:
+        queue.start()
+    return queue
+
+job_queue = services.Lazy(_build_job_queue, close=lambda queue: queue.stop(timeout=5))
+
+@api.route("/api/generate-videos", methods=["POST"])
+def generate_videos():
+    try:
+        payload = request.json or {}
+        if not payload.get("prompt"):
+            return jsonify({"error": "Prompt is required"}), 400
+        profile = payload.get("profile", encoding.DEFAULT_PROFILE)
+        encoding.get_profile(profile)
+        # "batch" for background bulk runs, so they yield API rate limits to interactive requests
+        priority = payload.get("priority", "interactive")
+        rate_limit.get_priority(priority)
+
+        job_id = job_queue.get().submit("generate-videos", {
+            "prompt": payload["prompt"],
+            "num_captions": payload.get("num_captions", 3),
+            "profile": profile,
+            "priority": priority
+        })
+        return jsonify({
+            "message": "Video generation started",
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "events_url": f"/api/jobs/{job_id}/events"
+        }), 202
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route("/api/stitch", methods=["POST"])
+def stitch_videos():
+    try:
+        payload = request.get_json(silent=True) or {}
+        profile = payload.get("profile", encoding.DEFAULT_PROFILE)
+        encoding.get_profile(profile)
+        hook_ids = payload.get("hook_ids")
+        if payload.get("job_id"):
+            # stitch the hooks of one generation job instead of every hook in the table
+            try:
+                hook_ids = hook_ids_for_job(payload["job_id"])
+            except LookupError as e:
+                return jsonify({"error": str(e)}), 404
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 409
+
+        job_id = job_queue.get().submit("stitch", {
+            "pairs": payload.get("pairs"),
+            "backend": payload.get("backend", "moviepy"),
+            "hook_ids": hook_ids,
+            "demo_ids": payload.get("demo_ids"),
+            "profile": profile
+        })
+        return jsonify({
+            "message": "Stitching started",
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "events_url": f"/api/jobs/{job_id}/events"
+        }), 202
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route("/api/render", methods=["POST"])
+def render_video():
+    try:
+        payload = request.get_json(silent=True) or {}
+        if not payload.get("s3_url") or not (payload.get("caption") or payload.get("captions")):
+            return jsonify({"error": "s3_url and caption (or a list of captions) are required"}), 400
+        profile = payload.get("profile", "publish")
+        encoding.get_profile(profile)
+
+        job_id = job_queue.get().submit("render", {
+            "s3_url": payload["s3_url"],
+            "caption": payload.get("caption"),
+            "captions": payload.get("captions"),
+            "profile": profile
+        })
         return jsonify({
-            "message": "Videos and captions generated successfully", 
-            "videos": uploaded_videos,
-            "videos_with_captions": videos_with_caption,
-            "captions": captions
-        }), 201
+            "message": "Render started",
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "events_url": f"/api/jobs/{job_id}/events"
+        }), 202
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def textoverlay(captions, videos):
-    videos_with_captions = []
+@api.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.get().store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+def _format_event(seq, event, data, sse):
+    if sse:
+        return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"seq": seq, "event": event, "data": data}) + "\n"
+
+@api.route("/api/jobs/<job_id>/events", methods=["GET"])
+def get_job_events(job_id):
+    # a job's results as they are published (e.g. every captioned video of a generation job), followed by
+    # an "end" event with the final status and result; NDJSON, or server-sent events with ?format=sse or
+    # Accept: text/event-stream. ?after=<seq> (or Last-Event-ID) resumes after an event already seen.
+    store = job_queue.get().store
+    if store.get(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+    sse = request.args.get("format") == "sse" or "text/event-stream" in request.headers.get("Accept", "")
+    try:
+        after = int(request.headers.get("Last-Event-ID") or request.args.get("after", 0))
+    except ValueError:
+        return jsonify({"error": "after must be an event sequence number"}), 400
+
+    def stream(after):
+        while True:
+            # status first: every event of a finished job was written before it finished
+            job = store.get(job_id)
+            for event in store.events(job_id, after):
+                after = event["seq"]
+                yield _format_event(after, event["event"], event["data"], sse)
+            if job["status"] in (SUCCEEDED, FAILED):
+                yield _format_event(after, "end", {"status": job["status"], "result": job["result"],
+                                                   "error": job["error"]}, sse)
+                return
+            time.sleep(EVENTS_POLL_INTERVAL)
+
+    return Response(stream(after), content_type="text/event-stream" if sse else "application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@api.route("/metrics", methods=["GET"])
+def metrics():
+    # span durations, bytes and frames of the jobs run by this process, its storage traffic and
+    # render cache hit rate, in the Prometheus text format
+    return Response(tracing.registry.render() + storage.metrics.render() + render_cache.render_cache.render(),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
+
+def textoverlay(captions, videos, profile=None):
+    # urls of the videos to caption, paired with their captions round-robin so neither list is cut short;
+    # a video with several captions is downloaded and decoded once for all of them
+    count = max(len(captions), len(videos)) if captions and videos else 0
+    return caption_items([(videos[i % len(videos)], captions[i % len(captions)]) for i in range(count)], profile)
+
+def caption_items(items, profile=None, threads=None):
+    from bulk_overlay import bulk_add_caption_to_video
+
+    results = bulk_add_caption_to_video(storage.get_client(), storage.S3_BUCKET, items, profile=profile,
+                                        threads=threads)
+
+    for result in results:
+        if result["error"]:
+            print(f"Caption overlay failed for {result['source']}: {result['error']}")
+
+    # urls with captions (and their poster and preview clip), per (video, caption) pair in order
+    return [
+        {"source": result["source"], "caption": result["caption"], "s3_url": result["s3_url"],
+         "poster_url": result["poster_url"], "preview_url": result["preview_url"], "cached": result["cached"],
+         "error": result["error"]}
+        for result in results
+    ]
+
+def create_app():
+    """
+    Build the Flask app.
+
+    Nothing is connected here; each worker process (e.g. under gunicorn) creates its own
+    clients and job workers when the first request needs them.
+
+    Returns:
+        Flask: The configured app
+    """
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(api)
+
+    @app.cli.command("stitch")
+    @click.option("--job-id", help="Only stitch the hooks of this generation job.")
+    @click.option("--backend", type=click.Choice(["moviepy", "ffmpeg", "stream"]), default="moviepy")
+    @click.option("--profile", type=click.Choice(sorted(encoding.PROFILES)), default=encoding.DEFAULT_PROFILE)
+    def stitch_command(job_id, backend, profile):
+        """Stitch hooks with every demo video and store the results."""
+        import stitch
 
-    for caption, video in zip(captions, videos):
-        s3_key = video.split("/")[-1]
-        processed_s3_url = text_overlay(s3, BUCKET_NAME, s3_key, caption)
-        videos_with_captions.append(processed_s3_url)
-    
-    # urls with captions
-    return videos_with_captions
+        hook_ids = hook_ids_for_job(job_id) if job_id else None
+        print(stitch.process_videos(services.get_prisma(), backend=backend, hook_ids=hook_ids, profile=profile))
 
-stitch.process_videos()
+    @app.cli.command("evict-renders")
+    @click.option("--older-than-days", type=float, default=30, show_default=True,
+                  help="Delete cached renders last written more than this many days ago.")
+    def evict_renders_command(older_than_days):
+        """Delete old cached renders with their posters and preview clips."""
+        deleted = render_cache.render_cache.evict(storage.get_client(), storage.S3_BUCKET, older_than_days * 86400)
+        print(f"Deleted {deleted} renders older than {older_than_days:g} days")
 
-@app.teardown_appcontext
-def shutdown_session(exception=None):
-    prisma.disconnect()
+    return app
 
 if __name__ == "__main__":
-    app.run(debug=True, port=5000) 
\ No newline at end of file
+    create_app().run(debug=True, port=5000)
@@ -0,0 +1,125 @@
+"""
+Render synthetic clips through the original MoviePy paths and the faster backends and compare the outputs.
+
+Exits non-zero if any candidate output drifts from the MoviePy output by more than --min-psnr.
+
+Usage (from apps/backend):
+    python benchmarks/compare_backends.py --width 720 --height 1280 --duration 3
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from moviepy.config import get_setting
+from moviepy.editor import VideoFileClip
+
+from stitch_engine import render_group
+from text_overlay import add_caption_to_video
+
+
+def make_clip(path, width, height, duration, fps=24, audio=True, pattern="testsrc"):
+    args = [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"{pattern}=size={width}x{height}:rate={fps}:duration={duration}",
+    ]
+    if audio:
+        args += ["-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}", "-c:a", "aac", "-shortest"]
+    subprocess.run(args + ["-c:v", "libx264", "-pix_fmt", "yuv420p", path], check=True)
+    return path
+
+
+def psnr(a_path, b_path, samples=8):
+    # mean PSNR over evenly spaced frames of the shorter clip
+    a = VideoFileClip(a_path)
+    b = VideoFileClip(b_path)
+    try:
+        duration = min(a.duration, b.duration)
+        scores = []
+        for t in np.linspace(0, duration, samples, endpoint=False):
+            mse = np.mean((a.get_frame(t).astype(np.float64) - b.get_frame(t).astype(np.float64)) ** 2)
+            scores.append(100.0 if mse == 0 else 10 * np.log10(255.0 ** 2 / mse))
+        return float(np.mean(scores)), abs(a.duration - b.duration)
+    finally:
+        a.close()
+        b.close()
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def cases(tmp, width, height, duration):
+    """
+    (name, reference, candidate) renders to compare: the original MoviePy code paths against the faster ones.
+
+    The references are the production paths the candidates replaced: the CompositeVideoClip
+    caption overlay and stitch_engine.render_group with the moviepy backend.
+    """
+    hook = make_clip(os.path.join(tmp, "hook.mp4"), width, height, duration, audio=False)
+    demo = make_clip(os.path.join(tmp, "demo.mp4"), width, height, duration, pattern="smptebars")
+    hook_copy = make_clip(os.path.join(tmp, "hook2.mp4"), width, height, duration, audio=False, pattern="smptebars")
+    caption = "POV: you finally found the one"
+
+    def overlay(mode, backend):
+        return lambda out: add_caption_to_video(demo, out, caption, mode=mode, backend=backend)
+
+    def stitch(clips, backend, max_duration):
+        return lambda out: render_group(clips[0], [(clips[1], out)], backend=backend, max_duration=max_duration)
+
+    return [
+        ("overlay (fast)", overlay("composite", "moviepy"), overlay("fast", "moviepy")),
+        ("overlay (ffmpeg)", overlay("composite", "moviepy"), overlay("fast", "ffmpeg")),
+        ("concat (filter graph)", stitch([hook, demo], "moviepy", duration * 1.5),
+         stitch([hook, demo], "ffmpeg", duration * 1.5)),
+        ("concat (stream copy)", stitch([hook, hook_copy], "moviepy", duration * 2),
+         stitch([hook, hook_copy], "ffmpeg", duration * 2)),
+        ("concat (stream)", stitch([hook, demo], "moviepy", duration * 1.5),
+         stitch([hook, demo], "stream", duration * 1.5)),
+    ]
+
+
+def compare(tmp, width, height, duration, min_psnr=30.0):
+    """Render every case both ways; one result dict per case with timings, PSNR and whether it matches."""
+    results = []
+    for name, reference, candidate in cases(tmp, width, height, duration):
+        ref_out = os.path.join(tmp, f"{name}-reference.mp4".replace(" ", "_"))
+        cand_out = os.path.join(tmp, f"{name}-candidate.mp4".replace(" ", "_"))
+        ref_time = timed(reference, ref_out)
+        cand_time = timed(candidate, cand_out)
+        score, duration_diff = psnr(ref_out, cand_out)
+        results.append({"name": name, "reference_seconds": ref_time, "candidate_seconds": cand_time,
+                        "psnr": score, "duration_diff": duration_diff,
+                        "ok": score >= min_psnr and duration_diff < 0.5})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--width", type=int, default=720)
+    parser.add_argument("--height", type=int, default=1280)
+    parser.add_argument("--duration", type=float, default=3)
+    parser.add_argument("--min-psnr", type=float, default=30.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = compare(tmp, args.width, args.height, args.duration, args.min_psnr)
+    for result in results:
+        print(f"{result['name']:>22}: moviepy {result['reference_seconds']:6.2f}s  "
+              f"candidate {result['candidate_seconds']:6.2f}s  "
+              f"speedup {result['reference_seconds'] / result['candidate_seconds']:5.1f}x  "
+              f"psnr {result['psnr']:5.1f} dB  duration diff {result['duration_diff']:.2f}s  "
+              f"{'ok' if result['ok'] else 'MISMATCH'}")
+
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
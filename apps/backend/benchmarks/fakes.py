@@ -0,0 +1,317 @@
+"""
+Local stand-ins for the external services, so the pipeline can be measured offline.
+
+- FakeRunwayML: image_to_video/tasks client whose tasks finish after a set latency and
+  point at synthetic MP4s served over HTTP by serve_directory(), which answers ranged
+  GETs like a CDN and can cut responses short to exercise retries
+- FakeOpenAI: chat.completions client returning canned numbered captions
+- SQLitePrisma: the subset of the Prisma client API the backend uses, on a SQLite file
+- S3 is covered by LocalS3Client (set S3_LOCAL_DIR)
+"""
+import functools
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    """Static files with single byte ranges, ETags and If-Range, like the CDNs providers serve results from."""
+
+    # share of responses cut off halfway, and the lock around the random draw
+    fail_rate = 0.0
+    # False answers every GET with the whole file, like a server without range support
+    ranges = True
+    # byte offsets whose next response is cut off, each once
+    cut_once = frozenset()
+    _random = random.Random(0)
+    _lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _etag(self, path):
+        stat = os.stat(path)
+        return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().do_GET()
+        size = os.path.getsize(path)
+        etag = self._etag(path)
+        start, end = 0, size - 1
+        ranged = (self.ranges and self.headers.get("Range", "").startswith("bytes=")
+                  and self.headers.get("If-Range", etag) == etag)
+        if ranged:
+            first, _, last = self.headers["Range"][6:].partition("-")
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.end_headers()
+                return
+        length = end - start + 1
+        self.send_response(206 if ranged else 200)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes" if self.ranges else "none")
+        self.send_header("ETag", etag)
+        if ranged:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        with self._lock:
+            truncate = self._random.random() < self.fail_rate or start in self.cut_once
+            if start in self.cut_once:
+                self.cut_once.discard(start)
+        with open(path, "rb") as f:
+            f.seek(start)
+            if truncate:
+                # the advertised length is never delivered, the client sees a short read
+                self.wfile.write(f.read(length // 2))
+                self.close_connection = True
+                return
+            while length > 0:
+                chunk = f.read(min(length, 1024 * 1024))
+                self.wfile.write(chunk)
+                length -= len(chunk)
+
+
+def serve_directory(path, fail_rate=0.0, seed=0, ranges=True, cut_once=()):
+    """
+    Serve a directory over HTTP on a free local port from a daemon thread.
+
+    Args:
+        fail_rate (float): Share of file responses cut off halfway through the body
+        ranges (bool): Answer Range requests; False always sends the whole file
+        cut_once (Iterable[int]): Byte offsets whose first response is cut off halfway, whatever the fail_rate
+
+    Returns:
+        Tuple[str, ThreadingHTTPServer]: Base URL and the server (call shutdown() when done)
+    """
+    handler = type("Handler", (_QuietHandler,), {"fail_rate": fail_rate, "ranges": ranges, "cut_once": set(cut_once),
+                                                 "_random": random.Random(seed)})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(handler, directory=path))
+    threading.Thread(target=server.serve_forever, name="fake-http", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}", server
+
+
+class FakeRunwayML:
+    """
+    RunwayML client whose image_to_video tasks succeed latency seconds after they are created.
+
+    Every task's output is output_url; fail_rate is the share of tasks that end FAILED.
+    """
+
+    def __init__(self, output_url, latency=1.0, fail_rate=0.0, seed=0):
+        self.output_url = output_url
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self._random = random.Random(seed)
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.image_to_video = SimpleNamespace(create=self._create)
+        self.tasks = SimpleNamespace(retrieve=self._retrieve, delete=self._delete)
+        self.cancelled = []
+
+    def _create(self, model, prompt_image, prompt_text, **kwargs):
+        task_id = uuid.uuid4().hex
+        with self._lock:
+            failed = self._random.random() < self.fail_rate
+            self._tasks[task_id] = (time.monotonic() + self.latency, failed)
+        return SimpleNamespace(id=task_id, status="PENDING")
+
+    def _retrieve(self, task_id):
+        with self._lock:
+            ready_at, failed = self._tasks[task_id]
+        if time.monotonic() < ready_at:
+            return SimpleNamespace(id=task_id, status="RUNNING", output=None)
+        if failed:
+            return SimpleNamespace(id=task_id, status="FAILED", output=None)
+        return SimpleNamespace(id=task_id, status="SUCCEEDED", output=[self.output_url])
+
+    def _delete(self, task_id):
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self.cancelled.append(task_id)
+
+
+class FakeOpenAI:
+    """OpenAI client whose chat completions return numbered captions after latency seconds."""
+
+    def __init__(self, latency=0.5):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+        prompt = messages[-1]["content"]
+        count = int(prompt.split()[1]) if prompt.split()[1].isdigit() else 3
+        content = "\n".join(f"{i}. caption number {i} for this video" for i in range(1, count + 1))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(total_tokens=40 * count),
+        )
+
+
+class _Table:
+    """One Prisma model accessor (prisma.video, prisma.demovideo, ...) on a SQLite table."""
+
+    def __init__(self, db, name, columns, unique=None):
+        self.db = db
+        self.name = name
+        self.columns = columns
+        self.unique = unique or {}
+        column_sql = ", ".join(f"{column} TEXT" for column in columns)
+        with db.lock:
+            db.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} (id INTEGER PRIMARY KEY AUTOINCREMENT, {column_sql}, created TEXT)"
+            )
+            for index, fields in self.unique.items():
+                db.conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_{index} ON {name} ({', '.join(fields)})")
+
+    def _row(self, row):
+        values = dict(row)
+        values["created"] = datetime.fromisoformat(values["created"])
+        # DemoVideo names its timestamp "uploaded"
+        values.setdefault("uploaded", values["created"])
+        return SimpleNamespace(**values)
+
+    def _where(self, where):
+        clauses, params = [], []
+        for field, condition in (where or {}).items():
+            if isinstance(condition, dict) and "in" in condition:
+                values = list(condition["in"])
+                if not values:
+                    clauses.append("0")
+                    continue
+                clauses.append(f"{field} IN ({', '.join('?' for _ in values)})")
+                params += values
+            elif condition is None:
+                clauses.append(f"{field} IS NULL")
+            else:
+                clauses.append(f"{field} = ?")
+                params.append(condition)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def find_many(self, where=None, take=None, skip=None, cursor=None, order=None, **kwargs):
+        # rows always come back ordered by id, the only order the backend asks for
+        sql, params = self._where(where)
+        if cursor is not None:
+            sql += (" AND" if sql else " WHERE") + " id >= ?"
+            params.append(cursor["id"])
+        sql = f"SELECT * FROM {self.name}{sql} ORDER BY id"
+        if take is not None or skip:
+            sql += f" LIMIT {int(take) if take is not None else -1} OFFSET {int(skip or 0)}"
+        with self.db.lock:
+            return [self._row(row) for row in self.db.conn.execute(sql, params).fetchall()]
+
+    def create(self, data, **kwargs):
+        fields = [field for field in self.columns if field in data]
+        with self.db.lock:
+            cursor = self.db.conn.execute(
+                f"INSERT INTO {self.name} ({', '.join(fields)}, created) VALUES ({', '.join('?' for _ in fields)}, ?)",
+                [data[field] for field in fields] + [datetime.now(timezone.utc).isoformat()],
+            )
+            row = self.db.conn.execute(f"SELECT * FROM {self.name} WHERE id = ?", (cursor.lastrowid,)).fetchone()
+        return self._row(row)
+
+    def create_many(self, data, skip_duplicates=False, **kwargs):
+        if not data:
+            return 0
+        fields = [field for field in self.columns if field in data[0]]
+        now = datetime.now(timezone.utc).isoformat()
+        verb = "INSERT OR IGNORE" if skip_duplicates else "INSERT"
+        with self.db.lock:
+            before = self.db.conn.total_changes
+            self.db.conn.executemany(
+                f"{verb} INTO {self.name} ({', '.join(fields)}, created) VALUES ({', '.join('?' for _ in fields)}, ?)",
+                [[row.get(field) for field in fields] + [now] for row in data],
+            )
+            return self.db.conn.total_changes - before
+
+    def update(self, where, data, **kwargs):
+        sql, params = self._where(where)
+        assignments = ", ".join(f"{field} = ?" for field in data)
+        with self.db.lock:
+            self.db.conn.execute(f"UPDATE {self.name} SET {assignments}{sql}", list(data.values()) + params)
+        rows = self.find_many(where=where)
+        return rows[0] if rows else None
+
+    def upsert(self, where, data, **kwargs):
+        # where is a single compound unique accessor, e.g. {'image_hash_prompt_model': {...}}
+        (index, fields), = where.items()
+        existing = self.find_many(where=fields)
+        if not existing:
+            return self.create(data["create"])
+        sql, params = self._where(fields)
+        assignments = ", ".join(f"{field} = ?" for field in data["update"])
+        with self.db.lock:
+            self.db.conn.execute(f"UPDATE {self.name} SET {assignments}{sql}", list(data["update"].values()) + params)
+        return self.find_many(where=fields)[0]
+
+
+class SQLitePrisma:
+    """Prisma stand-in with the Video, DemoVideo and ProcessedVideo models on one SQLite file."""
+
+    def __init__(self, path=":memory:"):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.RLock()
+        self.video = _Table(self, "video", ["filename", "prompt", "s3_url", "image_hash", "model", "poster_url",
+                                            "preview_url"],
+                            unique={"image_hash_prompt_model": ("image_hash", "prompt", "model")})
+        self.demovideo = _Table(self, "demovideo", ["filename", "s3_url"])
+        self.processedvideo = _Table(self, "processedvideo", ["filename", "s3_url"])
+
+    def connect(self):
+        pass
+
+    @contextmanager
+    def tx(self, **kwargs):
+        # the lock keeps other threads' statements out of the transaction
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                yield self
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def disconnect(self):
+        self.conn.close()
+
+    def dump(self):
+        # row counts per model, for sanity checks in benchmark output
+        with self.lock:
+            return json.dumps({
+                table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("video", "demovideo", "processedvideo")
+            })
+
+
+def make_stock_images(directory, count, width=768, height=1280):
+    """Write count distinct PNG stock images, so every image hashes differently."""
+    from PIL import Image
+
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for i in range(count):
+        name = f"stock_{i:03d}.png"
+        rng = random.Random(i)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        Image.new("RGB", (width, height), color).save(os.path.join(directory, name))
+        names.append(name)
+    return names
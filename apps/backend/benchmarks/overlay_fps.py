@@ -0,0 +1,54 @@
+"""
+Compare caption overlay throughput of the composite and fast render modes.
+
+Usage (from apps/backend):
+    python benchmarks/overlay_fps.py --width 1080 --height 1920 --duration 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moviepy.config import get_setting
+
+from text_overlay import add_caption_to_video
+
+
+def make_synthetic_clip(path, width, height, duration, fps=24):
+    # test pattern with a sine tone so the audio path is exercised too
+    subprocess.run([
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc=size={width}x{height}:rate={fps}:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", path,
+    ], check=True)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--width", type=int, default=1080)
+    parser.add_argument("--height", type=int, default=1920)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--fps", type=int, default=24)
+    parser.add_argument("--caption", default="POV: you finally found the one")
+    parser.add_argument("--modes", nargs="+", default=["composite", "fast"])
+    args = parser.parse_args()
+
+    n_frames = int(args.duration * args.fps)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = make_synthetic_clip(os.path.join(tmp, "source.mp4"), args.width, args.height, args.duration, args.fps)
+        for mode in args.modes:
+            output = os.path.join(tmp, f"{mode}.mp4")
+            start = time.perf_counter()
+            add_caption_to_video(source, output, args.caption, mode=mode)
+            elapsed = time.perf_counter() - start
+            print(f"{mode:>10}: {n_frames} frames in {elapsed:6.2f}s -> {n_frames / elapsed:7.1f} fps")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Measure cold startup of the backend: import app, build it with create_app() and serve a first request.
+
+Each run is a fresh interpreter, so module imports are paid in full like in a new gunicorn worker.
+Storage and the job store point at a temporary directory and no job workers are started.
+
+Usage (from apps/backend):
+    python benchmarks/startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in the child interpreter, prints one JSON line of timings in seconds
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+response = flask_app.test_client().get("/api/jobs/missing")
+served = time.perf_counter()
+assert response.status_code == 404, response.status_code
+print(json.dumps({
+    "import": imported - start,
+    "create_app": created - imported,
+    "first_request": served - created,
+    "total": served - start,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def run_once(tmp):
+    env = dict(
+        os.environ,
+        S3_LOCAL_DIR=os.path.join(tmp, "s3"),
+        JOBS_DB_PATH=os.path.join(tmp, "jobs.sqlite3"),
+        JOB_WORKERS="0",
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # the first run warms the OS file cache for the .pyc files and is not counted
+        run_once(tmp)
+        runs = [run_once(tmp) for _ in range(args.runs)]
+
+    for name in ("import", "create_app", "first_request", "total"):
+        values = [run[name] * 1000 for run in runs]
+        print(f"{name:>14}: median {statistics.median(values):8.1f} ms   max {max(values):8.1f} ms")
+    print(f"{'modules':>14}: {runs[-1]['modules']}")
+
+
+if __name__ == "__main__":
+    main()
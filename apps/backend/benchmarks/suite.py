@@ -0,0 +1,368 @@
+"""
+Offline benchmark suite for the generation pipeline, with local fakes for every external service.
+
+RunwayML, OpenAI, S3 and Postgres are replaced by the stand-ins in benchmarks/fakes.py and
+LocalS3Client, so the numbers only depend on this machine. Each case runs in a fresh
+interpreter so its peak RSS is its own. Results are compared against a stored baseline
+and regressions beyond --tolerance make the run exit non-zero.
+
+Usage (from apps/backend):
+    python benchmarks/suite.py                      # full matrix, compare with the baseline
+    python benchmarks/suite.py --quick --only overlay stitch
+    python benchmarks/suite.py --save-baseline      # record the current numbers as the baseline
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baselines.json")
+
+RESOLUTIONS = {"480p": (480, 854), "720p": (720, 1280), "1080p": (1080, 1920)}
+
+# (scenario, parameters) for every case; --quick keeps the first case of each scenario
+MATRIX = [
+    ("captions", {"batch": 1, "latency": 0.2}),
+    ("captions", {"batch": 8, "latency": 0.2}),
+    ("captions", {"batch": 32, "latency": 0.2}),
+    ("hooks", {"batch": 1, "latency": 1.0, "resolution": "720p"}),
+    ("hooks", {"batch": 4, "latency": 1.0, "resolution": "720p"}),
+    ("hooks", {"batch": 8, "latency": 1.0, "resolution": "720p"}),
+    ("overlay", {"resolution": "480p", "duration": 3}),
+    ("overlay", {"resolution": "720p", "duration": 3}),
+    ("overlay", {"resolution": "1080p", "duration": 3}),
+    ("overlay", {"resolution": "1080p", "duration": 3, "profile": "preview"}),
+    ("overlay", {"resolution": "1080p", "duration": 3, "profile": "draft"}),
+    ("overlay", {"resolution": "720p", "duration": 3, "captions": 4}),
+    ("stitch", {"hooks": 1, "demos": 2, "resolution": "480p", "backend": "moviepy"}),
+    ("stitch", {"hooks": 2, "demos": 3, "resolution": "720p", "backend": "moviepy"}),
+    ("stitch", {"hooks": 2, "demos": 3, "resolution": "720p", "backend": "ffmpeg"}),
+    ("stitch", {"hooks": 2, "demos": 3, "resolution": "720p", "backend": "stream"}),
+    ("stitch", {"hooks": 1, "demos": 2, "resolution": "1080p", "backend": "moviepy", "demo_seconds": 30}),
+    ("stitch", {"hooks": 1, "demos": 2, "resolution": "1080p", "backend": "stream", "demo_seconds": 30}),
+    ("transfer", {"size_mb": 8, "fail_rate": 0.0}),
+    ("transfer", {"size_mb": 64, "fail_rate": 0.0}),
+    ("transfer", {"size_mb": 64, "fail_rate": 0.2}),
+    ("api", {"batch": 1, "latency": 1.0, "resolution": "480p"}),
+    ("api", {"batch": 4, "latency": 1.0, "resolution": "720p"}),
+]
+
+
+def case_key(scenario, params):
+    return f"{scenario}[{','.join(f'{k}={v}' for k, v in sorted(params.items()))}]"
+
+
+def percentile(values, q):
+    # nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def measure(run, repeats, warmup):
+    for i in range(warmup):
+        run(-1 - i)
+    latencies = []
+    items = 0
+    for i in range(repeats):
+        start = time.perf_counter()
+        items += run(i)
+        latencies.append(time.perf_counter() - start)
+    return latencies, items
+
+
+def _clip(path, resolution, duration, fps=24):
+    from compare_backends import make_clip
+
+    width, height = RESOLUTIONS[resolution]
+    return make_clip(path, width, height, duration, fps)
+
+
+# scenarios run inside the child interpreter, with the working directory set to a scratch directory
+
+def bench_captions(params, repeats, warmup):
+    from caption_generator import CaptionGenerator
+    from fakes import FakeOpenAI
+
+    generator = CaptionGenerator()
+    generator.client = FakeOpenAI(params["latency"])
+
+    def run(i):
+        # fresh prompts every iteration, so nothing is served from the caption cache
+        generator.generate_captions_batch([f"benchmark prompt {i} {n}" for n in range(params["batch"])], 3)
+        return params["batch"]
+
+    return measure(run, repeats, warmup), "captions"
+
+
+def bench_hooks(params, repeats, warmup):
+    from fakes import FakeRunwayML, make_stock_images, serve_directory
+    from videofunctions import generate_hooks
+
+    os.makedirs("served")
+    _clip(os.path.join("served", "hook.mp4"), params["resolution"], 5)
+    base_url, server = serve_directory("served")
+    files = make_stock_images("stockimages", params["batch"])
+    client = FakeRunwayML(f"{base_url}/hook.mp4", latency=params["latency"])
+
+    def run(i):
+        hooks = generate_hooks(client, f"benchmark prompt {i}", files)
+        if len(hooks) != len(files):
+            raise RuntimeError(f"{len(files) - len(hooks)} hooks failed")
+        return len(hooks)
+
+    try:
+        return measure(run, repeats, warmup), "hooks"
+    finally:
+        server.shutdown()
+
+
+def bench_overlay(params, repeats, warmup):
+    import storage
+    from bulk_overlay import bulk_add_caption_to_video
+    from text_overlay import text_overlay
+
+    source = _clip("source.mp4", params["resolution"], params["duration"])
+    url = storage.upload_file(source, "hooks/source.mp4")
+    frames = int(params["duration"] * 24)
+
+    def run(i):
+        # a new caption every iteration, so the render cache never answers
+        if "captions" in params:
+            # several caption variants of one video, rendered from a single decode
+            items = [(url, f"benchmark caption {i}.{n}") for n in range(params["captions"])]
+            results = bulk_add_caption_to_video(storage.get_client(), storage.S3_BUCKET, items,
+                                                profile=params.get("profile"))
+            if any(result["error"] for result in results):
+                raise RuntimeError(next(result["error"] for result in results if result["error"]))
+            return frames * len(items)
+        text_overlay(storage.get_client(), storage.S3_BUCKET, url, f"benchmark caption {i}",
+                     profile=params.get("profile"))
+        return frames
+
+    return measure(run, repeats, warmup), "frames"
+
+
+def bench_stitch(params, repeats, warmup):
+    from stitch_engine import stitch_videos
+
+    hooks = [_clip(f"hook{i}.mp4", params["resolution"], 2) for i in range(params["hooks"])]
+    demos = [_clip(f"demo{i}.mp4", params["resolution"], params.get("demo_seconds", 4)) for i in range(params["demos"])]
+
+    def run(i):
+        output_dir = tempfile.mkdtemp(dir=".")
+        return len(stitch_videos(hooks, demos, output_dir, backend=params["backend"]))
+
+    return measure(run, repeats, warmup), "videos"
+
+
+def bench_transfer(params, repeats, warmup):
+    import hashlib
+
+    import storage
+    from fakes import serve_directory
+    from transfer import copy_url_to_s3
+
+    os.makedirs("served")
+    size = params["size_mb"] * 1024 * 1024
+    with open(os.path.join("served", "video.mp4"), "wb") as f:
+        f.write(os.urandom(size))
+    with open(os.path.join("served", "video.mp4"), "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    # fail_rate of the provider's responses are cut short, the transfer retries those parts
+    base_url, server = serve_directory("served", fail_rate=params["fail_rate"])
+
+    def run(i):
+        key = f"hooks/transfer_{i}.mp4"
+        copy_url_to_s3(f"{base_url}/video.mp4", key)
+        if hashlib.sha256(storage.get_stream(key).read()).hexdigest() != digest:
+            raise RuntimeError(f"{key} does not match the source")
+        return params["size_mb"]
+
+    try:
+        return measure(run, repeats, warmup), "MB"
+    finally:
+        server.shutdown()
+
+
+def bench_api(params, repeats, warmup):
+    import app
+    import services
+    import videofunctions
+    from caption_generator import CaptionGenerator
+    from fakes import FakeOpenAI, FakeRunwayML, SQLitePrisma, make_stock_images, serve_directory
+
+    os.makedirs("served")
+    _clip(os.path.join("served", "hook.mp4"), params["resolution"], 5)
+    base_url, server = serve_directory("served")
+    make_stock_images("stockimages", params["batch"])
+
+    services.prisma.set(SQLitePrisma())
+    generator = CaptionGenerator()
+    generator.client = FakeOpenAI(params.get("caption_latency", 0.2))
+    services.caption_generator.set(generator)
+    runway = FakeRunwayML(f"{base_url}/hook.mp4", latency=params["latency"])
+    videofunctions.runwayml_login = lambda: runway
+
+    client = app.create_app().test_client()
+
+    def run(i):
+        response = client.post("/api/generate-videos", json={"prompt": f"benchmark prompt {i}"})
+        status_url = response.get_json()["status_url"]
+        while True:
+            job = client.get(status_url).get_json()
+            if job["status"] in ("succeeded", "failed"):
+                break
+            time.sleep(0.05)
+        if job["status"] != "succeeded":
+            raise RuntimeError(f"Generation job failed: {job['error']}")
+        return len(job["result"]["videos"])
+
+    try:
+        return measure(run, repeats, warmup), "hooks"
+    finally:
+        server.shutdown()
+        app.job_queue.reset()
+
+
+SCENARIOS = {
+    "captions": bench_captions,
+    "hooks": bench_hooks,
+    "overlay": bench_overlay,
+    "stitch": bench_stitch,
+    "transfer": bench_transfer,
+    "api": bench_api,
+}
+
+
+def run_child(case):
+    (latencies, items), unit = SCENARIOS[case["scenario"]](case["params"], case["repeats"], case["warmup"])
+
+    if "bulk_overlay" in sys.modules:
+        # reap the encoder processes so their peak RSS is counted
+        sys.modules["bulk_overlay"].shutdown_pool()
+
+    # ru_maxrss is in KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(json.dumps({
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "throughput": items / sum(latencies),
+        "unit": unit,
+        "peak_rss_mb": round(own, 1),
+        "children_peak_rss_mb": round(children, 1),
+    }))
+
+
+def run_case(scenario, params, repeats, warmup):
+    case = {"scenario": scenario, "params": params, "repeats": repeats, "warmup": warmup}
+    with tempfile.TemporaryDirectory(prefix="lookbk-bench-") as work_dir:
+        env = dict(
+            os.environ,
+            S3_LOCAL_DIR=os.path.join(work_dir, "s3"),
+            JOBS_DB_PATH=os.path.join(work_dir, "jobs.sqlite3"),
+            JOB_WORKERS="1",
+            OPENAI_API_KEY="benchmark",
+            CAPTION_CACHE_BACKEND="memory",
+            RUNWAYML_POLL_INITIAL_DELAY="0.05",
+            RUNWAYML_POLL_MAX_DELAY="0.2",
+            # the fakes do not throttle, measure the pipeline rather than the configured API budgets
+            RATE_LIMIT_DB_PATH=os.path.join(work_dir, "ratelimit.sqlite3"),
+            TRANSFER_DB_PATH=os.path.join(work_dir, "transfers.sqlite3"),
+            TRANSFER_BACKOFF="0.05",
+            OPENAI_REQUESTS_PER_MINUTE="0",
+            RUNWAYML_TASKS_PER_MINUTE="0",
+            RUNWAYML_POLLS_PER_MINUTE="0",
+        )
+        env.pop("TRACE_DIR", None)
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", json.dumps(case)],
+            cwd=work_dir, env=env, capture_output=True, text=True,
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{case_key(scenario, params)} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(result, baseline, tolerance):
+    # names of the metrics that got worse than the baseline by more than tolerance
+    regressions = []
+    if result["p50"] > baseline["p50"] * (1 + tolerance):
+        regressions.append("p50")
+    if result["p99"] > baseline["p99"] * (1 + tolerance):
+        regressions.append("p99")
+    if result["throughput"] < baseline["throughput"] / (1 + tolerance):
+        regressions.append("throughput")
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append("peak_rss")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(SCENARIOS), help="Scenarios to run (default: all)")
+    parser.add_argument("--quick", action="store_true", help="One case per scenario, one repeat")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown/growth before flagging")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return
+
+    cases = [(scenario, params) for scenario, params in MATRIX if not args.only or scenario in args.only]
+    repeats = args.repeats
+    if args.quick:
+        seen = set()
+        cases = [case for case in cases if case[0] not in seen and not seen.add(case[0])]
+        repeats = 1
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    print(f"{'case':<58} {'throughput':>16} {'p50':>9} {'p99':>9} {'rss':>8} {'child rss':>10}")
+    results = {}
+    regressed = []
+    for scenario, params in cases:
+        key = case_key(scenario, params)
+        result = run_case(scenario, params, repeats, args.warmup)
+        results[key] = result
+        flags = compare(result, baselines[key], args.tolerance) if key in baselines and not args.save_baseline else []
+        if flags:
+            regressed.append((key, flags))
+        print(
+            f"{key:<58} {result['throughput']:9.2f} {result['unit'] + '/s':<6} "
+            f"{result['p50'] * 1000:7.0f}ms {result['p99'] * 1000:7.0f}ms "
+            f"{result['peak_rss_mb']:6.0f}MB {result['children_peak_rss_mb']:8.0f}MB"
+            + (f"  REGRESSED: {', '.join(flags)}" if flags else "")
+        )
+
+    if args.save_baseline:
+        baselines.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if regressed:
+        print(f"{len(regressed)} case(s) regressed by more than {args.tolerance:.0%} against {args.baseline}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import previews
+import storage
+import tracing
+from render_cache import render_cache
+from text_overlay import add_captions_to_video, overlay_url, plan_overlay
+
+# encoder processes, one per core unless overridden
+OVERLAY_WORKERS = int(os.getenv("OVERLAY_WORKERS", os.cpu_count() or 1))
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(max_workers: int) -> ProcessPoolExecutor:
+    # the pool is kept between batches so worker start-up (moviepy/numpy imports) is paid once
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn instead of fork, the web process has threads (job workers, boto3) running
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = max_workers
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+            _pool_workers = None
+    pool.shutdown(wait=False)
+
+
+def shutdown_pool():
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+        _pool_workers = None
+
+
+def _render(local_input: str, variants: List[Dict[str, Any]], font_size: int, threads: int,
+            profile: Optional[str] = None, position: str = 'center') -> List[Dict[str, Any]]:
+    # runs in a worker process, its spans are sent back to be recorded by the parent
+    with tracing.trace("overlay.render", dump=False) as trace:
+        add_captions_to_video(local_input, variants, font_size, threads=threads, profile=profile, position=position)
+    return trace.spans
+
+
+def bulk_add_caption_to_video(s3, bucket_name: str, items: Sequence[Tuple[str, str]],
+                              font_size: int = 100, position: str = 'center',
+                              max_workers: Optional[int] = None, profile: Optional[str] = None,
+                              threads: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Caption many videos at once.
+
+    Items are grouped per source video: each source is downloaded and decoded once and all
+    of its captions are rendered from that single decode, one encoder per caption. Encodes
+    run on a process pool sized to the cores, each encoder limited to its share of the
+    cores, while downloads and uploads run on threads so transfer overlaps with encoding.
+
+    Args:
+        s3: boto3 S3 client
+        bucket_name (str): Bucket holding the source videos and receiving the captioned copies
+        items (Sequence[Tuple[str, str]]): (s3_url, caption) pairs, several captions may share a video
+        font_size (int): Caption font size
+        position (str): Caption position
+        max_workers (Optional[int]): Number of encoder processes (default: OVERLAY_WORKERS)
+        profile (Optional[str]): Encoding profile name (default: encoding.DEFAULT_PROFILE)
+        threads (Optional[int]): Encoder threads per source (default: its share of the cores), for
+            callers running several batches side by side
+
+    Returns:
+        List[Dict[str, Any]]: One result per item, in input order, with the captioned video's
+        "s3_url", its "poster_url" and "preview_url", or an "error" message. A failed item
+        does not abort the rest of the batch.
+    """
+    if not items:
+        return []
+
+    groups: Dict[str, List[int]] = {}
+    for index, (s3_url, _) in enumerate(items):
+        groups.setdefault(s3_url, []).append(index)
+
+    workers = max(1, min(max_workers or OVERLAY_WORKERS, len(groups)))
+    encoder_threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    # one pool size for every batch (processes start on demand), so concurrent batches share it
+    pool = _get_pool(max_workers or OVERLAY_WORKERS)
+    tmp_dir = tempfile.mkdtemp(prefix="overlay_")
+    results = [
+        {"source": s3_url, "caption": caption, "s3_url": None, "poster_url": None, "preview_url": None,
+         "cached": False, "error": None}
+        for s3_url, caption in items
+    ]
+
+    def fail(pending: Dict[str, Dict[str, Any]], error: str):
+        # every caption of the source that was not uploaded yet fails together
+        for render in pending.values():
+            for index in render["indexes"]:
+                if results[index]["s3_url"] is None:
+                    results[index]["error"] = error
+
+    def process(group: int, s3_url: str, indexes: List[int]):
+        # renders still missing, by render key, so a caption repeated for the same video is rendered once
+        pending: Dict[str, Dict[str, Any]] = {}
+        for index in indexes:
+            result = results[index]
+            try:
+                plan = plan_overlay(s3, bucket_name, s3_url, result["caption"], font_size, position, profile)
+            except Exception as e:
+                result["error"] = str(e)
+                continue
+            if plan["cached_url"]:
+                # already rendered, nothing to download or encode
+                result.update(previews.urls(bucket_name, plan["preview_keys"]))
+                result["s3_url"] = plan["cached_url"]
+                result["cached"] = True
+                continue
+            render = pending.setdefault(plan["key"], {"plan": plan, "caption": result["caption"], "indexes": []})
+            render["indexes"].append(index)
+        if not pending:
+            return
+
+        local_input = os.path.join(tmp_dir, f"{group}_input.mp4")
+        variants = []
+        for n, render in enumerate(pending.values()):
+            local_output = os.path.join(tmp_dir, f"{group}_{n}_output.mp4")
+            variants.append({"caption": render["caption"], "output_path": local_output,
+                             "preview_paths": previews.local_paths(local_output)})
+        try:
+            storage.download_file(next(iter(pending.values()))["plan"]["source_key"], local_input,
+                                  bucket=bucket_name, client=s3)
+            # the worker's cores are shared by the encoders of every variant
+            variant_threads = max(1, encoder_threads // len(variants))
+            spans = pool.submit(_render, local_input, variants, font_size, variant_threads, profile, position).result()
+            tracing.import_spans(spans)
+            for render, variant in zip(pending.values(), variants):
+                plan = render["plan"]
+                # previews first, the render's own object is what marks it as cached
+                uploaded = previews.upload(s3, bucket_name, variant["preview_paths"], plan["preview_keys"])
+                storage.upload_file(variant["output_path"], plan["output_key"], bucket=bucket_name,
+                                    metadata=plan["metadata"], client=s3)
+                uploaded["s3_url"] = overlay_url(bucket_name, plan["output_key"])
+                render_cache.remember(plan["key"], uploaded["s3_url"])
+                for index in render["indexes"]:
+                    results[index].update(uploaded)
+        except BrokenProcessPool as e:
+            # a worker died (e.g. killed for memory), start a fresh pool for the next batch
+            fail(pending, f"Encoder process died: {e}")
+            _discard_pool(pool)
+        except Exception as e:
+            fail(pending, str(e))
+        finally:
+            paths = [local_input] + [path for variant in variants
+                                     for path in (variant["output_path"], *variant["preview_paths"].values())]
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    try:
+        # twice as many transfer threads as encoders, so the next download is ready when an encoder frees up
+        with ThreadPoolExecutor(max_workers=workers * 2) as executor:
+            futures = [executor.submit(tracing.wrap(process), group, s3_url, indexes)
+                       for group, (s3_url, indexes) in enumerate(groups.items())]
+            for future in futures:
+                future.result()
+        return results
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
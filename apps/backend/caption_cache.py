@@ -0,0 +1,156 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+CAPTION_CACHE_TTL = float(os.getenv("CAPTION_CACHE_TTL", 3600))
+CAPTION_CACHE_SIZE = int(os.getenv("CAPTION_CACHE_MAX_ENTRIES", 1000))
+# "memory" or "sqlite"
+CAPTION_CACHE_BACKEND = os.getenv("CAPTION_CACHE_BACKEND", "memory")
+CAPTION_CACHE_PATH = os.getenv("CAPTION_CACHE_PATH", "captions_cache.sqlite3")
+
+
+def normalize_prompt(video_type: str) -> str:
+    # prompts differing only in case or spacing share cache entries
+    return " ".join(video_type.lower().split())
+
+
+class MemoryCaptionStore:
+    """In-process LRU store of caption pools."""
+
+    def __init__(self, max_entries: int = CAPTION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[List[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[List[str], float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, captions: List[str], created: float):
+        with self._lock:
+            self._entries[key] = (list(captions), created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCaptionStore:
+    """Caption pools in a local SQLite file, shared by every worker process on the machine."""
+
+    def __init__(self, path: str = CAPTION_CACHE_PATH, max_entries: int = CAPTION_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS captions (
+                key TEXT PRIMARY KEY,
+                captions TEXT NOT NULL,
+                created REAL NOT NULL,
+                used REAL NOT NULL
+            )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS captions_used ON captions (used)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Tuple[List[str], float]]:
+        conn = self._connect()
+        row = conn.execute("SELECT captions, created FROM captions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE captions SET used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, captions: List[str], created: float):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO captions (key, captions, created, used) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(captions), created, time.time()),
+        )
+        # evict the least recently used entries beyond the size bound
+        conn.execute(
+            "DELETE FROM captions WHERE key NOT IN (SELECT key FROM captions ORDER BY used DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def delete(self, key: str):
+        self._connect().execute("DELETE FROM captions WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM captions")
+
+
+class CaptionCache:
+    """
+    TTL cache of generated caption pools per normalized prompt.
+
+    A pool of N captions also answers any request for fewer than N captions,
+    so a 15-caption batch serves later 3-caption requests for the same prompt.
+    """
+
+    def __init__(self, store=None, ttl: float = CAPTION_CACHE_TTL):
+        self.store = store if store is not None else MemoryCaptionStore()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, video_type: str, num_captions: int) -> Optional[List[str]]:
+        key = normalize_prompt(video_type)
+        entry = self.store.get(key)
+        if entry is not None:
+            captions, created = entry
+            if time.time() - created > self.ttl:
+                self.store.delete(key)
+            elif len(captions) >= num_captions:
+                self._count(True)
+                return captions[:num_captions]
+        self._count(False)
+        return None
+
+    def set(self, video_type: str, captions: List[str]):
+        key = normalize_prompt(video_type)
+        entry = self.store.get(key)
+        # keep the larger pool unless it has expired
+        if entry is not None and len(entry[0]) > len(captions) and time.time() - entry[1] <= self.ttl:
+            return
+        self.store.set(key, captions, time.time())
+
+    def info(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+
+def cache_from_env() -> CaptionCache:
+    if CAPTION_CACHE_BACKEND == "sqlite":
+        return CaptionCache(SQLiteCaptionStore(CAPTION_CACHE_PATH))
+    return CaptionCache(MemoryCaptionStore())
@@ -1,14 +1,32 @@
 import openai
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional
 from flask import request, jsonify
 
+import services
+import tracing
+from caption_cache import CaptionCache, cache_from_env, normalize_prompt
+
+# number of caption requests sent to OpenAI at once by generate_captions_batch
+CAPTION_MAX_CONCURRENCY = int(os.getenv("CAPTION_MAX_CONCURRENCY", 4))
+
 class CaptionGenerator:
-    def __init__(self):
+    def __init__(self, cache: Optional[CaptionCache] = None, max_concurrency: int = CAPTION_MAX_CONCURRENCY):
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY environment variable is not set")
         openai.api_key = self.api_key
+        self.cache = cache if cache is not None else cache_from_env()
+        self.max_concurrency = max_concurrency
+
+        # one client for every call, so its connection pool is reused
+        try:
+            # For newer versions of the OpenAI library
+            self.client = openai.OpenAI(api_key=self.api_key)
+        except AttributeError:
+            # For older versions of the OpenAI library
+            self.client = None
 
     def generate_captions(self, video_type: str, num_captions: int = 3) -> List[str]:
         """
@@ -21,6 +39,10 @@ class CaptionGenerator:
         Returns:
             List[str]: List of generated captions
         """
+        cached = self.cache.get(video_type, num_captions)
+        if cached is not None:
+            return cached
+
         prompt = f"""Generate {num_captions} highly engaging TikTok overlay captions for a {video_type} video.
 Keep each caption under 10 words, short, snappy, no hashtags or emojis, and attention-grabbing.
 Use **current TikTok slang, humor, or viral phrases**.
@@ -32,30 +54,34 @@ Use **current TikTok slang, humor, or viral phrases**.
         """
 
         try:
-            # Use the appropriate OpenAI client based on the installed version
-            try:
-                # For newer versions of the OpenAI library
-                client = openai.OpenAI()
-                response = client.chat.completions.create(
-                    model="gpt-4-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a creative assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7
-                )
-                captions_text = response.choices[0].message.content.strip()
-            except AttributeError:
-                # For older versions of the OpenAI library
-                response = openai.ChatCompletion.create(
-                    model="gpt-4-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a creative assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7
-                )
-                captions_text = response['choices'][0]['message']['content'].strip()
+            with tracing.span("openai.chat", model="gpt-4-turbo", captions=num_captions) as span:
+                # queued behind this key's rate limit, throttled calls are retried after Retry-After
+                limiter = services.get_rate_limiter()
+                # Use the appropriate OpenAI client based on the installed version
+                if self.client is not None:
+                    response = limiter.call(
+                        "openai", self.api_key, self.client.chat.completions.create,
+                        model="gpt-4-turbo",
+                        messages=[
+                            {"role": "system", "content": "You are a creative assistant."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=0.7
+                    )
+                    captions_text = response.choices[0].message.content.strip()
+                    if getattr(response, "usage", None) is not None:
+                        span.set(tokens=response.usage.total_tokens)
+                else:
+                    response = limiter.call(
+                        "openai", self.api_key, openai.ChatCompletion.create,
+                        model="gpt-4-turbo",
+                        messages=[
+                            {"role": "system", "content": "You are a creative assistant."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=0.7
+                    )
+                    captions_text = response['choices'][0]['message']['content'].strip()
 
             # Split by newlines and clean up numbering
             captions = [
@@ -64,6 +90,7 @@ Use **current TikTok slang, humor, or viral phrases**.
                 if line.strip()
             ]
 
+            self.cache.set(video_type, captions)
             return captions
 
         except Exception as e:
@@ -104,3 +131,30 @@ Use **current TikTok slang, humor, or viral phrases**.
             raise ValueError("Prompt is required")
         
         return self.generate_captions(prompt, num_captions)
+
+    def generate_captions_batch(self, video_types: List[str], num_captions: int = 3) -> List[List[str]]:
+        """
+        Generate captions for many prompts at once.
+
+        Prompts are deduplicated after normalization and the remaining requests run
+        with at most max_concurrency in flight; cached prompts make no request at all.
+
+        Args:
+            video_types (List[str]): Types of video to generate captions for
+            num_captions (int): Number of captions per prompt (default: 3)
+
+        Returns:
+            List[List[str]]: Captions for each prompt, in input order
+        """
+        unique = {}
+        for video_type in video_types:
+            unique.setdefault(normalize_prompt(video_type), video_type)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(unique)))) as executor:
+            futures = {
+                key: executor.submit(tracing.wrap(self.generate_captions), video_type, num_captions)
+                for key, video_type in unique.items()
+            }
+            results = {key: future.result() for key, future in futures.items()}
+
+        return [results[normalize_prompt(video_type)] for video_type in video_types]
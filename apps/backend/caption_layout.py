@@ -0,0 +1,261 @@
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from PIL import ImageFont
+
+# smallest font a caption is shrunk to before its lines are cut short
+CAPTION_MIN_FONT_SIZE = int(os.getenv("CAPTION_MIN_FONT_SIZE", 36))
+
+# margins kept free of captions, as fractions of the frame (left, top, right, bottom); vertical frames
+# keep clear of the TikTok/Reels interface: the header on top, buttons on the right, description below
+SAFE_AREAS: Dict[str, Tuple[float, float, float, float]] = {
+    "vertical": (0.06, 0.08, 0.12, 0.23),
+    "landscape": (0.05, 0.05, 0.05, 0.05),
+}
+
+POSITIONS = ("center", "top", "bottom")
+
+# glyph advances are measured once at this size and scaled, fonts are checked at the final size
+REFERENCE_SIZE = 256
+
+ELLIPSIS = "…"
+# Pillow's bitmap font only encodes latin-1
+ASCII_ELLIPSIS = "..."
+
+
+@lru_cache(maxsize=32)
+def load_font(font_name, font_size):
+    # load font (will be default Arial), parsing the truetype file only once per size;
+    # Pillow's fixed-size bitmap font stands in when it is not installed
+    try:
+        return ImageFont.truetype(font_name, font_size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+class FontMetrics:
+    """
+    Glyph advances and line height of one font, measured once per glyph at REFERENCE_SIZE.
+
+    Widths at other sizes are scaled from the reference, which ignores kerning and hinting;
+    layouts check their final lines against the real font.
+    """
+
+    def __init__(self, font_name: str):
+        self.font_name = font_name
+        self.font = load_font(font_name, REFERENCE_SIZE)
+        # bitmap fonts come in one size only
+        self.scalable = isinstance(self.font, ImageFont.FreeTypeFont)
+        if self.scalable:
+            ascent, descent = self.font.getmetrics()
+            self.line_height = ascent + descent
+        else:
+            self.line_height = self.font.getbbox("Ag")[3] + 1
+        self.ellipsis = ELLIPSIS if self.scalable else ASCII_ELLIPSIS
+        self._advances: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def advance(self, char: str) -> float:
+        width = self._advances.get(char)
+        if width is None:
+            width = self.font.getlength(char)
+            with self._lock:
+                self._advances[char] = width
+        return width
+
+    def width(self, text: str) -> float:
+        # width of text at REFERENCE_SIZE (for bitmap fonts, at their only size)
+        return sum(self.advance(char) for char in text)
+
+    def scale(self, font_size: int) -> float:
+        return font_size / REFERENCE_SIZE if self.scalable else 1.0
+
+    def font_at(self, font_size: int):
+        return load_font(self.font_name, font_size) if self.scalable else self.font
+
+
+@lru_cache(maxsize=16)
+def get_metrics(font_name: str) -> FontMetrics:
+    return FontMetrics(font_name)
+
+
+def safe_area(size: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    """Box (left, top, right, bottom) of the frame captions are kept in."""
+    width, height = size
+    left, top, right, bottom = SAFE_AREAS["vertical" if height > width else "landscape"]
+    return (int(round(width * left)), int(round(height * top)),
+            width - int(round(width * right)), height - int(round(height * bottom)))
+
+
+def wrap(widths: Sequence[float], space: float, max_width: float) -> List[List[int]]:
+    # greedy line breaking on measured widths: word indexes per line, a word wider than max_width gets a line alone
+    lines: List[List[int]] = []
+    line_width = 0.0
+    for i, width in enumerate(widths):
+        if lines and lines[-1] and line_width + space + width <= max_width:
+            lines[-1].append(i)
+            line_width += space + width
+        else:
+            lines.append([i])
+            line_width = width
+    return lines
+
+
+def _balance(words_widths: Sequence[float], space: float, max_width: float, line_count: int) -> float:
+    # narrowest width that still needs no more lines, so the last line is not left with one word
+    low = max(words_widths)
+    high = max_width
+    for _ in range(12):
+        if high - low < 1.0:
+            break
+        middle = (low + high) / 2
+        if len(wrap(words_widths, space, middle)) <= line_count:
+            high = middle
+        else:
+            low = middle
+    return high
+
+
+def _split_word(word: str, metrics: FontMetrics, max_width: float) -> List[str]:
+    # a word that does not fit on a line even at the smallest size is broken between characters
+    pieces, piece, width = [], "", 0.0
+    for char in word:
+        advance = metrics.advance(char)
+        if piece and width + advance > max_width:
+            pieces.append(piece)
+            piece, width = "", 0.0
+        piece += char
+        width += advance
+    return pieces + [piece] if piece else pieces
+
+
+def layout_caption(text: str, size: Tuple[int, int], max_font_size: int = 100, font_name: str = "Arial",
+                   position: str = "center", pad: int = 0, min_font_size: int = CAPTION_MIN_FONT_SIZE,
+                   metrics: Optional[FontMetrics] = None) -> Dict[str, Any]:
+    """
+    Fit a caption into the safe area of a frame.
+
+    The font is the largest size up to max_font_size at which the caption, wrapped on
+    measured word widths, fits the safe area; the lines are then balanced to even lengths.
+    Below min_font_size the caption is wrapped at min_font_size, words too long for a line
+    are broken and lines that do not fit are dropped, the last one ending in an ellipsis.
+
+    Args:
+        size (Tuple[int, int]): Frame (width, height)
+        position (str): Where the block sits in the safe area, one of POSITIONS
+        pad (int): Extra pixels around every line (e.g. the outline width)
+
+    Returns:
+        Dict[str, Any]: "lines" (text per line), "widths" (pixels per line), "font_size",
+        "line_height", "box" (left, top, width, height of the block in the frame) and
+        "fits" (False if the caption had to be cut)
+    """
+    if position not in POSITIONS:
+        position = "center"
+    metrics = metrics or get_metrics(font_name)
+    area_left, area_top, area_right, area_bottom = safe_area(size)
+    area_width = max(1, area_right - area_left - 2 * pad)
+    area_height = max(1, area_bottom - area_top - 2 * pad)
+
+    words = text.split()
+    widths = [metrics.width(word) for word in words]
+    space = metrics.advance(" ")
+    max_font_size = max(1, max_font_size)
+    min_font_size = max(1, min(min_font_size, max_font_size))
+
+    def fits(font_size: int) -> bool:
+        scale = metrics.scale(font_size)
+        max_width = area_width / scale
+        if widths and max(widths) > max_width:
+            return False
+        return len(wrap(widths, space, max_width)) * metrics.line_height * scale <= area_height
+
+    if not metrics.scalable:
+        font_size = max_font_size
+    elif fits(max_font_size):
+        font_size = max_font_size
+    else:
+        # largest fitting size, fits() only turns false as the font grows
+        low, high = min_font_size, max_font_size
+        while low < high:
+            middle = (low + high + 1) // 2
+            if fits(middle):
+                low = middle
+            else:
+                high = middle - 1
+        font_size = low
+
+    font = metrics.font_at(font_size)
+    while True:
+        scale = metrics.scale(font_size)
+        max_width = area_width / scale
+        max_lines = max(1, int(area_height // (metrics.line_height * scale)))
+        line_words, line_widths = list(words), list(widths)
+        if line_widths and max(line_widths) > max_width:
+            line_words = [piece for word in words for piece in _split_word(word, metrics, max_width)]
+            line_widths = [metrics.width(word) for word in line_words]
+        breaks = wrap(line_widths, space, max_width) if line_words else []
+        if 1 < len(breaks) <= max_lines:
+            breaks = wrap(line_widths, space, _balance(line_widths, space, max_width, len(breaks)))
+        lines = [" ".join(line_words[i] for i in line) for line in breaks]
+        complete = len(lines) <= max_lines
+        if not complete:
+            lines = lines[:max_lines]
+            while lines[-1] and font.getlength(lines[-1] + metrics.ellipsis) > area_width:
+                lines[-1] = lines[-1][:-1].rstrip()
+            lines[-1] += metrics.ellipsis
+        # the estimate ignores kerning and hinting, the real widths decide
+        real_widths = [font.getlength(line) for line in lines]
+        if not real_widths or max(real_widths) <= area_width or font_size <= min_font_size or not metrics.scalable:
+            break
+        font_size -= 1
+        font = metrics.font_at(font_size)
+
+    line_height = int(round(metrics.line_height * metrics.scale(font_size)))
+    block_width = int(max(real_widths, default=0)) + 2 * pad
+    block_height = line_height * len(lines) + 2 * pad
+    left = area_left + (area_right - area_left - block_width) // 2
+    if position == "top":
+        top = area_top
+    elif position == "bottom":
+        top = area_bottom - block_height
+    else:
+        top = area_top + (area_bottom - area_top - block_height) // 2
+    return {
+        "lines": lines,
+        "widths": [int(round(width)) for width in real_widths],
+        "font_size": font_size,
+        "line_height": line_height,
+        "box": (left, top, block_width, block_height),
+        "fits": complete and (not real_widths or max(real_widths) <= area_width),
+    }
+
+
+def layout_captions(texts: Sequence[str], size: Tuple[int, int], max_font_size: int = 100, font_name: str = "Arial",
+                    position: str = "center", pad: int = 0,
+                    min_font_size: int = CAPTION_MIN_FONT_SIZE) -> List[Dict[str, Any]]:
+    """
+    Lay out a batch of captions for one frame size.
+
+    The font's glyph advances are shared by the whole batch and repeated captions are laid
+    out once, so a layout costs microseconds once the glyphs have been measured.
+    """
+    metrics = get_metrics(font_name)
+    layouts: Dict[str, Dict[str, Any]] = {}
+    for text in texts:
+        if text not in layouts:
+            layouts[text] = layout_caption(text, size, max_font_size, font_name, position, pad, min_font_size,
+                                           metrics=metrics)
+    return [layouts[text] for text in texts]
+
+
+def cache_clear():
+    get_metrics.cache_clear()
+    load_font.cache_clear()
+
+
+def cache_info() -> Dict[str, Any]:
+    return {"fonts": load_font.cache_info()._asdict(), "metrics": get_metrics.cache_info()._asdict()}
+
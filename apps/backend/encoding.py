@@ -0,0 +1,116 @@
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# named encoder settings, selectable per request
+#   preset/crf:  x264 speed versus size/quality trade-off
+#   max_height:  outputs taller than this are scaled down (low-resolution proxies), None keeps the source size
+#   faststart:   move the MP4 index to the front so players can start before the download ends
+#   audio:       "copy" passes the source audio through untouched, "aac" re-encodes it, "none" drops it
+#   threads:     encoder threads, None leaves it to the caller (its share of the cores)
+PROFILES: Dict[str, Dict[str, Any]] = {
+    # quickest possible render, for checking timing and layout
+    "draft": {
+        "codec": "libx264", "preset": "ultrafast", "crf": 32, "pix_fmt": "yuv420p",
+        "max_height": 480, "faststart": True, "audio": "copy", "threads": None,
+    },
+    # dashboard gallery proxies, a fraction of the publish render time
+    "preview": {
+        "codec": "libx264", "preset": "veryfast", "crf": 28, "pix_fmt": "yuv420p",
+        "max_height": 720, "faststart": True, "audio": "copy", "threads": None,
+    },
+    # full resolution render of the variant that is actually posted
+    "publish": {
+        "codec": "libx264", "preset": "medium", "crf": 23, "pix_fmt": "yuv420p",
+        "max_height": None, "faststart": True, "audio": "copy", "threads": None,
+    },
+}
+
+DEFAULT_PROFILE = os.getenv("ENCODING_PROFILE", "publish")
+
+
+def get_profile(profile=None) -> Dict[str, Any]:
+    """
+    Resolve a profile name (or an already resolved profile) to its settings.
+
+    Raises:
+        ValueError: If the name is not one of PROFILES
+    """
+    if isinstance(profile, dict):
+        return profile
+    name = profile or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown encoding profile '{name}', expected one of {tuple(PROFILES)}")
+    return dict(PROFILES[name], name=name)
+
+
+def scaled_size(size: Sequence[int], profile) -> Tuple[int, int]:
+    # output size for a source of the given size, keeping the aspect ratio and even dimensions
+    profile = get_profile(profile)
+    width, height = size
+    max_height = profile["max_height"]
+    if not max_height or height <= max_height:
+        return width, height
+    # rounded half up like ffmpeg's scale=-2, so every backend produces the same size
+    return int(width * max_height / height / 2 + 0.5) * 2, max_height
+
+
+def scale_filter(profile) -> Optional[str]:
+    # ffmpeg filter that scales an output down to the profile's height (never up)
+    max_height = get_profile(profile)["max_height"]
+    if not max_height:
+        return None
+    return f"scale=-2:'min(ih,{max_height})'"
+
+
+def _has_movflags(params: Sequence[str]) -> bool:
+    # streamed outputs bring their own fragmented-MP4 flags, which rule out faststart
+    return "-movflags" in params
+
+
+def video_args(profile, threads: Optional[int] = None, extra: Sequence[str] = ()) -> List[str]:
+    """
+    ffmpeg output options for the video stream (codec, preset, CRF, pixel format, threads, faststart).
+
+    Args:
+        threads (Optional[int]): Encoder threads if the profile does not set them
+        extra (Sequence[str]): Caller output options, e.g. s3_stream.FRAGMENTED_MP4_PARAMS
+    """
+    profile = get_profile(profile)
+    args = ["-c:v", profile["codec"], "-preset", profile["preset"], "-crf", str(profile["crf"]),
+            "-pix_fmt", profile["pix_fmt"]]
+    threads = profile["threads"] if profile["threads"] is not None else threads
+    if threads is not None:
+        args += ["-threads", str(threads)]
+    if profile["faststart"] and not _has_movflags(extra):
+        args += ["-movflags", "+faststart"]
+    return args + list(extra)
+
+
+def audio_args(profile) -> List[str]:
+    audio = get_profile(profile)["audio"]
+    if audio == "none":
+        return ["-an"]
+    if audio == "aac":
+        return ["-c:a", "aac", "-b:a", "128k"]
+    return ["-c:a", "copy"]
+
+
+def moviepy_params(profile, extra: Sequence[str] = (), scale: bool = True) -> List[str]:
+    """
+    ffmpeg_params for moviepy writers, which set the codec, preset and threads themselves.
+
+    With scale the output is scaled down to the profile's height while encoding.
+    """
+    profile = get_profile(profile)
+    params = ["-crf", str(profile["crf"]), "-pix_fmt", profile["pix_fmt"]]
+    if scale and scale_filter(profile):
+        params += ["-vf", scale_filter(profile)]
+    if profile["faststart"] and not _has_movflags(extra):
+        params += ["-movflags", "+faststart"]
+    return params + list(extra)
+
+
+def cache_settings(profile) -> Dict[str, Any]:
+    # the settings that change the rendered bytes, for content-addressed cache keys
+    profile = get_profile(profile)
+    return {key: profile[key] for key in ("codec", "preset", "crf", "pix_fmt", "max_height", "audio")}
@@ -0,0 +1,228 @@
+import os
+import re
+import subprocess
+import tempfile
+
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+from PIL import Image
+
+import encoding
+import previews
+
+# render backends accepted by add_caption_to_video and stitch_videos
+BACKENDS = ('moviepy', 'ffmpeg')
+
+_VIDEO_STREAM = re.compile(r"Stream #\d+:\d+.*?: Video: (?P<codec>\w+)(?: \((?P<profile>[^)]*)\))?.*?, (?P<pix_fmt>\w+)(?:\([^)]*\))?, (?P<width>\d+)x(?P<height>\d+)")
+_AUDIO_STREAM = re.compile(r"Stream #\d+:\d+.*?: Audio: (?P<codec>\w+)(?: \((?P<profile>[^)]*)\))?.*?, (?P<sample_rate>\d+) Hz, (?P<channels>[\w.()]+)")
+_FPS = re.compile(r"([\d.]+) fps")
+_TBN = re.compile(r"([\d.]+k?) tbn")
+
+
+def ffmpeg_binary():
+    return get_setting("FFMPEG_BINARY")
+
+
+def run_ffmpeg(args):
+    # run ffmpeg quietly, surfacing its stderr if it fails
+    cmd = [ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error"] + list(args)
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {result.stderr.decode(errors='replace').strip()}")
+
+
+def probe(path):
+    """
+    Read the stream parameters of a media file without decoding it.
+
+    Returns:
+        dict: duration, size, fps and the codec parameters that decide whether clips can be stream-copied together
+    """
+    infos = ffmpeg_parse_infos(path)
+    result = subprocess.run([ffmpeg_binary(), "-hide_banner", "-i", path],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = result.stderr.decode(errors="replace")
+
+    video = None
+    audio = None
+    for line in stderr.splitlines():
+        if video is None and (match := _VIDEO_STREAM.search(line)):
+            fps = _FPS.search(line)
+            tbn = _TBN.search(line)
+            video = {
+                "codec": match["codec"],
+                "profile": match["profile"],
+                "pix_fmt": match["pix_fmt"],
+                "size": (int(match["width"]), int(match["height"])),
+                "fps": fps.group(1) if fps else None,
+                "tbn": tbn.group(1) if tbn else None,
+            }
+        elif audio is None and (match := _AUDIO_STREAM.search(line)):
+            audio = {
+                "codec": match["codec"],
+                "profile": match["profile"],
+                "sample_rate": int(match["sample_rate"]),
+                "channels": match["channels"],
+            }
+
+    return {
+        "duration": infos["duration"],
+        "size": tuple(infos["video_size"]) if infos.get("video_found") else None,
+        "fps": infos.get("video_fps"),
+        "video": video,
+        "audio": audio,
+    }
+
+
+def has_audio(path):
+    return bool(ffmpeg_parse_infos(path).get("audio_found"))
+
+
+def can_stream_copy(probes):
+    # the concat demuxer can only copy streams whose codec parameters are identical
+    first = probes[0]
+    if first["video"] is None:
+        return False
+    return all(p["video"] == first["video"] and p["audio"] == first["audio"] for p in probes[1:])
+
+
+def write_sprite_png(sprite, path):
+    Image.fromarray(sprite, "RGBA").save(path)
+    return path
+
+
+def overlay_caption(video_path, output_path, sprite, offset, fade_duration=0.5,
+                    profile=None, threads=None, output_params=None, preview_paths=None):
+    """
+    Overlay a pre-rendered caption sprite with fade in/out in a single ffmpeg filter graph.
+
+    Args:
+        sprite (np.ndarray): RGBA caption sprite, as returned by create_caption_sprite
+        offset (tuple): (x, y) position of the sprite inside the frame
+        profile: Encoding profile name or settings (see encoding.PROFILES)
+        preview_paths (dict): Optional {"poster": path, "preview": path}, written from the same decode as the render
+    """
+    overlay_captions(video_path, [{"output_path": output_path, "sprite": sprite, "offset": offset,
+                                   "preview_paths": preview_paths}],
+                     fade_duration, profile=profile, threads=threads, output_params=output_params)
+    return output_path
+
+
+def overlay_captions(video_path, outputs, fade_duration=0.5, profile=None, threads=None, output_params=None):
+    """
+    Overlay several caption sprites onto one video, one output each, from a single decode.
+
+    The decoded source is split inside the filter graph, so every variant costs an encode
+    but not another read of the source.
+
+    Args:
+        outputs (list): One dict per variant with "output_path", "sprite", "offset" and
+            optional "preview_paths" (see overlay_caption)
+        threads (int): Encoder threads per output
+    """
+    info = probe(video_path)
+    duration = info["duration"]
+    fps = info["fps"] or 24
+
+    caption_filter = "format=rgba"
+    if fade_duration > 0:
+        fade_out_start = max(duration - fade_duration, 0)
+        caption_filter += (f",fade=t=in:st=0:d={fade_duration}:alpha=1"
+                           f",fade=t=out:st={fade_out_start}:d={fade_duration}:alpha=1")
+
+    scale = encoding.scale_filter(profile)
+    graph = []
+    if len(outputs) > 1:
+        graph.append(f"[0:v]split={len(outputs)}" + "".join(f"[src{k}]" for k in range(len(outputs))))
+    tail_args = []
+    # sprite inputs follow the source; an empty caption (0x0 sprite) has none and its branch only copies the frames
+    captioned = [output for output in outputs if output["sprite"].size]
+    inputs = 0
+    for k, output in enumerate(outputs):
+        x, y = output["offset"]
+        source = f"src{k}" if len(outputs) > 1 else "0:v"
+        if output["sprite"].size:
+            # proxies are scaled after the overlay, so the caption keeps its place in the frame
+            inputs += 1
+            branch = (f"[{inputs}:v]{caption_filter}[cap{k}];"
+                      f"[{source}][cap{k}]overlay={x}:{y}:shortest=1:format=auto" + (f",{scale}" if scale else ""))
+        else:
+            branch = f"[{source}]{scale or 'null'}"
+        preview_paths = output.get("preview_paths")
+        if preview_paths:
+            # the captioned stream is split, the poster and preview clip come out of the same filter graph
+            branch += f"[out{k}];{previews.ffmpeg_graph(f'out{k}', duration, str(k))}"
+        else:
+            branch += f"[v{k}]"
+        graph.append(branch)
+
+        tail_args += ["-map", f"[v{k}]", "-map", "0:a?"] + encoding.audio_args(profile)
+        tail_args += encoding.video_args(profile, threads, output_params or []) + [output["output_path"]]
+        if preview_paths:
+            tail_args += previews.ffmpeg_outputs(preview_paths["poster"], preview_paths["preview"], str(k))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        args = ["-i", video_path]
+        for k, output in enumerate(captioned):
+            sprite_path = write_sprite_png(output["sprite"], os.path.join(tmp, f"caption_{k}.png"))
+            args += ["-loop", "1", "-framerate", str(fps), "-t", str(duration), "-i", sprite_path]
+        run_ffmpeg(args + ["-filter_complex", ";".join(graph)] + tail_args)
+
+    return [output["output_path"] for output in outputs]
+
+
+def concat_videos(paths, output_path, max_duration=None, profile=None, threads=None):
+    """
+    Concatenate clips into one video, trimmed to max_duration seconds.
+
+    Clips with identical codec parameters are joined with the concat demuxer and stream copy
+    (no decoding at all) unless the profile scales them down; otherwise a concat filter graph
+    scales every clip to the first clip's size (or the profile's proxy size) and frame rate and
+    fills missing audio with silence.
+    """
+    probes = [probe(path) for path in paths]
+    trim = ["-t", str(max_duration)] if max_duration else []
+    width, height = encoding.scaled_size(probes[0]["size"], profile)
+    keep_audio = encoding.get_profile(profile)["audio"] != "none"
+
+    if can_stream_copy(probes) and (width, height) == probes[0]["size"]:
+        with tempfile.TemporaryDirectory() as tmp:
+            list_path = os.path.join(tmp, "concat.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                for path in paths:
+                    escaped = os.path.abspath(path).replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+            run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy"]
+                       + ([] if keep_audio else ["-an"]) + trim + ["-movflags", "+faststart", output_path])
+        return output_path
+
+    fps = probes[0]["fps"] or 24
+    with_audio = keep_audio and any(p["audio"] is not None for p in probes)
+
+    inputs = []
+    filters = []
+    segments = []
+    for i, (path, info) in enumerate(zip(paths, probes)):
+        inputs += ["-i", path]
+        filters.append(
+            f"[{i}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps},format=yuv420p[v{i}]"
+        )
+        segments.append(f"[v{i}]")
+        if with_audio:
+            if info["audio"] is not None:
+                filters.append(f"[{i}:a]aformat=sample_rates=44100:channel_layouts=stereo[a{i}]")
+            else:
+                # silent track so every segment has audio for the concat filter
+                filters.append(f"anullsrc=r=44100:cl=stereo,atrim=duration={info['duration']}[a{i}]")
+            segments.append(f"[a{i}]")
+
+    filters.append(f"{''.join(segments)}concat=n={len(paths)}:v=1:a={1 if with_audio else 0}"
+                   + ("[v][a]" if with_audio else "[v]"))
+
+    args = inputs + ["-filter_complex", ";".join(filters), "-map", "[v]"]
+    if with_audio:
+        # the concat filter decodes the audio, so it is always re-encoded here
+        args += ["-map", "[a]", "-c:a", "aac"]
+    run_ffmpeg(args + encoding.video_args(profile, threads) + trim + [output_path])
+    return output_path
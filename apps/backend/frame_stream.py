@@ -0,0 +1,257 @@
+import os
+import resource
+import subprocess
+import tempfile
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from moviepy.video.io.ffmpeg_reader import FFMPEG_VideoReader, ffmpeg_parse_infos
+
+import encoding
+import ffmpeg_backend
+
+# decoded frames buffered between the reader and the encoder of a streamed stitch
+STITCH_RING_FRAMES = int(os.getenv("STITCH_RING_FRAMES", 8))
+# resident memory a stitch worker may use, in MB; 0 means no ceiling
+STITCH_MEMORY_LIMIT_MB = int(os.getenv("STITCH_MEMORY_LIMIT_MB", 0))
+
+# frames a reader holds besides the ring (its read buffer, the decoded array and the centered copy)
+READER_FRAMES = 3
+# resident memory is checked once every this many frames
+MEMORY_CHECK_EVERY = 24
+
+
+def rss_bytes() -> int:
+    # current resident set size of this process
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # no /proc: fall back to the peak, which is never below the current size
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def ring_slots(frame_bytes: int, memory_limit_mb: Optional[int] = None, max_slots: int = STITCH_RING_FRAMES) -> int:
+    """
+    Number of ring slots for frames of frame_bytes, within the worker's memory ceiling.
+
+    Raises:
+        MemoryError: If not even two frames fit under the ceiling
+    """
+    memory_limit_mb = STITCH_MEMORY_LIMIT_MB if memory_limit_mb is None else memory_limit_mb
+    max_slots = max(2, max_slots)
+    if not memory_limit_mb:
+        return max_slots
+    available = memory_limit_mb * 1024 * 1024 - rss_bytes() - READER_FRAMES * frame_bytes
+    slots = min(max_slots, available // frame_bytes)
+    if slots < 2:
+        raise MemoryError(f"Stitch needs {(2 + READER_FRAMES) * frame_bytes / 2**20:.0f} MB for frames on top of "
+                          f"{rss_bytes() / 2**20:.0f} MB in use, over the {memory_limit_mb} MB ceiling")
+    return int(slots)
+
+
+class FrameRing:
+    """
+    Fixed set of preallocated frame slots between one producer and one consumer thread.
+
+    The producer claim()s a free slot, fills frames[slot] and publish()es it; the consumer
+    takes next() slots in order and release()s them once written. Nothing is allocated per
+    frame, so the buffered frames never take more than slots * frame size.
+    """
+
+    def __init__(self, slots: int, size: Sequence[int]):
+        width, height = size
+        self.frames = np.zeros((slots, height, width, 3), dtype=np.uint8)
+        self.slots = slots
+        self._free = threading.Semaphore(slots)
+        self._filled = threading.Semaphore(0)
+        self._head = 0
+        self._tail = 0
+        self._done = False
+        self._cancelled = False
+        self.error: Optional[BaseException] = None
+
+    def claim(self) -> Optional[int]:
+        # index of the next free slot, or None once the consumer has given up
+        self._free.acquire()
+        if self._cancelled:
+            return None
+        return self._head % self.slots
+
+    def publish(self):
+        self._head += 1
+        self._filled.release()
+
+    def finish(self, error: Optional[BaseException] = None):
+        # no more frames; the consumer raises error once it has taken the frames before it
+        self.error = error
+        self._done = True
+        self._filled.release()
+
+    def next(self) -> Optional[int]:
+        # index of the next filled slot, or None at the end of the stream
+        self._filled.acquire()
+        if self._tail == self._head and self._done:
+            if self.error is not None:
+                raise self.error
+            return None
+        return self._tail % self.slots
+
+    def release(self):
+        self._tail += 1
+        self._free.release()
+
+    def cancel(self):
+        # stop the producer, e.g. because the encoder failed
+        self._cancelled = True
+        self._free.release()
+
+
+def plan_segments(paths: Sequence[str], max_duration: Optional[float] = None) -> List[dict]:
+    """
+    Stream parameters and play time of every source, trimmed so the sum stays within max_duration.
+
+    Only reads the file headers; the first source is always kept whole up to max_duration,
+    like the moviepy stitch.
+    """
+    segments = []
+    start = 0.0
+    for path in paths:
+        infos = ffmpeg_parse_infos(path)
+        duration = infos["duration"]
+        if max_duration:
+            duration = min(duration, max_duration - start)
+            if duration <= 0:
+                break
+        segments.append({
+            "path": path,
+            "start": start,
+            "duration": duration,
+            "size": tuple(infos["video_size"]),
+            "fps": infos["video_fps"],
+            "audio": infos["audio_found"],
+        })
+        start += duration
+    return segments
+
+
+def _encoder_args(segments, size, fps, output_path, profile, threads) -> List[str]:
+    # raw frames on stdin; the audio is read by the encoder itself, straight from the sources
+    width, height = size
+    with_audio = encoding.get_profile(profile)["audio"] != "none" and any(s["audio"] for s in segments)
+
+    args = ["-f", "rawvideo", "-vcodec", "rawvideo", "-s", f"{width}x{height}", "-pix_fmt", "rgb24",
+            "-r", f"{fps:.02f}", "-i", "-"]
+    if with_audio:
+        filters = []
+        labels = []
+        inputs = 1
+        for i, segment in enumerate(segments):
+            if segment["audio"]:
+                # audio only (-vn), so the source's video is never decoded twice
+                args += ["-vn", "-t", str(segment["duration"]), "-i", segment["path"]]
+                # padded, so a short audio track does not pull the following segments out of sync
+                filters.append(f"[{inputs}:a]aformat=sample_rates=44100:channel_layouts=stereo,apad,"
+                               f"atrim=duration={segment['duration']}[a{i}]")
+                inputs += 1
+            else:
+                filters.append(f"anullsrc=r=44100:cl=stereo,atrim=duration={segment['duration']}[a{i}]")
+            labels.append(f"[a{i}]")
+        filters.append(f"{''.join(labels)}concat=n={len(segments)}:v=0:a=1[a]")
+        args += ["-filter_complex", ";".join(filters), "-map", "0:v", "-map", "[a]", "-c:a", "aac"]
+    else:
+        args += ["-an"]
+    if encoding.scale_filter(profile):
+        args += ["-vf", encoding.scale_filter(profile)]
+    return args + encoding.video_args(profile, threads) + [output_path]
+
+
+def _read_frames(segments, ring: FrameRing, size: Tuple[int, int], fps: float):
+    # decode the segments one after another into the ring; each source is closed as soon as its part is read
+    width, height = size
+    index = 0
+    try:
+        for segment in segments:
+            reader = FFMPEG_VideoReader(segment["path"])
+            try:
+                w, h = reader.size
+                # centered on the canvas, like concatenate_videoclips(method="compose")
+                x, y = (width - w) // 2, (height - h) // 2
+                end = segment["start"] + segment["duration"]
+                while index / fps < end:
+                    slot = ring.claim()
+                    if slot is None:
+                        return
+                    frame = reader.get_frame(index / fps - segment["start"])
+                    target = ring.frames[slot]
+                    if (w, h) != (width, height):
+                        target[:] = 0
+                    target[y:y + h, x:x + w] = frame
+                    ring.publish()
+                    index += 1
+            finally:
+                reader.close()
+        ring.finish()
+    except BaseException as e:
+        ring.finish(e)
+
+
+def _ffmpeg_error(encoder, log) -> RuntimeError:
+    log.seek(0)
+    return RuntimeError(f"ffmpeg failed ({encoder.returncode}): {log.read().decode(errors='replace').strip()}")
+
+
+def stream_concat(paths, output_path, max_duration=None, profile=None, threads=None, memory_limit_mb=None):
+    """
+    Concatenate clips into one video, streaming decoded frames through a fixed-size ring into the encoder.
+
+    Only one source is decoded at a time, and it is closed as soon as its part has been read,
+    so memory and ffmpeg processes stay flat however many and however long the clips are.
+    Clips are centered on a canvas of the largest clip size at the highest frame rate, like
+    the moviepy stitch, and trimmed so the whole video lasts at most max_duration seconds.
+
+    Args:
+        memory_limit_mb (Optional[int]): Resident memory ceiling of this worker (default STITCH_MEMORY_LIMIT_MB, 0 for none)
+
+    Raises:
+        MemoryError: If the frames do not fit under the ceiling, or the worker goes over it while encoding
+    """
+    memory_limit_mb = STITCH_MEMORY_LIMIT_MB if memory_limit_mb is None else memory_limit_mb
+    segments = plan_segments(paths, max_duration)
+    size = (max(s["size"][0] for s in segments), max(s["size"][1] for s in segments))
+    fps = max(s["fps"] for s in segments)
+    ring = FrameRing(ring_slots(size[0] * size[1] * 3, memory_limit_mb), size)
+    reader = threading.Thread(target=_read_frames, args=(segments, ring, size, fps),
+                              name=f"read-{os.path.basename(str(output_path))}", daemon=True)
+
+    cmd = [ffmpeg_backend.ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error"]
+    cmd += _encoder_args(segments, size, fps, output_path, profile, threads)
+    with tempfile.TemporaryFile() as log:
+        encoder = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log)
+        reader.start()
+        frames = 0
+        try:
+            while (slot := ring.next()) is not None:
+                encoder.stdin.write(ring.frames[slot].data)
+                ring.release()
+                frames += 1
+                if memory_limit_mb and frames % MEMORY_CHECK_EVERY == 0 and rss_bytes() > memory_limit_mb * 2**20:
+                    raise MemoryError(f"Stitch worker went over its {memory_limit_mb} MB memory ceiling")
+            encoder.stdin.close()
+            encoder.wait()
+        except BrokenPipeError:
+            # the encoder exited early, its log says why
+            ring.cancel()
+            encoder.wait()
+            raise _ffmpeg_error(encoder, log)
+        except BaseException:
+            ring.cancel()
+            encoder.kill()
+            encoder.wait()
+            raise
+        finally:
+            reader.join()
+        if encoder.returncode != 0:
+            raise _ffmpeg_error(encoder, log)
+    return output_path
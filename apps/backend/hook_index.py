@@ -0,0 +1,78 @@
+from typing import Any, Dict, Iterable, List
+
+import tracing
+
+
+class HookIndex:
+    """
+    Lookup of already generated hooks, keyed on (image content hash, prompt, model).
+
+    Backed by the Prisma Video table and its @@unique([image_hash, prompt, model]) index.
+    """
+
+    def __init__(self, prisma):
+        self.prisma = prisma
+
+    def lookup(self, prompt: str, model: str, image_hashes: Iterable[str]) -> Dict[str, Any]:
+        # one query for the whole batch, returns {image_hash: Video}
+        hashes = list(dict.fromkeys(image_hashes))
+        if not hashes:
+            return {}
+        with tracing.span("prisma.video.find_many", hashes=len(hashes)):
+            rows = self.prisma.video.find_many(
+                where={'prompt': prompt, 'model': model, 'image_hash': {'in': hashes}}
+            )
+        return {row.image_hash: row for row in rows}
+
+    def record_many(self, hooks: List[Dict[str, Any]], prompt: str) -> Dict[str, Any]:
+        """
+        Store a batch of new hooks with one insert, in a single transaction.
+
+        Rows that already exist (another request generated the same hook first) are kept.
+
+        Returns:
+            Dict[str, Any]: {image_hash: Video} for every hook in the batch
+        """
+        if not hooks:
+            return {}
+        with tracing.span("prisma.video.create_many", rows=len(hooks)):
+            with self.prisma.tx() as tx:
+                tx.video.create_many(
+                    data=[
+                        {
+                            'filename': hook["filename"],
+                            'prompt': prompt,
+                            's3_url': hook["s3_url"],
+                            'image_hash': hook["image_hash"],
+                            'model': hook["model"],
+                        }
+                        for hook in hooks
+                    ],
+                    skip_duplicates=True,
+                )
+                # create_many only returns a count, read the rows back through the unique index
+                rows = tx.video.find_many(
+                    where={
+                        'prompt': prompt,
+                        'model': {'in': list({hook["model"] for hook in hooks})},
+                        'image_hash': {'in': [hook["image_hash"] for hook in hooks]},
+                    }
+                )
+        return {row.image_hash: row for row in rows}
+
+    def record_previews(self, previews: Dict[int, Dict[str, Any]]):
+        """
+        Store the poster and preview clip urls of captioned renders on their Video rows.
+
+        Args:
+            previews (Dict[int, Dict[str, Any]]): {video id: render result with "poster_url" and "preview_url"}
+        """
+        if not previews:
+            return
+        with tracing.span("prisma.video.update", rows=len(previews)):
+            with self.prisma.tx() as tx:
+                for video_id, render in previews.items():
+                    tx.video.update(
+                        where={'id': video_id},
+                        data={'poster_url': render["poster_url"], 'preview_url': render["preview_url"]},
+                    )
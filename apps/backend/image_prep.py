@@ -0,0 +1,181 @@
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# size of the prompt image for each RunwayML model: its default output resolution, which is the
+# ratio it renders when the request does not pass one; the image is cropped to it and never upscaled
+PROMPT_IMAGE_SIZES: Dict[str, Tuple[int, int]] = {
+    "gen3a_turbo": (1280, 768),
+}
+PROMPT_IMAGE_QUALITY = int(os.getenv("PROMPT_IMAGE_QUALITY", 85))  # JPEG quality, 1-95
+# memory kept for prepared data URIs (per process)
+PROMPT_IMAGE_CACHE_MB = float(os.getenv("PROMPT_IMAGE_CACHE_MB", 64))
+# content hashes remembered by path, size and mtime (per process)
+PROMPT_IMAGE_DIGESTS = int(os.getenv("PROMPT_IMAGE_DIGESTS", 4096))
+
+# formats RunwayML accepts as prompt images, passed through when there is nothing to gain
+ACCEPTED_MIME_TYPES = ("image/jpeg", "image/png", "image/webp")
+
+# EXIF orientations that swap width and height
+_TRANSPOSED = (5, 6, 7, 8)
+
+
+def _stat_key(path: str) -> Tuple[str, int, int]:
+    # changes whenever the file is rewritten, without reading it
+    stat = os.stat(path)
+    return os.path.realpath(path), stat.st_size, stat.st_mtime_ns
+
+
+def _data_uri(data: bytes, mime: str) -> str:
+    return f"data:{mime};base64," + base64.b64encode(data).decode("utf-8")
+
+
+def _raw_payload_bytes(size: int) -> int:
+    # length of the data URI the raw file used to be sent as (always labelled image/png)
+    return len("data:image/png;base64,") + 4 * -(-size // 3)
+
+
+def _crop_box(size: Tuple[int, int], target: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    # largest centered box of the target's aspect ratio
+    width, height = size
+    ratio = target[0] / target[1]
+    if width / height > ratio:
+        crop_width, crop_height = round(height * ratio), height
+    else:
+        crop_width, crop_height = width, round(width / ratio)
+    left, top = (width - crop_width) // 2, (height - crop_height) // 2
+    return left, top, left + crop_width, top + crop_height
+
+
+def prepare(path: str, target: Tuple[int, int], quality: int = PROMPT_IMAGE_QUALITY) -> Tuple[bytes, str]:
+    """
+    Crop an image to the target aspect ratio, scale it down to the target size and re-encode it.
+
+    Images with transparency are written as PNG, everything else as JPEG. Files Pillow cannot
+    read, and files that are already at the target size and smaller than a re-encode, are
+    passed through unchanged.
+
+    Returns:
+        Tuple[bytes, str]: The encoded image and its MIME type
+    """
+    with open(path, "rb") as f:
+        original = f.read()
+    try:
+        image = Image.open(io.BytesIO(original))
+    except UnidentifiedImageError:
+        return original, mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    source_mime = Image.MIME.get(image.format)
+    source_size = image.size
+    orientation = image.getexif().get(0x0112)
+    # JPEGs are decoded at the smallest DCT scale that still covers the target, a fraction of a full decode
+    image.draft("RGB", target[::-1] if orientation in _TRANSPOSED else target)
+    image = ImageOps.exif_transpose(image)
+
+    box = _crop_box(image.size, target)
+    if box[2] - box[0] > target[0]:
+        image = image.resize(target, Image.LANCZOS, box=box, reducing_gap=3.0)
+    elif box != (0, 0) + image.size:
+        image = image.crop(box)
+
+    buffer = io.BytesIO()
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image.save(buffer, "PNG", optimize=True)
+        mime = "image/png"
+    else:
+        image.convert("RGB").save(buffer, "JPEG", quality=quality, optimize=True)
+        mime = "image/jpeg"
+    data = buffer.getvalue()
+
+    untouched = image.size == source_size and orientation in (None, 1)
+    if untouched and source_mime in ACCEPTED_MIME_TYPES and len(original) <= len(data):
+        # already the right size and smaller than a re-encode
+        return original, source_mime
+    return data, mime
+
+
+class PromptImageCache:
+    """
+    Prepared prompt images as data URIs, kept in memory up to a byte budget (LRU).
+
+    Files are identified by their content hash, looked up by path, size and mtime, so a
+    repeated request neither reads nor encodes an image that has not changed on disk.
+    The hashes are kept for at most max_digests files (LRU).
+    """
+
+    def __init__(self, max_bytes: float = PROMPT_IMAGE_CACHE_MB * 1024 * 1024,
+                 max_digests: int = PROMPT_IMAGE_DIGESTS):
+        self.max_bytes = max_bytes
+        self.max_digests = max_digests
+        self._digests: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self._entries: "OrderedDict[Tuple[str, Tuple[int, int], int], Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+    def digest(self, path: str) -> str:
+        """SHA-256 of the file's content, read again only when its size or mtime changes."""
+        key = _stat_key(path)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            with self._lock:
+                self._digests[key] = digest
+                while len(self._digests) > self.max_digests:
+                    self._digests.popitem(last=False)
+        return digest
+
+    def prompt_image(self, path: str, model: str, quality: int = PROMPT_IMAGE_QUALITY) -> Dict[str, Any]:
+        """
+        The prepared prompt image of path for model.
+
+        Returns:
+            Dict[str, Any]: data_uri, mime, bytes (length of the data URI), bytes_saved (against
+            sending the raw file) and cached (whether it came from memory)
+        """
+        target = PROMPT_IMAGE_SIZES[model]
+        key = (self.digest(path), target, quality)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["bytes_saved"] += entry["bytes_saved"]
+                return dict(entry, cached=True)
+
+        data, mime = prepare(path, target, quality)
+        data_uri = _data_uri(data, mime)
+        entry = {"data_uri": data_uri, "mime": mime, "bytes": len(data_uri),
+                 "bytes_saved": _raw_payload_bytes(os.path.getsize(path)) - len(data_uri)}
+        with self._lock:
+            self.stats["misses"] += 1
+            self.stats["bytes_saved"] += entry["bytes_saved"]
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._bytes += entry["bytes"]
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["bytes"]
+        return dict(entry, cached=False)
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, size=len(self._entries), bytes=self._bytes, digests=len(self._digests))
+
+
+# process-wide cache used by videofunctions
+prompt_images = PromptImageCache()
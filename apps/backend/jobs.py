@@ -0,0 +1,344 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import tracing
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# workers refresh the heartbeat of their running jobs this often
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", 15))
+# running jobs without a heartbeat for this long are assumed to belong to a dead process
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", 120))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobStore:
+    """
+    SQLite-backed store for pipeline jobs.
+
+    Every process (and every gunicorn worker) opening the same file sees the same
+    queue, so jobs can be submitted by one worker and picked up by another.
+    """
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    stages TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    error TEXT,
+                    timings TEXT,
+                    created TEXT NOT NULL,
+                    started TEXT,
+                    heartbeat TEXT,
+                    finished TEXT
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created)")
+            # results a job publishes while it runs, streamed to clients by /api/jobs/<id>/events
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS job_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    event TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    created TEXT NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS job_events_job_seq ON job_events (job_id, seq)")
+            # job stores created before timings and heartbeats were recorded
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "timings" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN timings TEXT")
+            if "heartbeat" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat TEXT")
+
+    def _connect(self) -> sqlite3.Connection:
+        # one connection per thread, sqlite connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def create(self, kind: str, payload: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), _now()),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "stages": json.loads(row["stages"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "timings": json.loads(row["timings"]) if row["timings"] else None,
+            "created": row["created"],
+            "started": row["started"],
+            "finished": row["finished"],
+        }
+
+    def claim_next(self, kinds) -> Optional[Dict[str, Any]]:
+        """
+        Atomically move the oldest queued job of one of the given kinds to running.
+
+        Returns:
+            Optional[Dict[str, Any]]: The claimed job (id, kind, payload) or None if the queue is empty
+        """
+        placeholders = ",".join("?" for _ in kinds)
+        with self._transaction() as conn:
+            row = conn.execute(
+                f"SELECT id, kind, payload FROM jobs WHERE status = ? AND kind IN ({placeholders}) "
+                "ORDER BY created LIMIT 1",
+                (QUEUED, *kinds),
+            ).fetchone()
+            if row is None:
+                return None
+            now = _now()
+            conn.execute(
+                "UPDATE jobs SET status = ?, started = ?, heartbeat = ? WHERE id = ?",
+                (RUNNING, now, now, row["id"]),
+            )
+        return {"id": row["id"], "kind": row["kind"], "payload": json.loads(row["payload"])}
+
+    def update_stage(self, job_id: str, stage: str, **info):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            stages = json.loads(row["stages"]) if row else {}
+            stages.setdefault(stage, {}).update(info)
+            conn.execute("UPDATE jobs SET stages = ? WHERE id = ?", (json.dumps(stages), job_id))
+
+    def add_event(self, job_id: str, event: str, data: Dict[str, Any]) -> int:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO job_events (job_id, event, data, created) VALUES (?, ?, ?, ?)",
+                (job_id, event, json.dumps(data), _now()),
+            )
+        return cursor.lastrowid
+
+    def events(self, job_id: str, after: int = 0) -> List[Dict[str, Any]]:
+        """
+        Events the job published after sequence number after, oldest first.
+
+        Returns:
+            List[Dict[str, Any]]: {"seq", "event", "data", "created"} per event
+        """
+        rows = self._connect().execute(
+            "SELECT seq, event, data, created FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, after),
+        ).fetchall()
+        return [{"seq": row["seq"], "event": row["event"], "data": json.loads(row["data"]), "created": row["created"]}
+                for row in rows]
+
+    def heartbeat(self, job_ids):
+        # running jobs whose worker is still alive are never requeued
+        if not job_ids:
+            return
+        placeholders = ",".join("?" for _ in job_ids)
+        with self._transaction() as conn:
+            conn.execute(
+                f"UPDATE jobs SET heartbeat = ? WHERE status = ? AND id IN ({placeholders})",
+                (_now(), RUNNING, *job_ids),
+            )
+
+    def finish(self, job_id: str, result: Any = None, error: Optional[str] = None,
+               timings: Optional[Dict[str, Any]] = None):
+        # any error, even an empty message, fails the job
+        failed = error is not None
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, timings = ?, finished = ? WHERE id = ?",
+                (
+                    FAILED if failed else SUCCEEDED,
+                    None if failed else json.dumps(result),
+                    error,
+                    json.dumps(timings) if timings is not None else None,
+                    _now(),
+                    job_id,
+                ),
+            )
+
+    def requeue_stale(self, older_than: float = JOB_STALE_AFTER):
+        # jobs left running by a process that died (no heartbeat for older_than seconds) are picked up again;
+        # long jobs of live workers keep their heartbeat fresh and are left alone
+        cutoff = datetime.fromtimestamp(time.time() - older_than, timezone.utc).isoformat()
+        stale = "status = ? AND COALESCE(heartbeat, started) < ?"
+        with self._transaction() as conn:
+            # the rerun publishes its results again
+            conn.execute(
+                f"DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE {stale})",
+                (RUNNING, cutoff),
+            )
+            conn.execute(
+                f"UPDATE jobs SET status = ?, started = NULL, heartbeat = NULL WHERE {stale}",
+                (QUEUED, RUNNING, cutoff),
+            )
+
+
+class JobProgress:
+    """Stage reporter handed to job handlers, writes per-stage progress to the store."""
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.monotonic()
+        self.store.update_stage(self.job_id, name, status=RUNNING, started=_now())
+        try:
+            with tracing.span(f"stage.{name}"):
+                yield
+        except Exception as e:
+            self.store.update_stage(
+                self.job_id, name, status=FAILED, error=str(e),
+                duration=round(time.monotonic() - start, 3),
+            )
+            raise
+        self.store.update_stage(
+            self.job_id, name, status=SUCCEEDED, finished=_now(),
+            duration=round(time.monotonic() - start, 3),
+        )
+
+    def update(self, name: str, **info):
+        self.store.update_stage(self.job_id, name, **info)
+
+    def emit(self, event: str, **data):
+        # a partial result clients can use before the job finishes
+        self.store.add_event(self.job_id, event, data)
+
+
+class JobQueue:
+    """
+    Worker pool that runs queued jobs from a JobStore.
+
+    Handlers are registered per job kind and called as handler(payload, progress);
+    whatever they return is saved as the job result.
+    """
+
+    def __init__(self, store: JobStore, num_workers: int = JOB_WORKERS, poll_interval: float = 1.0):
+        self.store = store
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.handlers: Dict[str, Callable[[Dict[str, Any], JobProgress], Any]] = {}
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        # ids of the jobs this process is running, kept alive by the heartbeat thread
+        self._running = set()
+        self._running_lock = threading.Lock()
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any], JobProgress], Any]):
+        self.handlers[kind] = handler
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        job_id = self.store.create(kind, payload)
+        self._wakeup.set()
+        return job_id
+
+    def start(self):
+        if self._threads:
+            return
+        self.store.requeue_stale()
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self.store.claim_next(list(self.handlers))
+            if job is None:
+                # jobs submitted by other processes are only seen by polling
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _heartbeat(self):
+        # keep this process's running jobs alive and pick up the jobs of workers that died
+        while not self._stopping.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                with self._running_lock:
+                    running = list(self._running)
+                self.store.heartbeat(running)
+                self.store.requeue_stale()
+            except Exception:
+                traceback.print_exc()
+            else:
+                self._wakeup.set()
+
+    def _run(self, job: Dict[str, Any]):
+        progress = JobProgress(self.store, job["id"])
+        result, error = None, None
+        with self._running_lock:
+            self._running.add(job["id"])
+        # every span recorded by the handler (and the threads it hands work to) lands in this trace
+        with tracing.trace(f"job.{job['kind']}", trace_id=job["id"]) as trace:
+            try:
+                result = self.handlers[job["kind"]](job["payload"], progress)
+            except Exception as e:
+                traceback.print_exc()
+                # exceptions raised without a message (TimeoutError(), queue.Empty()) still fail the job
+                error = str(e) or type(e).__name__
+        try:
+            self.store.finish(job["id"], result=result, error=error, timings=trace.breakdown())
+        finally:
+            with self._running_lock:
+                self._running.discard(job["id"])
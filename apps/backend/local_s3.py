@@ -0,0 +1,241 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import shutil
+import uuid
+
+from botocore.exceptions import ClientError
+
+
+def _not_found(bucket, key, operation, code="NoSuchKey"):
+    # same error shape botocore raises for a missing object
+    return ClientError({"Error": {"Code": code, "Message": f"s3://{bucket}/{key} does not exist"}}, operation)
+
+
+class LocalBody(io.RawIOBase):
+    """Minimal stand-in for botocore's StreamingBody over a local file."""
+
+    def __init__(self, path, start=0, length=None):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = length if length is not None else os.path.getsize(path) - start
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def iter_chunks(self, chunk_size=1024 * 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+class LocalS3Client:
+    """
+    Local directory stand-in for the subset of the boto3 S3 client the backend uses.
+
+    Objects live at <root>/<bucket>/<key>, metadata in <root>/.meta/<bucket>/<key>.json.
+    Presigned URLs are plain file paths, which ffmpeg and MoviePy read like any URL.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def _meta_path(self, bucket, key):
+        return os.path.join(self.root, ".meta", bucket, key + ".json")
+
+    def _write_meta(self, bucket, key, etag, content_type=None, metadata=None):
+        path = self._meta_path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"ETag": etag, "ContentType": content_type, "Metadata": metadata or {}}, f)
+
+    def _read_meta(self, bucket, key, operation="GetObject"):
+        if not os.path.exists(self._path(bucket, key)):
+            raise _not_found(bucket, key, operation, "404" if operation == "HeadObject" else "NoSuchKey")
+        try:
+            with open(self._meta_path(bucket, key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"ETag": self._md5_etag(self._path(bucket, key)), "ContentType": None, "Metadata": {}}
+
+    @staticmethod
+    def _md5_etag(path):
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return f'"{digest.hexdigest()}"'
+
+    def _store(self, bucket, key, fileobj, extra_args=None):
+        extra_args = extra_args or {}
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(fileobj, f, 1024 * 1024)
+            os.replace(tmp_path, path)
+        except BaseException:
+            # a failed upload leaves nothing behind, like an aborted S3 upload
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._write_meta(bucket, key, self._md5_etag(path), extra_args.get("ContentType"), extra_args.get("Metadata"))
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self._store(Bucket, Key, Fileobj, ExtraArgs)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        with open(Filename, "rb") as f:
+            self._store(Bucket, Key, f, ExtraArgs)
+
+    def put_object(self, Bucket, Key, Body=b"", ContentType=None, Metadata=None, **kwargs):
+        fileobj = io.BytesIO(Body) if isinstance(Body, (bytes, bytearray)) else Body
+        self._store(Bucket, Key, fileobj, {"ContentType": ContentType, "Metadata": Metadata})
+        return {"ETag": self._read_meta(Bucket, Key)["ETag"]}
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Callback=None, Config=None):
+        self._read_meta(Bucket, Key)
+        shutil.copyfile(self._path(Bucket, Key), Filename)
+
+    def download_fileobj(self, Bucket, Key, Fileobj, ExtraArgs=None, Callback=None, Config=None):
+        self._read_meta(Bucket, Key)
+        with open(self._path(Bucket, Key), "rb") as f:
+            shutil.copyfileobj(f, Fileobj, 1024 * 1024)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        meta = self._read_meta(Bucket, Key, "HeadObject")
+        return {
+            "ContentLength": os.path.getsize(self._path(Bucket, Key)),
+            "ETag": meta["ETag"],
+            "ContentType": meta["ContentType"],
+            "Metadata": meta["Metadata"],
+        }
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        # a missing key is NoSuchKey here, a bare 404 only for HEAD
+        self._read_meta(Bucket, Key)
+        head = self.head_object(Bucket, Key)
+        size = head["ContentLength"]
+        start, length = 0, size
+        if Range:
+            # only the "bytes=start-end" / "bytes=start-" forms are supported
+            first, _, last = Range.split("=", 1)[1].partition("-")
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            length = max(0, end - start + 1)
+        return dict(head, Body=LocalBody(self._path(Bucket, Key), start, length), ContentLength=length)
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        for path in (self._path(Bucket, Key), self._meta_path(Bucket, Key)):
+            if os.path.exists(path):
+                os.remove(path)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        base = os.path.join(self.root, Bucket)
+        contents = []
+        for dirpath, _, filenames in os.walk(base):
+            for filename in filenames:
+                if filename.endswith(".part"):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, filename), base).replace(os.sep, "/")
+                if key.startswith(Prefix):
+                    head = self.head_object(Bucket, key)
+                    contents.append({
+                        "Key": key,
+                        "Size": head["ContentLength"],
+                        "ETag": head["ETag"],
+                        "LastModified": os.path.getmtime(os.path.join(dirpath, filename)),
+                    })
+        contents.sort(key=lambda item: item["Key"])
+        return {"Contents": contents, "KeyCount": len(contents), "IsTruncated": False}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        return self._path(Params["Bucket"], Params["Key"])
+
+    def _upload_dir(self, upload_id):
+        return os.path.join(self.root, ".uploads", upload_id)
+
+    def create_multipart_upload(self, Bucket, Key, ContentType=None, Metadata=None, **kwargs):
+        # parts are kept on disk so an upload outlives the client that started it
+        upload_id = uuid.uuid4().hex
+        upload_dir = self._upload_dir(upload_id)
+        os.makedirs(upload_dir)
+        with open(os.path.join(upload_dir, "upload.json"), "w", encoding="utf-8") as f:
+            json.dump({"Bucket": Bucket, "Key": Key, "ContentType": ContentType, "Metadata": Metadata}, f)
+        return {"UploadId": upload_id, "Bucket": Bucket, "Key": Key}
+
+    def _check_upload(self, upload_id, operation):
+        if not os.path.isdir(self._upload_dir(upload_id)):
+            raise ClientError({"Error": {"Code": "NoSuchUpload", "Message": f"Upload {upload_id} does not exist"}}, operation)
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5=None, **kwargs):
+        self._check_upload(UploadId, "UploadPart")
+        data = Body if isinstance(Body, (bytes, bytearray)) else Body.read()
+        if ContentMD5 is not None and base64.b64decode(ContentMD5) != hashlib.md5(data).digest():
+            raise ClientError({"Error": {"Code": "BadDigest", "Message": "Content-MD5 does not match the part"}},
+                              "UploadPart")
+        part_path = os.path.join(self._upload_dir(UploadId), f"{PartNumber:05d}")
+        with open(part_path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(part_path + ".tmp", part_path)
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def list_parts(self, Bucket, Key, UploadId, **kwargs):
+        self._check_upload(UploadId, "ListParts")
+        upload_dir = self._upload_dir(UploadId)
+        parts = []
+        for name in sorted(os.listdir(upload_dir)):
+            if name.isdigit():
+                path = os.path.join(upload_dir, name)
+                parts.append({"PartNumber": int(name), "ETag": self._md5_etag(path), "Size": os.path.getsize(path)})
+        return {"Parts": parts, "IsTruncated": False}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._check_upload(UploadId, "CompleteMultipartUpload")
+        upload_dir = self._upload_dir(UploadId)
+        with open(os.path.join(upload_dir, "upload.json"), encoding="utf-8") as f:
+            upload = json.load(f)
+
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        digests = b""
+        with open(path, "wb") as out:
+            for number in numbers:
+                with open(os.path.join(upload_dir, f"{number:05d}"), "rb") as f:
+                    data = f.read()
+                out.write(data)
+                digests += hashlib.md5(data).digest()
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+        # same ETag scheme as S3 multipart uploads
+        etag = f'"{hashlib.md5(digests).hexdigest()}-{len(numbers)}"'
+        self._write_meta(Bucket, Key, etag, upload["ContentType"], upload["Metadata"])
+        return {"ETag": etag, "Bucket": Bucket, "Key": Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        shutil.rmtree(self._upload_dir(UploadId), ignore_errors=True)
+        return {}
@@ -0,0 +1,148 @@
+import os
+import queue
+import threading
+from contextlib import nullcontext
+from typing import Any, Callable, Iterable, List, Optional
+
+import tracing
+
+# items buffered between two stages of a streaming pipeline; a full queue holds the stage before it back
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 4))
+
+# end of stream marker, passed from stage to stage
+_DONE = object()
+
+
+def make_queue(size: int = PIPELINE_QUEUE_SIZE) -> "queue.Queue":
+    return queue.Queue(maxsize=size)
+
+
+def assign_captions(num_captions: int, num_videos: int) -> List[List[int]]:
+    """
+    Caption indexes for every video position, paired round-robin so neither list is cut short.
+
+    Matches the pairing of app.textoverlay, but can be computed before any video exists.
+    """
+    if not num_captions or not num_videos:
+        return [[] for _ in range(num_videos)]
+    assigned = [[] for _ in range(num_videos)]
+    for i in range(max(num_captions, num_videos)):
+        assigned[i % num_videos].append(i % num_captions)
+    return assigned
+
+
+class Stage:
+    """
+    One step of a streaming pipeline, run on its own worker threads.
+
+    Workers take items from inbox, call fn(item) and put everything it returns (an iterable)
+    into outbox. A stage without an inbox is a source: fn() is called once and its items are
+    streamed out. With batch=True, fn gets a list of every item waiting in the inbox, so a
+    busy stage still writes in bulk while an idle one handles items one at a time.
+
+    The stage passes the end of its inbox on once all of its workers are done. The first
+    exception is kept in error; after it the stage only drains its inbox, so the stages
+    before it never block on a full queue. Wrapped in progress.stage(name) when a job
+    progress reporter is given.
+    """
+
+    def __init__(self, name: str, fn: Callable[..., Iterable[Any]], inbox: Optional["queue.Queue"] = None,
+                 outbox: Optional["queue.Queue"] = None, workers: int = 1, batch: bool = False, progress=None):
+        self.name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = max(1, workers) if inbox is not None else 1
+        self.batch = batch
+        self.progress = progress
+        self.error: Optional[BaseException] = None
+        self.done = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=tracing.wrap(self._supervise), name=f"stage-{name}", daemon=True)
+
+    def start(self) -> "Stage":
+        self._thread.start()
+        return self
+
+    def join(self) -> "Stage":
+        self._thread.join()
+        return self
+
+    def _supervise(self):
+        try:
+            with self.progress.stage(self.name) if self.progress is not None else nullcontext():
+                threads = [threading.Thread(target=tracing.wrap(self._work), name=f"stage-{self.name}-{i}", daemon=True)
+                           for i in range(self.workers)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                if self.error is not None:
+                    raise self.error
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            if self.outbox is not None:
+                self.outbox.put(_DONE)
+
+    def _fail(self, error: BaseException):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+    def _emit(self, items: Iterable[Any], count: int):
+        for item in items or ():
+            if self.outbox is not None:
+                self.outbox.put(item)
+        with self._lock:
+            self.done += count
+        if self.progress is not None:
+            self.progress.update(self.name, done=self.done)
+
+    def _work(self):
+        if self.inbox is None:
+            try:
+                for item in self.fn():
+                    self._emit((item,), 1)
+            except Exception as e:
+                self._fail(e)
+            return
+
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                # leave the marker for the other workers of this stage
+                self.inbox.put(_DONE)
+                return
+            items = [item]
+            finished = False
+            while self.batch:
+                try:
+                    more = self.inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if more is _DONE:
+                    self.inbox.put(_DONE)
+                    finished = True
+                    break
+                items.append(more)
+            if self.error is None:
+                try:
+                    self._emit(self.fn(items) if self.batch else self.fn(item), len(items))
+                except Exception as e:
+                    self._fail(e)
+            if finished:
+                return
+
+
+def run(stages: List[Stage]):
+    """
+    Start the stages, wait for all of them and raise the first error in pipeline order.
+    """
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
@@ -0,0 +1,133 @@
+import os
+from typing import Dict, List, Sequence
+
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+from PIL import Image
+
+import storage
+
+# gallery by-products of a render: a poster JPEG and a short low-bitrate clip, both made from the
+# frames the render already decodes, so the dashboard never has to load the full MP4 to show a choice
+POSTER_TIME = float(os.getenv("POSTER_TIME", 1.0))  # seconds into the video (at most its middle)
+POSTER_MAX_HEIGHT = int(os.getenv("POSTER_MAX_HEIGHT", 640))
+POSTER_QUALITY = int(os.getenv("POSTER_QUALITY", 80))  # JPEG quality, 1-95
+
+PREVIEW_SECONDS = float(os.getenv("PREVIEW_SECONDS", 3))
+PREVIEW_MAX_HEIGHT = int(os.getenv("PREVIEW_MAX_HEIGHT", 360))
+PREVIEW_FPS = int(os.getenv("PREVIEW_FPS", 12))
+PREVIEW_CRF = int(os.getenv("PREVIEW_CRF", 32))
+
+
+def poster_time(duration: float) -> float:
+    return min(POSTER_TIME, max(duration, 0) / 2)
+
+
+def _scale_filter(max_height: int) -> str:
+    return f"scale=-2:'min(ih,{max_height})'"
+
+
+def preview_video_args() -> List[str]:
+    # no audio, the gallery plays previews muted
+    return ["-an", "-c:v", "libx264", "-preset", "veryfast", "-crf", str(PREVIEW_CRF), "-pix_fmt", "yuv420p",
+            "-movflags", "+faststart"]
+
+
+def ffmpeg_graph(label: str, duration: float, suffix: str = "") -> str:
+    """
+    Filter graph branches that turn one video stream of an ffmpeg render into its previews.
+
+    Args:
+        label (str): Name of the rendered video stream in the graph, e.g. "out"
+        duration (float): Duration of the render, to place the poster frame
+        suffix (str): Appended to the output labels, to tell several renders of one graph apart
+
+    Returns:
+        str: Graph fragment splitting [label] into [v] (the render itself), [poster] and [preview]
+    """
+    return (f"[{label}]split=3[v{suffix}][ps{suffix}][pv{suffix}];"
+            f"[ps{suffix}]trim=start={poster_time(duration)},{_scale_filter(POSTER_MAX_HEIGHT)}[poster{suffix}];"
+            f"[pv{suffix}]trim=duration={PREVIEW_SECONDS},fps={PREVIEW_FPS},setpts=PTS-STARTPTS,"
+            f"{_scale_filter(PREVIEW_MAX_HEIGHT)}[preview{suffix}]")
+
+
+def ffmpeg_outputs(poster_path: str, preview_path: str, suffix: str = "") -> List[str]:
+    # output options for the labels of ffmpeg_graph, to append after the render's own output
+    # (JPEG qscale 2-31, lower is better; roughly what POSTER_QUALITY gives through PIL)
+    qscale = max(2, min(31, round(31 - POSTER_QUALITY * 29 / 95)))
+    return (["-map", f"[poster{suffix}]", "-frames:v", "1", "-q:v", str(qscale), poster_path]
+            + ["-map", f"[preview{suffix}]", "-r", str(PREVIEW_FPS)] + preview_video_args() + [preview_path])
+
+
+class FrameTap:
+    """
+    Write the poster and preview clip from frames as a render produces them.
+
+    Call write() with every rendered frame, then close(). The poster is the frame at
+    poster_time(), the preview the first PREVIEW_SECONDS, resampled to PREVIEW_FPS.
+    """
+
+    def __init__(self, poster_path: str, preview_path: str, size: Sequence[int], fps: float, duration: float):
+        self.poster_path = poster_path
+        self.fps = fps
+        self.poster_index = int(poster_time(duration) * fps)
+        self.preview_frames = int(min(PREVIEW_SECONDS, duration) * PREVIEW_FPS)
+        self._preview_written = 0
+        self._last = None
+        self._poster_saved = False
+        # ffmpeg scales the preview down, frames are piped at the render size
+        self._writer = FFMPEG_VideoWriter(
+            preview_path, tuple(size), PREVIEW_FPS, codec="libx264", preset="veryfast",
+            ffmpeg_params=["-crf", str(PREVIEW_CRF), "-pix_fmt", "yuv420p", "-vf", _scale_filter(PREVIEW_MAX_HEIGHT),
+                           "-movflags", "+faststart"],
+        )
+        self.preview_path = preview_path
+
+    def write(self, index: int, frame):
+        if not self._poster_saved and index >= self.poster_index:
+            self.save_poster(frame)
+        # keep the frames whose time is next on the preview's frame grid
+        if self._preview_written < self.preview_frames and index / self.fps >= self._preview_written / PREVIEW_FPS:
+            self._writer.write_frame(frame)
+            self._preview_written += 1
+        self._last = frame
+
+    def save_poster(self, frame):
+        image = Image.fromarray(frame)
+        if image.height > POSTER_MAX_HEIGHT:
+            image = image.resize((max(2, round(image.width * POSTER_MAX_HEIGHT / image.height)), POSTER_MAX_HEIGHT),
+                                 Image.BILINEAR)
+        image.save(self.poster_path, "JPEG", quality=POSTER_QUALITY, optimize=True)
+        self._poster_saved = True
+
+    def close(self):
+        # videos shorter than the poster time get their last frame
+        if not self._poster_saved and self._last is not None:
+            self.save_poster(self._last)
+        self._writer.close()
+
+
+def upload(s3, bucket_name: str, paths: Dict[str, str], keys: Dict[str, str]) -> Dict[str, str]:
+    """
+    Upload the poster and preview clip of a render.
+
+    Returns:
+        Dict[str, str]: {"poster_url": ..., "preview_url": ...}
+    """
+    return {
+        "poster_url": storage.upload_file(paths["poster"], keys["poster"], content_type="image/jpeg",
+                                          bucket=bucket_name, client=s3),
+        "preview_url": storage.upload_file(paths["preview"], keys["preview"], bucket=bucket_name, client=s3),
+    }
+
+
+def urls(bucket_name: str, keys: Dict[str, str]) -> Dict[str, str]:
+    return {
+        "poster_url": storage.object_url(keys["poster"], bucket_name),
+        "preview_url": storage.object_url(keys["preview"], bucket_name),
+    }
+
+
+def local_paths(output_path: str) -> Dict[str, str]:
+    # where a render's previews are written locally, next to the render
+    base = os.path.splitext(output_path)[0]
+    return {"poster": f"{base}.poster.jpg", "preview": f"{base}.preview.mp4"}
@@ -0,0 +1,287 @@
+import contextvars
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import tracing
+
+# shared by every process on the host, like the job store
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "ratelimit.sqlite3")
+
+# (requests per minute, burst) per provider; every API key gets its own bucket, 0 disables the limit
+LIMITS: Dict[str, Tuple[float, float]] = {
+    "openai": (float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 60)), float(os.getenv("OPENAI_BURST", 10))),
+    "runwayml": (float(os.getenv("RUNWAYML_TASKS_PER_MINUTE", 20)), float(os.getenv("RUNWAYML_BURST", 5))),
+    "runwayml.poll": (float(os.getenv("RUNWAYML_POLLS_PER_MINUTE", 120)), float(os.getenv("RUNWAYML_POLL_BURST", 20))),
+}
+
+# retries of throttled calls (HTTP 429/503), after the provider's Retry-After plus a jittered backoff
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", 5))
+RATE_LIMIT_BACKOFF = float(os.getenv("RATE_LIMIT_BACKOFF", 1.0))
+RATE_LIMIT_MAX_BACKOFF = float(os.getenv("RATE_LIMIT_MAX_BACKOFF", 60.0))
+# longest wait for a token before giving up
+RATE_LIMIT_TIMEOUT = float(os.getenv("RATE_LIMIT_TIMEOUT", 600))
+
+RETRY_STATUSES = (429, 503)
+
+# waiters are polled at least this often, so Retry-After and new higher-priority waiters are noticed
+MAX_SLEEP = 0.5
+# waiters that stopped polling this long ago belong to a dead process
+WAITER_STALE_AFTER = 10.0
+
+# lower runs first: interactive requests take tokens before background batch jobs
+INTERACTIVE = 0
+BATCH = 1
+PRIORITIES = {"interactive": INTERACTIVE, "batch": BATCH}
+
+_priority: contextvars.ContextVar = contextvars.ContextVar("rate_limit_priority", default=INTERACTIVE)
+
+
+def get_priority(level) -> int:
+    """
+    Resolve a priority name ("interactive", "batch") or level.
+
+    Raises:
+        ValueError: If the name is not one of PRIORITIES
+    """
+    if isinstance(level, int):
+        return level
+    if level not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{level}', expected one of {tuple(PRIORITIES)}")
+    return PRIORITIES[level]
+
+
+@contextmanager
+def priority(level):
+    """Run the enclosed block (and threads started through tracing.wrap) at this priority."""
+    token = _priority.set(get_priority(level))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def key_id(api_key: Optional[str]) -> str:
+    # buckets are per API key, but the key itself is never written to disk
+    if not api_key:
+        return "default"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Seconds a provider asked us to wait before retrying, or None if the error is not throttling.
+
+    Understands the openai/runwayml SDK errors (status_code and response headers) and the
+    older openai errors (http_status and headers).
+    """
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    if status not in RETRY_STATUSES:
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None) or {}
+    headers = {str(name).lower(): value for name, value in dict(headers).items()}
+    try:
+        if headers.get("retry-after-ms"):
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+    except ValueError:
+        pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        # Retry-After may also be an HTTP date
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return 0.0
+
+
+class RateLimiter:
+    """
+    Token buckets per provider and API key, shared by every process through a SQLite file.
+
+    Each take is one IMMEDIATE transaction, so workers in different processes never hand out
+    the same token. Waiters are registered with their priority; a waiter steps aside while a
+    higher-priority waiter for the same bucket is queued. A throttled response blocks the
+    whole bucket until its Retry-After has passed.
+    """
+
+    def __init__(self, path: str = RATE_LIMIT_DB_PATH, limits: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.path = path
+        self.limits = dict(LIMITS if limits is None else limits)
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    blocked_until REAL NOT NULL DEFAULT 0
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS waiters (
+                    id TEXT PRIMARY KEY,
+                    bucket TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    seen REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS waiters_bucket_priority ON waiters (bucket, priority)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # one connection per thread (and per process), sqlite connections must not be shared
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _bucket(self, provider: str, api_key: Optional[str]) -> str:
+        return f"{provider}:{key_id(api_key)}"
+
+    def _take(self, bucket: str, rate: float, burst: float, level: int, waiter: str) -> float:
+        # take a token if one is free; otherwise register as a waiter and return the seconds to wait
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM waiters WHERE seen < ?", (now - WAITER_STALE_AFTER,))
+            row = conn.execute("SELECT tokens, updated, blocked_until FROM buckets WHERE name = ?", (bucket,)).fetchone()
+            if row is None:
+                tokens, blocked_until = burst, 0.0
+            else:
+                tokens = min(burst, row["tokens"] + max(0.0, now - row["updated"]) * rate)
+                blocked_until = row["blocked_until"]
+
+            if blocked_until > now:
+                wait = blocked_until - now
+            elif conn.execute("SELECT 1 FROM waiters WHERE bucket = ? AND priority < ? LIMIT 1",
+                              (bucket, level)).fetchone():
+                # a more urgent caller is queued for this bucket, let it go first
+                wait = MAX_SLEEP
+            elif tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+
+            conn.execute(
+                """INSERT INTO buckets (name, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated""",
+                (bucket, tokens, now, blocked_until),
+            )
+            if wait > 0:
+                conn.execute(
+                    """INSERT INTO waiters (id, bucket, priority, seen) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(id) DO UPDATE SET seen = excluded.seen""",
+                    (waiter, bucket, level, now),
+                )
+            else:
+                conn.execute("DELETE FROM waiters WHERE id = ?", (waiter,))
+        return wait
+
+    def acquire(self, provider: str, api_key: Optional[str] = None, level: Optional[int] = None,
+                timeout: float = RATE_LIMIT_TIMEOUT) -> float:
+        """
+        Block until the provider's bucket for this API key has a token, and take it.
+
+        Args:
+            level (Optional[int]): Priority, defaults to the one set with priority()
+
+        Returns:
+            float: Seconds spent waiting
+
+        Raises:
+            TimeoutError: If no token became free within timeout seconds
+        """
+        rate_per_minute, burst = self.limits[provider]
+        if rate_per_minute <= 0:
+            return 0.0
+        bucket = self._bucket(provider, api_key)
+        level = _priority.get() if level is None else level
+        waiter = uuid.uuid4().hex
+        start = time.monotonic()
+
+        with tracing.span(f"ratelimit.{provider}.wait", bucket=bucket, priority=level) as span:
+            queued = False
+            try:
+                while True:
+                    wait = self._take(bucket, rate_per_minute / 60, max(1.0, burst), level, waiter)
+                    # taking the token also removes the waiter row
+                    queued = wait > 0
+                    if not queued:
+                        break
+                    if time.monotonic() - start + min(wait, MAX_SLEEP) > timeout:
+                        raise TimeoutError(f"No {provider} rate limit token within {timeout} seconds")
+                    # jittered, so processes polling the same bucket do not line up
+                    time.sleep(min(wait, MAX_SLEEP) * random.uniform(0.8, 1.0))
+            finally:
+                if queued:
+                    with self._transaction() as conn:
+                        conn.execute("DELETE FROM waiters WHERE id = ?", (waiter,))
+            waited = time.monotonic() - start
+            span.set(waited=round(waited, 4))
+        return waited
+
+    def block(self, provider: str, api_key: Optional[str], seconds: float):
+        # the provider throttled us: no caller of this bucket, in any process, sends until then
+        until = time.time() + seconds
+        with self._transaction() as conn:
+            conn.execute(
+                """INSERT INTO buckets (name, tokens, updated, blocked_until) VALUES (?, 0, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET blocked_until = MAX(blocked_until, excluded.blocked_until)""",
+                (self._bucket(provider, api_key), time.time(), until),
+            )
+
+    def call(self, provider: str, api_key: Optional[str], fn: Callable, *args, **kwargs) -> Any:
+        """
+        Call fn(*args, **kwargs) under the provider's rate limit.
+
+        Throttled calls (HTTP 429/503) are retried up to RATE_LIMIT_MAX_RETRIES times, after the
+        provider's Retry-After plus an exponential, jittered backoff. Queue wait and call time
+        are traced separately as ratelimit.<provider>.wait and ratelimit.<provider>.exec.
+        """
+        attempt = 0
+        while True:
+            self.acquire(provider, api_key)
+            try:
+                with tracing.span(f"ratelimit.{provider}.exec", attempt=attempt):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                delay = retry_after(e)
+                if delay is None or attempt >= RATE_LIMIT_MAX_RETRIES:
+                    raise
+                backoff = min(RATE_LIMIT_MAX_BACKOFF, RATE_LIMIT_BACKOFF * 2 ** attempt)
+                self.block(provider, api_key, delay + random.uniform(0, backoff))
+                attempt += 1
+
+    def info(self) -> Dict[str, Any]:
+        # bucket levels and queued waiters, for debugging
+        with self._transaction() as conn:
+            buckets = {row["name"]: dict(row) for row in conn.execute("SELECT * FROM buckets")}
+            for row in conn.execute("SELECT bucket, priority, COUNT(*) AS n FROM waiters GROUP BY bucket, priority"):
+                buckets.setdefault(row["bucket"], {}).setdefault("waiters", {})[row["priority"]] = row["n"]
+        return buckets
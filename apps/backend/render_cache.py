@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+import storage
+
+# bump when the renderer output changes, so old renders stop matching
+RENDER_VERSION = "4"
+RENDER_PREFIX = "overlaid/"
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", 4096))
+# seconds a remembered render is trusted without a HEAD; renders evicted by another process
+# can be answered from memory for at most this long
+RENDER_CACHE_TTL = float(os.getenv("RENDER_CACHE_TTL", 60))
+
+# object metadata marking an object as a cached render (S3 lower-cases metadata keys)
+KEY_METADATA = "render-key"
+SOURCE_METADATA = "source-etag"
+
+
+def render_key(source_etag: str, caption: str, **settings) -> str:
+    """
+    Content address of a captioned render.
+
+    Any change to the source object (its ETag), the caption or a style/codec setting
+    gives a different key; identical inputs always give the same key.
+    """
+    payload = json.dumps(
+        {"version": RENDER_VERSION, "source": source_etag.strip('"'), "caption": caption, "settings": settings},
+        sort_keys=True, default=list,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def output_key(key: str) -> str:
+    return f"{RENDER_PREFIX}{key}.mp4"
+
+
+def preview_keys(key: str) -> Dict[str, str]:
+    # poster and preview clip of a render, uploaded before the render itself so a cache hit implies them
+    return {"poster": f"{RENDER_PREFIX}{key}.poster.jpg", "preview": f"{RENDER_PREFIX}{key}.preview.mp4"}
+
+
+def object_metadata(key: str, source_etag: str) -> Dict[str, str]:
+    return {KEY_METADATA: key, SOURCE_METADATA: source_etag.strip('"')}
+
+
+def _is_not_found(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+class RenderCache:
+    """
+    Index of finished renders, backed by the render objects' own S3 metadata.
+
+    Lookups check an in-process LRU first and then HEAD the content-addressed key, so
+    every worker and every process shares the same index without a separate table.
+    LRU entries older than ttl seconds are revalidated with a HEAD, so a render deleted
+    by another process (e.g. by evict()) stops being answered once its entry expires.
+    """
+
+    def __init__(self, max_entries: int = RENDER_CACHE_SIZE, ttl: float = RENDER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # render key -> (url, time.monotonic() when it was last seen in S3)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "s3_hits": 0, "misses": 0, "evicted": 0}
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.stats[name] += n
+
+    def remember(self, key: str, url: str):
+        with self._lock:
+            self._entries[key] = (url, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+            self.stats["misses"] += 1
+
+    def lookup(self, s3, bucket_name: str, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry[0]
+
+        try:
+            head = s3.head_object(Bucket=bucket_name, Key=output_key(key))
+        except ClientError as e:
+            if not _is_not_found(e):
+                raise
+            self._forget(key)
+            return None
+
+        if head.get("Metadata", {}).get(KEY_METADATA) != key:
+            # something else was written at this key, do not trust it
+            self._forget(key)
+            return None
+
+        url = storage.object_url(output_key(key), bucket_name)
+        self.remember(key, url)
+        self._count("s3_hits")
+        return url
+
+    def evict(self, s3, bucket_name: str, older_than: float) -> int:
+        """
+        Delete cached renders (and their posters and preview clips) last written more than older_than seconds ago.
+
+        Other processes keep answering a deleted render from memory until their entry is
+        older than RENDER_CACHE_TTL; their next lookup after that misses.
+
+        Returns:
+            int: Number of renders deleted
+        """
+        cutoff = time.time() - older_than
+        deleted = 0
+        kwargs: Dict[str, Any] = {"Bucket": bucket_name, "Prefix": RENDER_PREFIX}
+        while True:
+            page = s3.list_objects_v2(**kwargs)
+            for item in page.get("Contents", []):
+                modified = item["LastModified"]
+                modified = modified.timestamp() if isinstance(modified, datetime) else float(modified)
+                if modified >= cutoff:
+                    continue
+                key = item["Key"][len(RENDER_PREFIX):].split(".", 1)[0]
+                s3.delete_object(Bucket=bucket_name, Key=item["Key"])
+                if item["Key"] == output_key(key):
+                    with self._lock:
+                        self._entries.pop(key, None)
+                    deleted += 1
+            if not page.get("IsTruncated"):
+                break
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+        self._count("evicted", deleted)
+        return deleted
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.stats["memory_hits"] + self.stats["s3_hits"]
+            lookups = hits + self.stats["misses"]
+            return dict(self.stats, size=len(self._entries), hit_rate=hits / lookups if lookups else 0.0)
+
+    def render(self, prefix: str = "lookbk") -> str:
+        """Lookups by result, entries and hit rate in the Prometheus text format, for /metrics."""
+        info = self.info()
+        lookups = f"{prefix}_render_cache_lookups_total"
+        lines = [f"# HELP {lookups} Render cache lookups by result.", f"# TYPE {lookups} counter"]
+        for result, stat in (("memory_hit", "memory_hits"), ("s3_hit", "s3_hits"), ("miss", "misses")):
+            lines.append(f'{lookups}{{result="{result}"}} {info[stat]}')
+        for name, kind, description, value in (
+            ("evicted_total", "counter", "Cached renders deleted by this process.", info["evicted"]),
+            ("entries", "gauge", "Renders remembered in this process.", info["size"]),
+            ("hit_ratio", "gauge", "Share of lookups answered from memory or S3.", info["hit_rate"]),
+        ):
+            lines += [f"# HELP {prefix}_render_cache_{name} {description}",
+                      f"# TYPE {prefix}_render_cache_{name} {kind}",
+                      f"{prefix}_render_cache_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+# process-wide cache used by text_overlay and bulk_overlay
+render_cache = RenderCache()
@@ -0,0 +1,156 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import storage
+import tracing
+
+# S3 needs every part but the last to be at least 5 MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+PART_SIZE = int(os.getenv("S3_PART_SIZE", 8 * 1024 * 1024))
+
+# MP4 muxer flags for non-seekable outputs: the moov atom goes first and the
+# media follows in fragments, so the file can be uploaded while it is written
+FRAGMENTED_MP4_PARAMS = ['-movflags', 'frag_keyframe+empty_moov+default_base_moof']
+
+
+class MultipartWriter:
+    """
+    File-like writer that sends everything written to it to S3 as a multipart upload.
+
+    Parts are uploaded as soon as PART_SIZE bytes are buffered; close() uploads the
+    remainder and completes the upload, abort() throws the upload away.
+    """
+
+    def __init__(self, s3, bucket_name, key, part_size=PART_SIZE, content_type='video/mp4', metadata=None):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._parts = []
+        self._closed = False
+        extra = {"ContentType": content_type}
+        if metadata:
+            extra["Metadata"] = metadata
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=key, **extra)["UploadId"]
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def _upload_part(self, data):
+        number = len(self._parts) + 1
+        start = time.monotonic()
+        with tracing.span("s3.put_part", key=self.key, part=number, bytes=len(data)):
+            response = self.s3.upload_part(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                                           PartNumber=number, Body=data)
+        storage.metrics.record("put_part", len(data), time.monotonic() - start)
+        self._parts.append({"PartNumber": number, "ETag": response["ETag"]})
+
+    def close(self):
+        if self._closed:
+            return
+        if self._buffer or not self._parts:
+            self._upload_part(bytes(self._buffer))
+            self._buffer.clear()
+        self.s3.complete_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                                          MultipartUpload={"Parts": self._parts})
+        self._closed = True
+
+    def abort(self):
+        if self._closed:
+            return
+        self.s3.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+        self._closed = True
+
+
+def source_url(s3, bucket_name, key, expires=3600):
+    # presigned GET url, ffmpeg reads it with ranged requests so rendering starts before the download ends
+    try:
+        return storage.presign(key, bucket_name, expires, client=s3)
+    except (AttributeError, NotImplementedError):
+        return None
+
+
+@contextmanager
+def open_source(s3, bucket_name, key, tmp_dir=None):
+    """
+    Yield a path or URL ffmpeg can read the object from.
+
+    Prefers a presigned URL; if the client cannot presign, the object is spilled to a
+    temporary file that is deleted when the context exits.
+    """
+    url = source_url(s3, bucket_name, key)
+    if url is not None:
+        yield url
+        return
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        local_path = os.path.join(tmp, os.path.basename(key) or "source.mp4")
+        storage.download_file(key, local_path, bucket=bucket_name, client=s3)
+        yield local_path
+
+
+@contextmanager
+def pipe_to_s3(s3, bucket_name, key, filename='output.mp4', part_size=PART_SIZE, content_type='video/mp4', metadata=None):
+    """
+    Yield a named pipe path; whatever is written to it is streamed into s3://bucket/key.
+
+    The encoder writes to the pipe as if it were a file (use FRAGMENTED_MP4_PARAMS for MP4),
+    and a background thread uploads each part as soon as it is full. The upload is completed
+    when the context exits cleanly and aborted if it raises.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        fifo_path = os.path.join(tmp, filename)
+        os.mkfifo(fifo_path)
+        writer = MultipartWriter(s3, bucket_name, key, part_size, content_type, metadata)
+        errors = []
+
+        def upload():
+            with open(fifo_path, 'rb') as fifo:
+                while True:
+                    chunk = fifo.read(1024 * 1024)
+                    if not chunk:
+                        return
+                    if errors:
+                        # keep draining so the encoder never blocks on a full pipe
+                        continue
+                    try:
+                        writer.write(chunk)
+                    except Exception as e:
+                        errors.append(e)
+
+        thread = threading.Thread(target=tracing.wrap(upload), name=f"s3-upload-{key}", daemon=True)
+        thread.start()
+        try:
+            yield fifo_path
+        except BaseException:
+            _release_reader(fifo_path)
+            thread.join()
+            writer.abort()
+            raise
+
+        # if the encoder never opened the pipe the reader is still waiting for a writer
+        _release_reader(fifo_path)
+        thread.join()
+        if errors:
+            writer.abort()
+            raise errors[0]
+        writer.close()
+
+
+def _release_reader(fifo_path):
+    try:
+        fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+    except OSError:
+        # no reader waiting (ENXIO), it already saw EOF
+        return
+    os.close(fd)
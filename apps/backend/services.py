@@ -0,0 +1,105 @@
+import atexit
+import os
+import threading
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    """
+    Per-process singleton, created on first use.
+
+    The value is rebuilt after a fork (e.g. gunicorn --preload), so every worker
+    process gets its own clients and connections instead of sharing the parent's.
+    """
+
+    def __init__(self, factory: Callable[[], T], close: Optional[Callable[[T], Any]] = None):
+        self._factory = factory
+        self._close = close
+        self._value: Optional[T] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        if close is not None:
+            atexit.register(self.reset)
+
+    def get(self) -> T:
+        if self._value is None or self._pid != os.getpid():
+            with self._lock:
+                if self._value is None or self._pid != os.getpid():
+                    self._value = self._factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def set(self, value: T):
+        # swap in a ready-made value, e.g. a stand-in client in benchmarks
+        with self._lock:
+            self._value = value
+            self._pid = os.getpid()
+
+    def reset(self):
+        with self._lock:
+            value, self._value = self._value, None
+            # a value inherited over fork belongs to the parent, only drop the reference
+            if value is not None and self._close is not None and self._pid == os.getpid():
+                self._close(value)
+
+
+def _connect_prisma():
+    from prisma import Prisma
+
+    prisma = Prisma()
+    prisma.connect()
+    return prisma
+
+
+def _caption_generator():
+    # imports openai, so it is only paid for when captions are first needed
+    from caption_generator import CaptionGenerator
+
+    return CaptionGenerator()
+
+
+def _hook_index():
+    from hook_index import HookIndex
+
+    return HookIndex(prisma.get())
+
+
+def _rate_limiter():
+    from rate_limit import RateLimiter
+
+    return RateLimiter()
+
+
+def _transfer_store():
+    from transfer import TransferStore
+
+    return TransferStore()
+
+
+prisma = Lazy(_connect_prisma, close=lambda client: client.disconnect())
+caption_generator = Lazy(_caption_generator)
+hook_index = Lazy(_hook_index)
+rate_limiter = Lazy(_rate_limiter)
+transfer_store = Lazy(_transfer_store)
+
+
+def get_prisma():
+    return prisma.get()
+
+
+def get_caption_generator():
+    return caption_generator.get()
+
+
+def get_hook_index():
+    return hook_index.get()
+
+
+def get_rate_limiter():
+    return rate_limiter.get()
+
+
+def get_transfer_store():
+    return transfer_store.get()
@@ -1,135 +1,137 @@
-from moviepy import *
+import argparse
+import itertools
 import os
+import tempfile
 import requests
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import boto3
-from datetime import datetime
-from flask_sqlalchemy import SQLAlchemy
+from concurrent.futures import ThreadPoolExecutor
+
+import encoding
+import storage
+import tracing
+from stitch_engine import STITCH_BACKENDS, stitch_videos
 
 from dotenv import load_dotenv
 load_dotenv()
-app = Flask(__name__)
-CORS(app)
-
-MYSQL_USER = os.getenv('MYSQL_USER')
-MYSQL_PASS = os.getenv('MYSQL_PASS')
-
-AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
-AWS_SECRET_KEY = os.getenv("AWS_SECRET_KEY")
-BUCKET_NAME = os.getenv("S3_BUCKET")
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_KEY
-)
-
-RDS_ENDPOINT = os.getenv('RDS_ENDPOINT')
-RDS_DB = os.getenv('RDS_DB')
-#change these codes to .env later
-
-s3 = boto3.client("s3", aws_access_key_id=AWS_ACCESS_KEY, aws_secret_access_key=AWS_SECRET_KEY)
-
-#logging into RDS
-app.config["SQLALCHEMY_DATABASE_URI"] = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASS}@{RDS_ENDPOINT}/{RDS_DB}"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db = SQLAlchemy(app)
-
-class Video(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(255), nullable=False)
-    prompt = db.Column(db.String(255), nullable=False)
-    s3_url = db.Column(db.String(500), nullable=False)
-    created = db.Column(db.DateTime, default=datetime.utcnow)
-
-class ProcessedVideo(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(255), nullable=False)
-    s3_url = db.Column(db.String(500), nullable=False)
-    created = db.Column(db.DateTime, default=datetime.utcnow)
-
-class DemoVideo(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(255), nullable=False)
-    s3_url = db.Column(db.String(500), nullable=False)
-    uploaded = db.Column(db.DateTime, default=datetime.utcnow)
-
-#download videos from AWS (hooks only)
+
+#download videos from AWS (hooks and demos)
 def download_video(url, save_path): #requires url from server and the path to save it at
+    if "amazonaws.com/" in url:
+        #objects in our bucket go through the shared, authenticated client
+        return storage.download_file(storage.key_from_url(url), save_path)
     response = requests.get(url, stream=True)
+    response.raise_for_status()
     with open(save_path, "wb") as file:
-        for chunk in response.iter_content(chunk_size=8192):
+        for chunk in response.iter_content(chunk_size=1024 * 1024):
             file.write(chunk)
     return save_path #returns file path where it was downloaded
 
-#stitch videos together
-def stitch_videos(hooks, demos):
-    # checks if number of hooks and number of demos are of parsable length (must be equal number of hooks & demos or demos must be a multiple of hooks)
-    if(len(hooks) != len(demos) | len(demos) % len(hooks) != 0):
-        raise ValueError("Hooks and Demos are not of parsable length.")
-
-    stitched = [None] * len(demos)
-    if(len(hooks) < len(demos)):
-        i = 0
-        while(i < len(demos) -1):
-            for hook in hooks:
-                stitch = concatenate_videoclips([hook, demos[i]])
-                stitched[i] = stitch.write_videofile(f"video{i}.mp4").with_end(17)
-    else:
-        for i in range(len(hooks)):
-            stitch = concatenate_videoclips([hooks[i], demos[i]])
-            stitched[i] = stitch.write_videofile(f"video{i}.mp4").with_end(17)
-
-    return stitched #returns list of stitched video clips
-
-#organizes hooks and demos into lists to be stitched together
-def arrange_video(hook_list, demo_list):
-    #download hook videos from AWS
-    for i in range(len(hook_list)):
-        hook_files = [VideoFileClip(download_video(hook_list[i],f"hvid{i}.mp4"))]
-    #demo video upload
-    for i in range(len(demo_list)):
-        demo_files = [VideoFileClip(download_video(demo_list[i], f"dvid{i}.mp4"))]
-
-    #if they aren't able to be uploaded, raise error
-    if not demo_files:
-        raise FileNotFoundError("No video files found in the specified folder.")
-    if not hook_files:
-        raise ValueError("Could not upload hook files. Check if they have been properly uploaded.")
-
-    #return tuple of hook and demo files
-    return hook_files, demo_files
-
-def process_videos():
+#downloads videos in parallel into work_dir as <prefix>0.mp4, <prefix>1.mp4, ...
+def download_videos(url_list, work_dir, prefix):
+    paths = [os.path.join(work_dir, f"{prefix}{i}.mp4") for i in range(len(url_list))]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(download_video, url_list, paths))
+    return paths
+
+#rows read per query when walking a table
+PAGE_SIZE = int(os.getenv("STITCH_PAGE_SIZE", 500))
+
+#yield the rows of a model page by page, ordered by id, so a big table is never loaded in one query
+def iter_pages(model, where=None, page_size=PAGE_SIZE):
+    cursor = None
+    while True:
+        if cursor is None:
+            rows = model.find_many(where=where or {}, take=page_size, order={'id': 'asc'})
+        else:
+            #keyset pagination on the primary key, each page is an index range scan
+            rows = model.find_many(where=where or {}, take=page_size, skip=1, cursor={'id': cursor}, order={'id': 'asc'})
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        cursor = rows[-1].id
+
+#yield the s3 urls of the given rows (by id), or of every row when ids is None, one page at a time
+def iter_url_pages(model, ids=None, page_size=PAGE_SIZE):
+    if ids is None:
+        for rows in iter_pages(model, page_size=page_size):
+            yield [row.s3_url for row in rows]
+        return
+    ids = list(dict.fromkeys(int(i) for i in ids))
+    for start in range(0, len(ids), page_size):
+        chunk = ids[start:start + page_size]
+        by_id = {row.id: row.s3_url for row in model.find_many(where={'id': {'in': chunk}})}
+        #keep the requested order, pairs refer to positions in it
+        urls = [by_id[i] for i in chunk if i in by_id]
+        if urls:
+            yield urls
+
+def process_videos(prisma, pairs=None, backend='moviepy', hook_ids=None, demo_ids=None, profile=None):
+    #hooks come from the Video table, demos from DemoVideo, restricted to the given ids if any;
+    #every hook may be paired with every demo, so the demos are fetched once and the hooks page by page
+    profile = encoding.get_profile(profile)
+    demos = [url for urls in iter_url_pages(prisma.demovideo, demo_ids) for url in urls]
+    #if there is nothing to stitch, raise error
+    if not demos:
+        raise FileNotFoundError("No demo videos found.")
+    hook_pages = iter_url_pages(prisma.video, hook_ids)
+    first_page = next(hook_pages, None)
+    if first_page is None:
+        raise ValueError("No hook videos found. Check if they have been properly uploaded.")
+    if pairs is not None:
+        pairs = list(dict.fromkeys((int(h), int(d)) for h, d in pairs))
+        for h, d in pairs:
+            if h < 0 or not 0 <= d < len(demos):
+                raise ValueError(f"Pair ({h}, {d}) is out of range for {len(demos)} demos.")
+
+    processed = []
+    offset = 0
+    with tempfile.TemporaryDirectory() as work_dir:
+        demo_paths = download_videos(demos, work_dir, "dvid")
+        for hooks in itertools.chain([first_page], hook_pages):
+            #pairs use positions in the whole hook list, shift them to this page
+            page_pairs = None if pairs is None else [(h - offset, d) for h, d in pairs if offset <= h < offset + len(hooks)]
+            if page_pairs != []:
+                hook_paths = download_videos(hooks, work_dir, "hvid")
+                stitches = stitch_videos(hook_paths, demo_paths, work_dir, backend=backend, pairs=page_pairs,
+                                         profile=profile)
+
+                for stitch in stitches:
+                    hook_name = hooks[stitch["hook"]].split("/")[-1].split(".")[0]
+                    demo_name = demos[stitch["demo"]].split("/")[-1].split(".")[0]
+                    filename = f"{hook_name}_{demo_name}.mp4"
+                    #one key per profile, so a draft stitch never overwrites the published one
+                    video_url = storage.upload_file(stitch["path"], f"stitched/{profile['name']}/{filename}")
+                    processed.append({"filename": filename, "s3_url": video_url})
+
+                #only one page of hooks and its stitches is on disk at a time
+                for path in hook_paths + [stitch["path"] for stitch in stitches]:
+                    os.remove(path)
+            offset += len(hooks)
+
+    #the hook count is only known once every page has been read
+    if pairs is not None and any(h >= offset for h, _ in pairs):
+        raise ValueError(f"Pairs refer to hooks beyond the {offset} hooks found.")
+
+    #one insert (and one round trip) for the whole batch
+    with tracing.span("prisma.processedvideo.create_many", rows=len(processed)):
+        prisma.processedvideo.create_many(data=processed)
+
+    return {"message": "Videos stitched and stored successfully", "videos": [video["s3_url"] for video in processed]}
+
+if __name__ == "__main__":
+    from prisma import Prisma
+
+    parser = argparse.ArgumentParser(description="Stitch every hook with every demo video and store the results.")
+    parser.add_argument("--backend", choices=STITCH_BACKENDS, default="moviepy")
+    parser.add_argument("--hook-ids", type=int, nargs="+", help="Video ids of the hooks to stitch (default: all)")
+    parser.add_argument("--demo-ids", type=int, nargs="+", help="DemoVideo ids of the demos to stitch (default: all)")
+    parser.add_argument("--profile", choices=sorted(encoding.PROFILES), default=encoding.DEFAULT_PROFILE)
+    args = parser.parse_args()
+
+    client = Prisma()
+    client.connect()
     try:
-        hooks = []
-        demos = []
-        videos = Video.query.all()
-        demoVideos = DemoVideo.query.all()
-
-        #retrieve s3 urls for hooks and demos
-        hooks = [video.s3_url for video in videos]
-        demos = [demo.s3_url for demo in demoVideos]
-
-        processed_videos = arrange_video(hooks, demos)
-        hook_list, demo_list = processed_videos
-
-        #stitch processed videos
-        stitches = stitch_videos(hook_list, demo_list)
-
-        for video_url in stitches:
-            filename = video_url.split("/")[-1]
-            new_processed_video = ProcessedVideo(
-                filename=filename,
-                s3_url=video_url
-            )
-
-            # Add to the database session
-            db.session.add(new_processed_video)
-
-            # Commit the transaction to save the stitched videos
-        db.session.commit()
-        return jsonify({"message": "Videos stitched and stored successfully", "videos": stitches}), 201
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({"error":str(e)}), 500
\ No newline at end of file
+        print(process_videos(client, backend=args.backend, hook_ids=args.hook_ids, demo_ids=args.demo_ids,
+                             profile=args.profile))
+    finally:
+        client.disconnect()
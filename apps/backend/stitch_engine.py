@@ -0,0 +1,113 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from moviepy.editor import VideoFileClip, concatenate_videoclips
+
+import encoding
+import ffmpeg_backend
+import frame_stream
+
+#length of a stitched video in seconds
+MAX_DURATION = 17
+
+#stitch backends: the render backends, plus 'stream' which decodes one source at a time into a fixed-size frame ring
+STITCH_BACKENDS = ffmpeg_backend.BACKENDS + ('stream',)
+
+#stitch worker processes, one per core unless overridden
+STITCH_WORKERS = int(os.getenv("STITCH_WORKERS", os.cpu_count() or 1))
+
+#plan which hook goes in front of which demo
+def plan_pairs(num_hooks, num_demos, pairs=None):
+    if num_hooks == 0 or num_demos == 0:
+        raise ValueError("Need at least one hook and one demo to stitch.")
+    if pairs is None:
+        #full hook x demo matrix
+        return [(h, d) for h in range(num_hooks) for d in range(num_demos)]
+
+    pairs = list(dict.fromkeys((int(h), int(d)) for h, d in pairs))
+    for h, d in pairs:
+        if not (0 <= h < num_hooks and 0 <= d < num_demos):
+            raise ValueError(f"Pair ({h}, {d}) is out of range for {num_hooks} hooks and {num_demos} demos.")
+    return pairs
+
+#split the plan into worker tasks, pairs sharing a hook stay together so the hook is opened once per task
+def group_pairs(pairs, max_workers):
+    by_hook = {}
+    for h, d in pairs:
+        by_hook.setdefault(h, []).append(d)
+
+    #cap the task size so a single hook with many demos still spreads over the workers
+    chunk = max(1, -(-len(pairs) // max(1, max_workers)))
+    tasks = []
+    for h, demos in by_hook.items():
+        for i in range(0, len(demos), chunk):
+            tasks.append((h, demos[i:i + chunk]))
+    return tasks
+
+#render one hook followed by one demo into output_path, trimmed to max_duration before encoding
+def render_pair(hook, demo, output_path, backend='moviepy', max_duration=MAX_DURATION, threads=None, profile=None):
+    render_group(hook, [(demo, output_path)], backend, max_duration, threads, profile)
+    return output_path
+
+#render one hook in front of several demos (runs in a worker process)
+def render_group(hook_path, jobs, backend='moviepy', max_duration=MAX_DURATION, threads=None, profile=None):
+    if backend not in STITCH_BACKENDS:
+        raise ValueError(f"Unknown stitch backend '{backend}', expected one of {STITCH_BACKENDS}")
+    profile = encoding.get_profile(profile)
+
+    if backend == 'ffmpeg':
+        #concat straight from the files, stream copy when both clips share codec parameters
+        for demo_path, output_path in jobs:
+            ffmpeg_backend.concat_videos([hook_path, demo_path], output_path, max_duration, profile=profile, threads=threads)
+        return [output_path for _, output_path in jobs]
+
+    if backend == 'stream':
+        #bounded memory: one reader per output, closed as soon as its clip is used up (see frame_stream)
+        for demo_path, output_path in jobs:
+            frame_stream.stream_concat([hook_path, demo_path], output_path, max_duration, profile=profile, threads=threads)
+        return [output_path for _, output_path in jobs]
+
+    hook = VideoFileClip(hook_path)
+    try:
+        hook_part = hook.subclip(0, min(hook.duration, max_duration)) if max_duration else hook
+        for demo_path, output_path in jobs:
+            demo = VideoFileClip(demo_path)
+            try:
+                parts = [hook_part]
+                remaining = max_duration - hook_part.duration if max_duration else demo.duration
+                if remaining > 0:
+                    parts.append(demo.subclip(0, min(demo.duration, remaining)))
+                #compose, hooks and demos usually differ in size
+                stitch = concatenate_videoclips(parts, method="compose")
+                #mixed sources, so the audio is re-encoded; its temp file goes next to the output, not the cwd
+                stitch.write_videofile(output_path, codec=profile["codec"], preset=profile["preset"],
+                                       threads=profile["threads"] or threads, audio=profile["audio"] != "none",
+                                       audio_codec="aac", temp_audiofile=f"{output_path}.audio.m4a",
+                                       ffmpeg_params=encoding.moviepy_params(profile), logger=None)
+            finally:
+                demo.close()
+    finally:
+        hook.close()
+    return [output_path for _, output_path in jobs]
+
+#stitch videos together
+def stitch_videos(hooks, demos, output_dir, backend='moviepy', pairs=None, max_workers=None, max_duration=MAX_DURATION,
+                  profile=None):
+    #renders every planned (hook, demo) pair from local files in parallel worker processes
+    plan = plan_pairs(len(hooks), len(demos), pairs)
+    workers = max(1, min(max_workers or STITCH_WORKERS, len(plan)))
+    encoder_threads = max(1, (os.cpu_count() or 1) // workers)
+    outputs = {pair: os.path.join(output_dir, f"stitch_{pair[0]}_{pair[1]}.mp4") for pair in plan}
+
+    tasks = group_pairs(plan, workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [
+            executor.submit(render_group, hooks[h], [(demos[d], outputs[(h, d)]) for d in task_demos],
+                            backend, max_duration, encoder_threads, encoding.get_profile(profile))
+            for h, task_demos in tasks
+        ]
+        for future in futures:
+            future.result()
+
+    return [{"hook": h, "demo": d, "path": outputs[(h, d)]} for h, d in plan] #returns stitched video files
@@ -0,0 +1,259 @@
+import os
+import threading
+import time
+from typing import Any, BinaryIO, Dict, Optional
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from dotenv import load_dotenv
+
+import tracing
+from local_s3 import LocalS3Client
+
+load_dotenv()
+
+S3_BUCKET = os.getenv("S3_BUCKET", "lookbk-video-bucket")
+S3_REGION = os.getenv("S3_REGION", "us-west-1")
+# when set, objects are read and written in this directory instead of S3 (offline development and benchmarks)
+S3_LOCAL_DIR = os.getenv("S3_LOCAL_DIR")
+
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 50))
+
+# multipart settings for every upload/download that goes through the transfer manager
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=int(os.getenv("S3_MULTIPART_THRESHOLD", 8 * 1024 * 1024)),
+    multipart_chunksize=int(os.getenv("S3_MULTIPART_CHUNKSIZE", 8 * 1024 * 1024)),
+    max_concurrency=int(os.getenv("S3_MAX_CONCURRENCY", 10)),
+    use_threads=True,
+)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+class StorageMetrics:
+    """Request counts, bytes moved and time spent per storage operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops: Dict[str, Dict[str, float]] = {}
+
+    def record(self, op: str, nbytes: int, seconds: float):
+        with self._lock:
+            stats = self._ops.setdefault(op, {"requests": 0, "bytes": 0, "seconds": 0.0})
+            stats["requests"] += 1
+            stats["bytes"] += nbytes
+            stats["seconds"] += seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                op: dict(stats, bytes_per_sec=stats["bytes"] / stats["seconds"] if stats["seconds"] else 0.0)
+                for op, stats in self._ops.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._ops.clear()
+
+    def render(self, prefix: str = "lookbk") -> str:
+        """The totals in the Prometheus text format, appended to the span metrics on /metrics."""
+        ops = self.snapshot()
+        lines = []
+        for counter, description in (("requests", "Storage requests."),
+                                     ("bytes", "Bytes moved to and from storage."),
+                                     ("seconds", "Seconds spent in storage requests, body reads included.")):
+            name = f"{prefix}_storage_{counter}_total"
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            for op, stats in sorted(ops.items()):
+                lines.append(f'{name}{{op="{op}"}} {stats[counter]}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = StorageMetrics()
+
+
+def get_client():
+    """
+    Shared S3 client for the whole process.
+
+    boto3 clients are thread-safe, so one client (and its connection pool) is reused by
+    every request, job worker and transfer thread instead of reconnecting for each call.
+    It is created on first use and again in forked children, whose inherited pool sockets
+    still belong to the parent.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                if S3_LOCAL_DIR:
+                    _client = LocalS3Client(S3_LOCAL_DIR)
+                else:
+                    _client = boto3.session.Session().client(
+                        "s3",
+                        aws_access_key_id=os.getenv("AWS_ACCESS_KEY"),
+                        aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
+                        region_name=S3_REGION,
+                        config=Config(
+                            signature_version="s3v4",
+                            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                            tcp_keepalive=True,
+                            retries={"max_attempts": 5, "mode": "adaptive"},
+                        ),
+                    )
+                _client_pid = os.getpid()
+    return _client
+
+
+def set_client(client):
+    # swap the shared client, e.g. for a LocalS3Client in benchmarks
+    global _client, _client_pid
+    with _client_lock:
+        _client = client
+        _client_pid = os.getpid()
+
+
+def object_url(key: str, bucket: Optional[str] = None) -> str:
+    return f"https://{bucket or S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{key}"
+
+
+def key_from_url(url: str) -> str:
+    # object key of an s3 url built by object_url (or a bare key)
+    if "amazonaws.com/" in url:
+        return url.split("amazonaws.com/", 1)[1].split("?")[0]
+    return url
+
+
+class _CountingReader:
+    def __init__(self, fileobj: BinaryIO, expected: Optional[int] = None):
+        self._fileobj = fileobj
+        self._expected = expected
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self.bytes_read += len(data)
+        # a stream cut short (or running long) must fail the upload, not store a truncated object
+        if self._expected is not None and ((not data and self.bytes_read < self._expected)
+                                           or self.bytes_read > self._expected):
+            raise IOError(f"stream ended after {self.bytes_read} bytes, expected {self._expected}")
+        return data
+
+
+class _MeteredBody:
+    """A get_object body that records the bytes read and the time spent reading them once it is drained or closed."""
+
+    def __init__(self, body, request_seconds: float):
+        self._body = body
+        self._seconds = request_seconds
+        self._recorded = False
+        self.bytes_read = 0
+
+    def read(self, amt=None):
+        start = time.monotonic()
+        data = self._body.read(amt)
+        self._seconds += time.monotonic() - start
+        self.bytes_read += len(data)
+        if not data or amt is None:
+            self._record()
+        return data
+
+    def iter_chunks(self, chunk_size: int = 1024 * 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._record()
+        self._body.close()
+
+    def _record(self):
+        if not self._recorded:
+            self._recorded = True
+            metrics.record("get", self.bytes_read, self._seconds)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._body, name)
+
+
+def put_stream(fileobj: BinaryIO, key: str, content_type: str = "video/mp4", bucket: Optional[str] = None,
+               metadata: Optional[Dict[str, str]] = None, client=None, content_length: Optional[int] = None) -> str:
+    """
+    Upload a readable stream without buffering it to disk, multipart above the threshold.
+
+    Args:
+        content_length (Optional[int]): Expected size; a stream of any other length raises
+            and the upload is aborted, so nothing is stored
+
+    Returns:
+        str: URL of the uploaded object
+    """
+    extra: Dict[str, Any] = {"ContentType": content_type}
+    if metadata:
+        extra["Metadata"] = metadata
+    reader = _CountingReader(fileobj, content_length)
+    start = time.monotonic()
+    with tracing.span("s3.put", key=key) as span:
+        (client or get_client()).upload_fileobj(reader, bucket or S3_BUCKET, key, ExtraArgs=extra, Config=TRANSFER_CONFIG)
+        span.set(bytes=reader.bytes_read)
+    metrics.record("put", reader.bytes_read, time.monotonic() - start)
+    return object_url(key, bucket)
+
+
+def get_stream(key: str, bucket: Optional[str] = None, byte_range: Optional[str] = None, client=None):
+    """
+    Open an object for streaming reads.
+
+    Args:
+        byte_range (Optional[str]): HTTP range such as "bytes=0-1048575"
+
+    Returns:
+        The response body, a file-like object to read() or iter_chunks() from; the storage
+        metrics count the bytes actually read and the time spent reading them
+    """
+    params: Dict[str, Any] = {"Bucket": bucket or S3_BUCKET, "Key": key}
+    if byte_range:
+        params["Range"] = byte_range
+    start = time.monotonic()
+    # the span times the request only, the body is read after it returns
+    with tracing.span("s3.get", key=key):
+        response = (client or get_client()).get_object(**params)
+    return _MeteredBody(response["Body"], time.monotonic() - start)
+
+
+def upload_file(path: str, key: str, content_type: str = "video/mp4", bucket: Optional[str] = None,
+                metadata: Optional[Dict[str, str]] = None, client=None) -> str:
+    extra: Dict[str, Any] = {"ContentType": content_type}
+    if metadata:
+        extra["Metadata"] = metadata
+    start = time.monotonic()
+    with tracing.span("s3.put", key=key, bytes=os.path.getsize(path)):
+        (client or get_client()).upload_file(path, bucket or S3_BUCKET, key, ExtraArgs=extra, Config=TRANSFER_CONFIG)
+    metrics.record("put", os.path.getsize(path), time.monotonic() - start)
+    return object_url(key, bucket)
+
+
+def download_file(key: str, path: str, bucket: Optional[str] = None, client=None) -> str:
+    start = time.monotonic()
+    with tracing.span("s3.get", key=key) as span:
+        (client or get_client()).download_file(bucket or S3_BUCKET, key, path, Config=TRANSFER_CONFIG)
+        span.set(bytes=os.path.getsize(path))
+    metrics.record("get", os.path.getsize(path), time.monotonic() - start)
+    return path
+
+
+def presign(key: str, bucket: Optional[str] = None, expires: int = 3600, method: str = "get_object", client=None) -> str:
+    metrics.record("presign", 0, 0.0)
+    return (client or get_client()).generate_presigned_url(
+        method, Params={"Bucket": bucket or S3_BUCKET, "Key": key}, ExpiresIn=expires
+    )
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+
+import services  # noqa: E402
+from rate_limit import RateLimiter  # noqa: E402
+
+
+@pytest.fixture
+def rate_limiter(tmp_path, monkeypatch):
+    # provider calls go through a limiter on a throwaway database, never the shared one in the working directory
+    limiter = RateLimiter(str(tmp_path / "ratelimit.sqlite3"))
+    monkeypatch.setattr(services, "get_rate_limiter", lambda: limiter)
+    return limiter
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from compare_backends import compare, make_clip, psnr
+from ffmpeg_backend import overlay_captions
+from text_overlay import create_caption_sprite
+
+
+@pytest.fixture(scope="module")
+def results(tmp_path_factory):
+    # small clips keep the MoviePy references quick; every case is rendered once for the module
+    tmp = str(tmp_path_factory.mktemp("backends"))
+    return {result["name"]: result for result in compare(tmp, 160, 284, 1)}
+
+
+@pytest.mark.parametrize("name", ["overlay (fast)", "overlay (ffmpeg)", "concat (filter graph)",
+                                  "concat (stream copy)", "concat (stream)"])
+def test_backend_matches_moviepy(results, name):
+    result = results[name]
+    assert result["ok"], result
+
+
+def test_empty_caption_copies_the_frames(tmp_path):
+    source = make_clip(str(tmp_path / "source.mp4"), 160, 284, 1, audio=False)
+    sprite, offset = create_caption_sprite("", (160, 284))
+    assert sprite.size == 0
+    outputs = [{"output_path": str(tmp_path / "empty.mp4"), "sprite": sprite, "offset": offset},
+               {"output_path": str(tmp_path / "captioned.mp4"),
+                "sprite": create_caption_sprite("hello", (160, 284))[0],
+                "offset": create_caption_sprite("hello", (160, 284))[1]}]
+    overlay_captions(source, outputs)
+    assert os.path.getsize(outputs[1]["output_path"]) > 0
+    score, duration_diff = psnr(source, outputs[0]["output_path"])
+    assert score >= 30 and duration_diff < 0.5
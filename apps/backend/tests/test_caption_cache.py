@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+import caption_cache
+from caption_cache import CaptionCache, MemoryCaptionStore, SQLiteCaptionStore
+from caption_generator import CaptionGenerator
+from fakes import FakeOpenAI
+
+POOL = [f"caption {i}" for i in range(15)]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(caption_cache, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, clock):
+    if request.param == "memory":
+        return MemoryCaptionStore(max_entries=2)
+    return SQLiteCaptionStore(str(tmp_path / "captions.sqlite3"), max_entries=2)
+
+
+def test_larger_pool_serves_smaller_requests(store):
+    cache = CaptionCache(store, ttl=60)
+    cache.set("Cooking  Video", POOL)
+
+    assert cache.get("cooking video", 3) == POOL[:3]
+    assert cache.get("cooking video", 20) is None
+    # a smaller pool never replaces a larger one that is still fresh
+    cache.set("cooking video", ["other"])
+    assert cache.get("cooking video", 15) == POOL
+    assert cache.info()["hits"] == 2 and cache.info()["misses"] == 1
+
+
+def test_pools_expire_after_the_ttl(store, clock):
+    cache = CaptionCache(store, ttl=60)
+    cache.set("cooking", POOL)
+
+    clock.now += 61
+    assert cache.get("cooking", 3) is None
+    assert store.get("cooking") is None
+    cache.set("cooking", ["fresh"])
+    assert cache.get("cooking", 1) == ["fresh"]
+
+
+def test_least_recently_used_pool_is_evicted(store, clock):
+    store.set("a", ["a"], clock.now)
+    clock.now += 1
+    store.set("b", ["b"], clock.now)
+    clock.now += 1
+    assert store.get("a") is not None
+    clock.now += 1
+    store.set("c", ["c"], clock.now)
+
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path, clock):
+    path = str(tmp_path / "captions.sqlite3")
+    CaptionCache(SQLiteCaptionStore(path)).set("cooking", POOL)
+
+    assert CaptionCache(SQLiteCaptionStore(path)).get("Cooking", 5) == POOL[:5]
+
+
+def test_batch_requests_each_prompt_once(monkeypatch, rate_limiter):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    generator = CaptionGenerator(cache=CaptionCache(MemoryCaptionStore()))
+    generator.client = FakeOpenAI(latency=0)
+
+    results = generator.generate_captions_batch(["Cooking", " cooking ", "Travel"], 3)
+
+    assert generator.client.calls == 2
+    assert results[0] == results[1] and len(results[0]) == 3 and len(results[2]) == 3
+    # everything is cached now, smaller requests included
+    assert generator.generate_captions_batch(["COOKING", "travel"], 2) == [results[0][:2], results[2][:2]]
+    assert generator.client.calls == 2
@@ -0,0 +1,11 @@
+from caption_layout import get_metrics, layout_caption, safe_area
+
+
+def test_overlong_caption_fits_the_safe_area():
+    layout = layout_caption("word " * 2000, (360, 640))
+    left, top, right, bottom = safe_area((360, 640))
+
+    assert not layout["fits"]
+    assert layout["lines"][-1].endswith(get_metrics("Arial").ellipsis)
+    assert max(layout["widths"]) <= right - left
+    assert layout["box"][3] <= bottom - top
@@ -0,0 +1,107 @@
+import base64
+import hashlib
+import io
+import os
+import random
+
+from PIL import Image
+
+import image_prep
+from image_prep import PromptImageCache, prepare
+
+TARGET = image_prep.PROMPT_IMAGE_SIZES["gen3a_turbo"]
+
+
+def noise_image(path, size, mode="RGB", seed=0):
+    # random pixels, so nothing compresses well and re-encoding has something to save
+    rng = random.Random(seed)
+    image = Image.frombytes(mode, size, rng.randbytes(size[0] * size[1] * len(mode)))
+    image.save(path)
+    return path
+
+
+def decode(data_uri):
+    header, _, payload = data_uri.partition(",")
+    return header, Image.open(io.BytesIO(base64.b64decode(payload)))
+
+
+def test_small_images_are_cropped_but_never_upscaled(tmp_path):
+    path = noise_image(tmp_path / "square.png", (400, 400))
+
+    data, mime = prepare(str(path), TARGET)
+
+    assert mime == "image/jpeg"
+    assert Image.open(io.BytesIO(data)).size == (400, 240)
+
+
+def test_large_images_are_scaled_down_to_the_target(tmp_path):
+    path = noise_image(tmp_path / "portrait.jpg", (1000, 2000))
+
+    data, mime = prepare(str(path), TARGET)
+
+    assert mime == "image/jpeg"
+    assert Image.open(io.BytesIO(data)).size == (1000, 600)
+    path = noise_image(tmp_path / "wide.png", (3000, 1500))
+    assert Image.open(io.BytesIO(prepare(str(path), TARGET)[0])).size == TARGET
+
+
+def test_transparent_images_stay_png(tmp_path):
+    path = noise_image(tmp_path / "logo.png", (320, 192), mode="RGBA")
+
+    entry = PromptImageCache().prompt_image(str(path), "gen3a_turbo")
+
+    header, image = decode(entry["data_uri"])
+    assert header == "data:image/png;base64"
+    assert entry["mime"] == "image/png" and image.mode == "RGBA"
+    assert entry["bytes"] == len(entry["data_uri"])
+
+
+def test_bytes_saved_against_the_raw_file(tmp_path):
+    path = noise_image(tmp_path / "big.png", (1600, 1600))
+    cache = PromptImageCache()
+
+    entry = cache.prompt_image(str(path), "gen3a_turbo")
+
+    assert entry["data_uri"].startswith("data:image/jpeg;base64,")
+    assert entry["bytes_saved"] == image_prep._raw_payload_bytes(os.path.getsize(path)) - entry["bytes"]
+    assert entry["bytes_saved"] > 0
+    assert cache.prompt_image(str(path), "gen3a_turbo")["cached"]
+    assert cache.info()["bytes_saved"] == 2 * entry["bytes_saved"]
+
+
+def test_rewritten_files_are_prepared_again(tmp_path):
+    path = str(noise_image(tmp_path / "stock.png", (200, 200), seed=1))
+    cache = PromptImageCache()
+    first = cache.prompt_image(path, "gen3a_turbo")
+    assert cache.prompt_image(path, "gen3a_turbo")["cached"]
+
+    # a different size on disk
+    noise_image(path, (300, 300), seed=1)
+    second = cache.prompt_image(path, "gen3a_turbo")
+    assert not second["cached"] and second["data_uri"] != first["data_uri"]
+
+    # the same size with a new mtime
+    before = cache.digest(path)
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    data[len(data) // 2] ^= 0xFF
+    stat = os.stat(path)
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert os.path.getsize(path) == stat.st_size
+    assert cache.digest(path) == hashlib.sha256(data).hexdigest() != before
+
+
+def test_digests_are_capped(tmp_path):
+    paths = [str(noise_image(tmp_path / f"{i}.png", (16, 16), seed=i)) for i in range(3)]
+    cache = PromptImageCache(max_digests=2)
+
+    digests = [cache.digest(path) for path in paths]
+    assert len(set(digests)) == 3
+    assert cache.info()["digests"] == 2
+    # the least recently used path was evicted, the other two are still known
+    assert list(cache._digests) == [image_prep._stat_key(path) for path in paths[1:]]
+    cache.digest(paths[1])
+    cache.digest(paths[0])
+    assert list(cache._digests) == [image_prep._stat_key(path) for path in (paths[1], paths[0])]
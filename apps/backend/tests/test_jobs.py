@@ -0,0 +1,110 @@
+import queue
+import time
+
+import pytest
+
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobProgress, JobQueue, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def job_queue(store):
+    job_queue = JobQueue(store, num_workers=1, poll_interval=0.05)
+    yield job_queue
+    job_queue.stop(timeout=5)
+
+
+def wait_for(store, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = store.get(job_id)
+        if job["status"] in (SUCCEEDED, FAILED):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_submit_claim_finish(store):
+    job_id = store.create("render", {"caption": "hello"})
+    assert store.get(job_id)["status"] == QUEUED
+
+    job = store.claim_next(["render"])
+    assert job == {"id": job_id, "kind": "render", "payload": {"caption": "hello"}}
+    assert store.get(job_id)["status"] == RUNNING
+    assert store.claim_next(["render"]) is None
+
+    store.finish(job_id, result={"s3_url": "u"})
+    finished = store.get(job_id)
+    assert (finished["status"], finished["result"], finished["error"]) == (SUCCEEDED, {"s3_url": "u"}, None)
+
+
+def test_queue_runs_submitted_jobs(job_queue, store):
+    job_queue.register("double", lambda payload, progress: payload["n"] * 2)
+    job_queue.start()
+
+    job = wait_for(store, job_queue.submit("double", {"n": 21}))
+
+    assert (job["status"], job["result"]) == (SUCCEEDED, 42)
+    assert job["timings"]["spans"]["job.double"]["count"] == 1
+    with pytest.raises(ValueError):
+        job_queue.submit("unknown", {})
+
+
+def test_exception_without_message_fails_the_job(job_queue, store):
+    def handler(payload, progress):
+        with progress.stage("download"):
+            raise queue.Empty()
+
+    job_queue.register("empty", handler)
+    job_queue.start()
+
+    job = wait_for(store, job_queue.submit("empty", {}))
+
+    assert (job["status"], job["result"], job["error"]) == (FAILED, None, "Empty")
+    assert job["stages"]["download"]["status"] == FAILED
+
+
+def test_requeue_stale_picks_up_jobs_without_a_heartbeat(store):
+    job_id = store.create("render", {})
+    store.claim_next(["render"])
+    JobProgress(store, job_id).emit("video", index=0)
+
+    # a fresh heartbeat keeps the job running
+    store.requeue_stale(older_than=60)
+    assert store.get(job_id)["status"] == RUNNING
+
+    # the heartbeat lapsed: the job is queued again and its published events are dropped for the rerun
+    store.requeue_stale(older_than=-1)
+    job = store.get(job_id)
+    assert (job["status"], job["started"]) == (QUEUED, None)
+    assert store.events(job_id) == []
+    assert store.claim_next(["render"])["id"] == job_id
+
+
+def test_heartbeat_keeps_long_jobs_running(store):
+    job_id = store.create("render", {})
+    store.claim_next(["render"])
+    time.sleep(0.2)
+
+    store.heartbeat([job_id])
+    store.requeue_stale(older_than=0.1)
+
+    assert store.get(job_id)["status"] == RUNNING
+
+
+def test_emitted_events_come_back_in_order(store):
+    job_id = store.create("generate", {})
+    progress = JobProgress(store, job_id)
+    for index in range(3):
+        progress.emit("video", index=index)
+    progress.emit("done")
+
+    events = store.events(job_id)
+    assert [(event["event"], event["data"]) for event in events] == [
+        ("video", {"index": 0}), ("video", {"index": 1}), ("video", {"index": 2}), ("done", {})]
+    assert [event["seq"] for event in events] == sorted(event["seq"] for event in events)
+    assert [event["data"] for event in store.events(job_id, after=events[1]["seq"])] == [{"index": 2}, {}]
@@ -0,0 +1,83 @@
+import io
+import os
+
+import pytest
+
+import storage
+from local_s3 import LocalS3Client
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def s3(tmp_path):
+    return LocalS3Client(str(tmp_path / "s3"))
+
+
+def test_upload_file_round_trip(s3, tmp_path):
+    path = tmp_path / "video.mp4"
+    data = os.urandom(300_000)
+    path.write_bytes(data)
+
+    url = storage.upload_file(str(path), "hooks/video.mp4", bucket=BUCKET, metadata={"render-key": "abc"}, client=s3)
+
+    assert storage.key_from_url(url) == "hooks/video.mp4"
+    assert storage.get_stream("hooks/video.mp4", bucket=BUCKET, client=s3).read() == data
+    head = s3.head_object(Bucket=BUCKET, Key="hooks/video.mp4")
+    assert head["ContentLength"] == len(data)
+    assert head["ContentType"] == "video/mp4"
+    assert head["Metadata"] == {"render-key": "abc"}
+
+
+def test_put_stream_round_trip(s3):
+    data = os.urandom(1_000_000)
+
+    storage.put_stream(io.BytesIO(data), "hooks/stream.mp4", bucket=BUCKET, client=s3)
+
+    assert storage.get_stream("hooks/stream.mp4", bucket=BUCKET, client=s3).read() == data
+
+
+def test_get_stream_range(s3):
+    data = bytes(range(256)) * 16
+    storage.put_stream(io.BytesIO(data), "hooks/range.bin", bucket=BUCKET, client=s3)
+
+    body = storage.get_stream("hooks/range.bin", bucket=BUCKET, byte_range="bytes=100-299", client=s3)
+
+    assert body.read() == data[100:300]
+
+
+def test_download_file_and_missing_key(s3, tmp_path):
+    storage.put_stream(io.BytesIO(b"hello"), "a.txt", content_type="text/plain", bucket=BUCKET, client=s3)
+
+    path = storage.download_file("a.txt", str(tmp_path / "a.txt"), bucket=BUCKET, client=s3)
+
+    with open(path, "rb") as f:
+        assert f.read() == b"hello"
+    with pytest.raises(Exception) as error:
+        storage.get_stream("missing.txt", bucket=BUCKET, client=s3)
+    assert error.value.response["Error"]["Code"] == "NoSuchKey"
+
+
+def test_get_stream_metrics_count_bytes_read(s3):
+    data = os.urandom(100_000)
+    storage.put_stream(io.BytesIO(data), "hooks/metered.bin", bucket=BUCKET, client=s3)
+    storage.metrics.reset()
+
+    body = storage.get_stream("hooks/metered.bin", bucket=BUCKET, client=s3)
+    assert storage.metrics.snapshot() == {}
+    assert b"".join(body.iter_chunks(30_000)) == data
+    body.close()
+
+    assert storage.metrics.snapshot()["get"]["requests"] == 1
+    assert storage.metrics.snapshot()["get"]["bytes"] == len(data)
+    assert 'lookbk_storage_bytes_total{op="get"} 100000' in storage.metrics.render()
+
+
+def test_put_stream_short_stream_stores_nothing(s3):
+    with pytest.raises(IOError):
+        storage.put_stream(io.BytesIO(b"x" * 1000), "short.bin", bucket=BUCKET, client=s3, content_length=2000)
+
+    with pytest.raises(Exception) as error:
+        s3.head_object(Bucket=BUCKET, Key="short.bin")
+    assert error.value.response["Error"]["Code"] == "404"
+    assert not [name for _, _, files in os.walk(s3.root) for name in files if name.endswith(".part")]
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from pipeline import Stage, assign_captions, make_queue, run
+
+
+def test_items_flow_through_every_stage():
+    doubled, results = make_queue(), make_queue(100)
+    stages = [
+        Stage("source", lambda: range(10), outbox=doubled),
+        Stage("double", lambda item: [item * 2], inbox=doubled, outbox=results, workers=3),
+    ]
+
+    run(stages)
+
+    items = []
+    while not results.empty():
+        items.append(results.get())
+    assert sorted(item for item in items if isinstance(item, int)) == list(range(0, 20, 2))
+    assert [stage.done for stage in stages] == [10, 10]
+
+
+def test_middle_stage_error_drains_and_stops_the_pipeline():
+    first, second = make_queue(1), make_queue(1)
+    produced, stored = [], []
+
+    def source():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    def middle(item):
+        if item == 3:
+            raise RuntimeError("encode failed")
+        return [item]
+
+    stages = [
+        Stage("source", source, outbox=first),
+        Stage("middle", middle, inbox=first, outbox=second),
+        Stage("sink", lambda item: stored.append(item), inbox=second),
+    ]
+
+    with pytest.raises(RuntimeError, match="encode failed"):
+        run(stages)
+
+    # the source was not blocked by the failed stage, and every stage finished
+    assert len(produced) == 100
+    assert stored == [0, 1, 2]
+    assert not any(stage._thread.is_alive() for stage in stages)
+
+
+def test_full_queue_holds_the_source_back():
+    queue = make_queue(2)
+    release = threading.Event()
+    produced = []
+
+    def source():
+        for i in range(50):
+            produced.append(i)
+            yield i
+
+    def sink(item):
+        release.wait()
+
+    stages = [Stage("source", source, outbox=queue), Stage("sink", sink, inbox=queue)]
+    for stage in stages:
+        stage.start()
+    time.sleep(0.2)
+
+    # one item in the sink, two queued and one waiting to be put
+    assert len(produced) <= 4
+    release.set()
+    for stage in stages:
+        stage.join()
+    assert len(produced) == 50 and stages[1].done == 50
+
+
+def test_batch_stage_gets_every_waiting_item():
+    queue = make_queue(10)
+    batches = []
+    source = Stage("source", lambda: range(6), outbox=queue).start().join()
+    sink = Stage("sink", lambda items: batches.append(list(items)), inbox=queue, batch=True)
+
+    run([sink])
+
+    assert source.done == 6
+    assert batches == [[0, 1, 2, 3, 4, 5]]
+
+
+def test_assign_captions_round_robin():
+    assert assign_captions(5, 2) == [[0, 2, 4], [1, 3]]
+    assert assign_captions(2, 3) == [[0], [1], [0]]
+    assert assign_captions(0, 2) == [[], []]
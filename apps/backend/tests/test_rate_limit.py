@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limit
+
+# one token per second, two in the bucket when it is full
+LIMITS = {"provider": (60, 2)}
+
+
+class Clock:
+    """Stands in for the time module: sleeping moves the clock instead of blocking."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class Throttled(Exception):
+    def __init__(self, status_code=429, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def limiter(tmp_path, clock):
+    return rate_limit.RateLimiter(str(tmp_path / "ratelimit.sqlite3"), limits=LIMITS)
+
+
+def test_take_spends_the_burst_then_refills(limiter, clock):
+    assert limiter._take("provider:default", 1.0, 2.0, rate_limit.INTERACTIVE, "a") == 0
+    assert limiter._take("provider:default", 1.0, 2.0, rate_limit.INTERACTIVE, "a") == 0
+    assert limiter._take("provider:default", 1.0, 2.0, rate_limit.INTERACTIVE, "a") == pytest.approx(1.0)
+
+    clock.sleep(0.5)
+    assert limiter._take("provider:default", 1.0, 2.0, rate_limit.INTERACTIVE, "a") == pytest.approx(0.5)
+    clock.sleep(0.5)
+    assert limiter._take("provider:default", 1.0, 2.0, rate_limit.INTERACTIVE, "a") == 0
+
+
+def test_processes_share_the_bucket(limiter):
+    other = rate_limit.RateLimiter(limiter.path, limits=LIMITS)
+    limiter.acquire("provider")
+    limiter.acquire("provider")
+
+    assert other._take("provider:default", 1.0, 2.0, rate_limit.INTERACTIVE, "b") > 0
+
+
+def test_batch_steps_aside_for_queued_interactive_waiter(limiter, clock):
+    bucket = "provider:default"
+    for _ in range(2):
+        limiter._take(bucket, 1.0, 2.0, rate_limit.INTERACTIVE, "warmup")
+    assert limiter._take(bucket, 1.0, 2.0, rate_limit.INTERACTIVE, "interactive") > 0
+
+    clock.sleep(2)
+    # a token is free, but the queued interactive waiter goes first
+    assert limiter._take(bucket, 1.0, 2.0, rate_limit.BATCH, "batch") == rate_limit.MAX_SLEEP
+    assert limiter._take(bucket, 1.0, 2.0, rate_limit.INTERACTIVE, "interactive") == 0
+    assert limiter._take(bucket, 1.0, 2.0, rate_limit.BATCH, "batch") == 0
+
+
+def test_priority_context_sets_the_waiter_level(limiter, monkeypatch):
+    levels = []
+    take = limiter._take
+    monkeypatch.setattr(limiter, "_take", lambda bucket, rate, burst, level, waiter:
+                        levels.append(level) or take(bucket, rate, burst, level, waiter))
+
+    limiter.acquire("provider")
+    with rate_limit.priority("batch"):
+        limiter.acquire("provider")
+
+    assert levels == [rate_limit.INTERACTIVE, rate_limit.BATCH]
+    with pytest.raises(ValueError):
+        rate_limit.get_priority("urgent")
+
+
+def test_retry_after_reads_headers_and_errors(clock):
+    assert rate_limit.retry_after(Throttled(headers={"Retry-After-Ms": "1500"})) == 1.5
+    assert rate_limit.retry_after(Throttled(503, {"retry-after": "3"})) == 3.0
+    assert rate_limit.retry_after(Throttled()) == 0.0
+    assert rate_limit.retry_after(Throttled(500, {"retry-after": "3"})) is None
+    assert rate_limit.retry_after(ValueError("not an HTTP error")) is None
+
+    # the older openai errors carry http_status and headers on the exception
+    legacy = Exception("rate limited")
+    legacy.http_status, legacy.headers = 429, {"Retry-After": "7"}
+    assert rate_limit.retry_after(legacy) == 7.0
+
+    date = datetime.fromtimestamp(clock.now, timezone.utc) + timedelta(seconds=30)
+    assert rate_limit.retry_after(Throttled(headers={"retry-after": format_datetime(date, usegmt=True)})) == 30.0
+
+
+def test_call_retries_throttled_calls_after_retry_after(limiter, clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_BACKOFF", 0.0)
+    calls = []
+
+    def fn():
+        calls.append(clock.now)
+        if len(calls) < 3:
+            raise Throttled(headers={"retry-after": "5"})
+        return "ok"
+
+    assert limiter.call("provider", None, fn) == "ok"
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 5 and calls[2] - calls[1] >= 5
+
+
+def test_call_gives_up_after_max_retries_and_on_other_errors(limiter, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_BACKOFF", 0.0)
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_MAX_RETRIES", 1)
+    throttled, failed = [], []
+
+    def always_throttled():
+        throttled.append(1)
+        raise Throttled()
+
+    def broken():
+        failed.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(Throttled):
+        limiter.call("provider", None, always_throttled)
+    with pytest.raises(ValueError):
+        limiter.call("provider", None, broken)
+    assert (len(throttled), len(failed)) == (2, 1)
+
+
+def test_block_holds_every_caller_of_the_bucket(limiter, clock):
+    limiter.block("provider", "key", 5)
+
+    assert limiter._take(limiter._bucket("provider", "key"), 1.0, 2.0, rate_limit.INTERACTIVE, "a") == pytest.approx(5)
+    assert limiter._take(limiter._bucket("provider", None), 1.0, 2.0, rate_limit.INTERACTIVE, "a") == 0
@@ -0,0 +1,56 @@
+import io
+
+import pytest
+
+import render_cache
+import storage
+from local_s3 import LocalS3Client
+from text_overlay import plan_overlay
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def s3(tmp_path):
+    return LocalS3Client(str(tmp_path / "s3"))
+
+
+def store_render(s3, key):
+    storage.put_stream(io.BytesIO(b"render"), render_cache.output_key(key), bucket=BUCKET,
+                       metadata=render_cache.object_metadata(key, '"etag"'), client=s3)
+
+
+def test_lookup_hits_memory_then_s3(s3):
+    cache = render_cache.RenderCache(ttl=60)
+    store_render(s3, "abc")
+
+    assert cache.lookup(s3, BUCKET, "abc") is not None
+    assert cache.lookup(s3, BUCKET, "abc") is not None
+    assert cache.lookup(s3, BUCKET, "missing") is None
+
+    info = cache.info()
+    assert (info["s3_hits"], info["memory_hits"], info["misses"]) == (1, 1, 1)
+    assert info["hit_rate"] == pytest.approx(2 / 3)
+    assert 'lookbk_render_cache_lookups_total{result="memory_hit"} 1' in cache.render()
+
+
+def test_expired_entry_is_revalidated_after_evict_elsewhere(s3):
+    cache = render_cache.RenderCache(ttl=0)
+    other_process = render_cache.RenderCache(ttl=0)
+    store_render(s3, "abc")
+    assert cache.lookup(s3, BUCKET, "abc") is not None
+
+    assert other_process.evict(s3, BUCKET, older_than=-60) == 1
+
+    assert cache.lookup(s3, BUCKET, "abc") is None
+    assert cache.info()["size"] == 0
+
+
+def test_streamed_and_regular_renders_have_different_keys(s3):
+    storage.put_stream(io.BytesIO(b"source"), "hooks/hook.mp4", bucket=BUCKET, client=s3)
+
+    regular = plan_overlay(s3, BUCKET, "hooks/hook.mp4", "hello")
+    streamed = plan_overlay(s3, BUCKET, "hooks/hook.mp4", "hello", streaming=True)
+
+    assert regular["key"] != streamed["key"]
+    assert regular["output_key"] != streamed["output_key"]
@@ -0,0 +1,50 @@
+import functools
+import os
+
+import pytest
+
+import stitch
+import storage
+from compare_backends import make_clip
+from fakes import SQLitePrisma, serve_directory
+from local_s3 import LocalS3Client
+
+
+@pytest.fixture
+def prisma(tmp_path, monkeypatch):
+    # three hooks and one demo served over HTTP, stitched into a local bucket, two hooks per page
+    clips = tmp_path / "clips"
+    clips.mkdir()
+    for name in ("hook0", "hook1", "hook2", "demo0"):
+        make_clip(str(clips / f"{name}.mp4"), 160, 284, 0.5, audio=False)
+    url, server = serve_directory(str(clips))
+    monkeypatch.setattr(storage, "_client", LocalS3Client(str(tmp_path / "s3")))
+    monkeypatch.setattr(storage, "_client_pid", os.getpid())
+    monkeypatch.setattr(stitch, "iter_url_pages", functools.partial(stitch.iter_url_pages, page_size=2))
+
+    db = SQLitePrisma()
+    for name in ("hook0", "hook1", "hook2"):
+        db.video.create({"filename": f"{name}.mp4", "s3_url": f"{url}/{name}.mp4"})
+    db.demovideo.create({"filename": "demo0.mp4", "s3_url": f"{url}/demo0.mp4"})
+    yield db
+    server.shutdown()
+
+
+def test_process_videos_streams_hook_pages(prisma):
+    result = stitch.process_videos(prisma, backend="ffmpeg", profile="draft")
+
+    assert [url.split("/", 3)[-1] for url in result["videos"]] == [
+        "stitched/draft/hook0_demo0.mp4", "stitched/draft/hook1_demo0.mp4", "stitched/draft/hook2_demo0.mp4"]
+    assert len(prisma.processedvideo.find_many()) == 3
+
+
+def test_process_videos_pairs_span_pages(prisma):
+    result = stitch.process_videos(prisma, pairs=[[2, 0], [0, 0]], backend="ffmpeg", profile="draft")
+
+    assert sorted(url.rsplit("/", 1)[-1] for url in result["videos"]) == ["hook0_demo0.mp4", "hook2_demo0.mp4"]
+
+
+def test_process_videos_rejects_pairs_past_the_last_hook(prisma):
+    with pytest.raises(ValueError):
+        stitch.process_videos(prisma, pairs=[[3, 0]], backend="ffmpeg", profile="draft")
+    assert prisma.processedvideo.find_many() == []
@@ -0,0 +1,32 @@
+import pytest
+
+from compare_backends import make_clip, psnr
+from text_overlay import add_caption_to_video, create_caption_sprite, create_caption_sprites
+
+
+def test_position_moves_the_caption():
+    offsets = {position: create_caption_sprite("hello there", (360, 640), 40, position=position)[1]
+               for position in ("top", "center", "bottom")}
+
+    assert offsets["top"][1] < offsets["center"][1] < offsets["bottom"][1]
+    assert create_caption_sprites(["hello there"], (360, 640), 40, position="top")[0][1] == offsets["top"]
+
+
+@pytest.mark.parametrize("backend", ["moviepy", "ffmpeg"])
+def test_fast_paths_place_the_caption_like_the_composite_path(tmp_path, backend):
+    source = make_clip(str(tmp_path / "source.mp4"), 160, 284, 1, audio=False)
+    reference = str(tmp_path / "composite.mp4")
+    candidate = str(tmp_path / "fast.mp4")
+
+    add_caption_to_video(source, reference, "hello", 40, "top", mode="composite")
+    add_caption_to_video(source, candidate, "hello", 40, "top", mode="fast", backend=backend)
+
+    score, _ = psnr(reference, candidate)
+    # a caption in the wrong place scores about 30 dB, the same placement well above 40
+    assert score >= 40
+
+
+def test_overlong_caption_is_cut_with_an_ellipsis():
+    sprite, _ = create_caption_sprite("word " * 2000, (360, 640))
+
+    assert sprite.size
@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+
+import pytest
+
+import transfer
+from fakes import serve_directory
+from local_s3 import LocalS3Client
+
+BUCKET = "test-bucket"
+# three parts of the smallest size S3 accepts
+SIZE = 2 * transfer.MIN_PART_SIZE + 12345
+
+
+@pytest.fixture
+def source(tmp_path):
+    directory = tmp_path / "source"
+    directory.mkdir()
+    data = os.urandom(SIZE)
+    (directory / "hook.mp4").write_bytes(data)
+    return str(directory), data
+
+
+@pytest.fixture
+def s3(tmp_path):
+    return LocalS3Client(str(tmp_path / "s3"))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return transfer.TransferStore(str(tmp_path / "transfers.sqlite3"))
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(transfer, "_backoff", lambda attempt: 0)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(directory, **kwargs):
+        url, server = serve_directory(directory, **kwargs)
+        servers.append(server)
+        return f"{url}/hook.mp4"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def stored(s3, key):
+    return s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def test_truncated_parts_are_retried(source, s3, store, serve, capsys):
+    directory, data = source
+    # the first response for the third part is cut off halfway
+    url = serve(directory, cut_once=[2 * transfer.MIN_PART_SIZE])
+
+    transfer.copy_url_to_s3(url, "hooks/hook.mp4", bucket=BUCKET, client=s3, store=store,
+                            part_size=transfer.MIN_PART_SIZE)
+
+    assert "Retrying part 3" in capsys.readouterr().out
+    assert stored(s3, "hooks/hook.mp4") == data
+    assert store.get(BUCKET, "hooks/hook.mp4") is None
+
+
+def test_failed_transfer_resumes_with_the_missing_parts(source, s3, store, serve, monkeypatch):
+    directory, data = source
+    url = serve(directory)
+    copy_part = transfer._copy_part
+    calls = []
+
+    def failing_part(session, s3, url, bucket, key, upload_id, number, *args):
+        calls.append(number)
+        if number == 2:
+            raise transfer._PartError("connection reset")
+        return copy_part(session, s3, url, bucket, key, upload_id, number, *args)
+
+    monkeypatch.setattr(transfer, "_copy_part", failing_part)
+    with pytest.raises(transfer._PartError):
+        transfer.copy_url_to_s3(url, "hooks/hook.mp4", bucket=BUCKET, client=s3, store=store, workers=1,
+                                part_size=transfer.MIN_PART_SIZE)
+    assert store.get(BUCKET, "hooks/hook.mp4") is not None
+
+    calls.clear()
+    monkeypatch.setattr(transfer, "_copy_part", lambda *args: calls.append(args[6]) or copy_part(*args))
+    transfer.copy_url_to_s3(url, "hooks/hook.mp4", bucket=BUCKET, client=s3, store=store,
+                            part_size=transfer.MIN_PART_SIZE)
+
+    assert calls == [2]
+    assert stored(s3, "hooks/hook.mp4") == data
+
+
+def test_truncated_stream_stores_nothing(source, s3, store, serve):
+    directory, data = source
+    url = serve(directory, fail_rate=1.0, ranges=False)
+
+    with pytest.raises(Exception):
+        transfer.copy_url_to_s3(url, "hooks/hook.mp4", bucket=BUCKET, client=s3, store=store)
+
+    with pytest.raises(Exception) as error:
+        s3.head_object(Bucket=BUCKET, Key="hooks/hook.mp4")
+    assert error.value.response["Error"]["Code"] == "404"
+
+
+def test_stream_without_ranges_is_copied(source, s3, store, serve):
+    directory, data = source
+    url = serve(directory, ranges=False)
+
+    transfer.copy_url_to_s3(url, "hooks/hook.mp4", bucket=BUCKET, client=s3, store=store)
+
+    assert stored(s3, "hooks/hook.mp4") == data
+
+
+def test_concurrent_copy_waits_instead_of_aborting(source, s3, store, serve):
+    directory, data = source
+    url = serve(directory)
+    # another copy of a different source is uploading to the key and holds its lease
+    upload_id = s3.create_multipart_upload(Bucket=BUCKET, Key="hooks/hook.mp4")["UploadId"]
+    store.put(BUCKET, "hooks/hook.mp4", upload_id, '"other-source"', SIZE, transfer.MIN_PART_SIZE)
+    assert store.claim(BUCKET, "hooks/hook.mp4", "other")
+
+    copy = threading.Thread(target=transfer.copy_url_to_s3, args=(url, "hooks/hook.mp4"),
+                            kwargs={"bucket": BUCKET, "client": s3, "store": store})
+    copy.start()
+    time.sleep(1.5)
+    assert copy.is_alive()
+    assert s3.list_parts(Bucket=BUCKET, Key="hooks/hook.mp4", UploadId=upload_id)["Parts"] == []
+
+    # the other copy dies without cleaning up, its upload no longer has a running owner
+    store.release(BUCKET, "hooks/hook.mp4", "other")
+    copy.join(30)
+
+    assert not copy.is_alive()
+    assert stored(s3, "hooks/hook.mp4") == data
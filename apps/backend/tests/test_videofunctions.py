@@ -0,0 +1,81 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import videofunctions
+from fakes import FakeRunwayML, make_stock_images
+
+
+@pytest.fixture
+def runway(rate_limiter):
+    # no task budget, so only max_in_flight bounds the batch
+    rate_limiter.limits["runwayml"] = (0, 0)
+    return FakeRunwayML("https://provider.example/output.mp4", latency=0)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # polls return at once, the delays they would have waited are recorded
+    sleeps = []
+    monkeypatch.setattr(videofunctions, "time", SimpleNamespace(monotonic=time.monotonic, sleep=sleeps.append))
+    return sleeps
+
+
+def test_generate_hooks_keeps_max_in_flight(runway, sleeps, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    files = make_stock_images("stockimages", 6, 64, 96)
+    lock = threading.Lock()
+    in_flight = {"now": 0, "max": 0}
+    create = runway.image_to_video.create
+
+    def counted_create(**kwargs):
+        with lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        return create(**kwargs)
+
+    def grab_video(link, key):
+        # the copy takes a while, the task's slot is only free once it is done
+        time.sleep(0.1)
+        with lock:
+            in_flight["now"] -= 1
+        return f"https://bucket.example/{key}"
+
+    runway.image_to_video.create = counted_create
+    monkeypatch.setattr(videofunctions, "grab_video", grab_video)
+
+    hooks = videofunctions.generate_hooks(runway, "a prompt", files, max_in_flight=2)
+
+    assert [hook["filename"] for hook in hooks] == files
+    assert in_flight["max"] == 2
+
+
+def test_wait_for_task_backs_off_exponentially(runway, sleeps):
+    task = runway.image_to_video.create(model="m", prompt_image="i", prompt_text="p")
+    retrieve = runway.tasks.retrieve
+    polls = []
+
+    def slow_retrieve(task_id):
+        polls.append(task_id)
+        if len(polls) <= 4:
+            return SimpleNamespace(id=task_id, status="RUNNING", output=None)
+        return retrieve(task_id)
+
+    runway.tasks.retrieve = slow_retrieve
+
+    done = videofunctions.wait_for_task(runway, task.id, timeout=600, initial_delay=1, max_delay=4)
+
+    assert done.status == "SUCCEEDED"
+    assert sleeps == [1, 2, 4, 4, 4]
+
+
+def test_timed_out_task_is_cancelled(rate_limiter):
+    runway = FakeRunwayML("https://provider.example/output.mp4", latency=1000)
+    task = runway.image_to_video.create(model="m", prompt_image="i", prompt_text="p")
+
+    with pytest.raises(TimeoutError, match=task.id):
+        videofunctions.wait_for_task(runway, task.id, timeout=0.1, initial_delay=0.02, max_delay=0.02)
+
+    assert runway.cancelled == [task.id]
@@ -1,82 +1,501 @@
 import os
-import boto3
+import queue
+import tempfile
+import threading
+from collections import OrderedDict
 from moviepy.editor import VideoFileClip, CompositeVideoClip, ImageClip
-from PIL import Image, ImageDraw, ImageFont
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
 import numpy as np
 
-def create_text_clip(text, size, font_size=100, font_name='Arial', text_color=(255, 255, 255, 255), outline_color=(0, 0, 0, 255)):
-    # transparent image for background
-    img = Image.new('RGBA', size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
+import caption_layout
+import encoding
+import ffmpeg_backend
+import previews
+import render_cache
+import s3_stream
+import storage
+import tracing
 
-    # load font (will be default Arial)
+# outline thickness around the caption text, in pixels
+OUTLINE_WIDTH = 2
+
+# number of rendered caption sprites kept in memory
+CAPTION_CACHE_SIZE = int(os.getenv("CAPTION_CACHE_SIZE", 256))
+
+# decoded frames buffered per caption variant, so one slow encoder does not stall the others for long
+VARIANT_QUEUE_SIZE = int(os.getenv("VARIANT_QUEUE_SIZE", 4))
+
+_sprite_cache = OrderedDict()
+_sprite_cache_lock = threading.Lock()
+_sprite_cache_stats = {"hits": 0, "misses": 0}
+
+def draw_layout(layout, font_name='Arial', text_color=(255, 255, 255, 255), outline_color=(0, 0, 0, 255)):
+    # draw the outlined lines of a caption_layout layout; returns the RGBA sprite and its (x, y) offset in the frame
+    font = caption_layout.load_font(font_name, layout["font_size"])
+    left, top, width, height = layout["box"]
+    if not layout["lines"]:
+        return np.zeros((0, 0, 4), dtype=np.uint8), (0, 0)
+
+    # canvas covers the text block plus the outline on every side, each line centred in it
+    pad = OUTLINE_WIDTH
+    canvas_size = (width, height)
+    origins = [((width - line_width) // 2, pad + i * layout["line_height"])
+               for i, line_width in enumerate(layout["widths"])]
+
+    img = Image.new('RGBA', canvas_size, (0, 0, 0, 0))
+    if isinstance(font, ImageFont.FreeTypeFont):
+        # outline in a single stroke pass
+        draw = ImageDraw.Draw(img)
+        for origin, line in zip(origins, layout["lines"]):
+            draw.text(origin, line, font=font, fill=text_color, stroke_width=pad, stroke_fill=outline_color)
+    else:
+        # bitmap fonts have no stroke support, dilate the glyph mask instead
+        mask = Image.new('L', canvas_size, 0)
+        draw = ImageDraw.Draw(mask)
+        for origin, line in zip(origins, layout["lines"]):
+            draw.text(origin, line, font=font, fill=255)
+        img.paste(outline_color, mask=mask.filter(ImageFilter.MaxFilter(2 * pad + 1)))
+        img.paste(text_color, mask=mask)
+
+    # trimmed to the pixels the caption actually covers
+    bbox = img.getchannel('A').getbbox()
+    if bbox is None:
+        return np.zeros((0, 0, 4), dtype=np.uint8), (0, 0)
+    sprite = np.array(img.crop(bbox))
+    return sprite, (int(left + bbox[0]), int(top + bbox[1]))
+
+def render_caption_sprite(text, size, font_size=100, font_name='Arial', text_color=(255, 255, 255, 255), outline_color=(0, 0, 0, 255), position='center'):
+    # lay the caption out in the frame's safe area (font_size is the largest size used) and draw it
+    layout = caption_layout.layout_caption(text, size, font_size, font_name, position, pad=OUTLINE_WIDTH)
+    return draw_layout(layout, font_name, text_color, outline_color)
+
+def _sprite_key(text, size, font_size, font_name, text_color, outline_color, position):
+    return (text, font_name, font_size, tuple(text_color), tuple(outline_color), tuple(size), position)
+
+def create_caption_sprite(text, size, font_size=100, font_name='Arial', text_color=(255, 255, 255, 255), outline_color=(0, 0, 0, 255), position='center'):
+    # cached render_caption_sprite: returns the (read-only) RGBA sprite and its (x, y) offset in the frame
+    key = _sprite_key(text, size, font_size, font_name, text_color, outline_color, position)
+    with _sprite_cache_lock:
+        cached = _sprite_cache.get(key)
+        if cached is not None:
+            _sprite_cache.move_to_end(key)
+            _sprite_cache_stats["hits"] += 1
+            return cached
+        _sprite_cache_stats["misses"] += 1
+
+    sprite, offset = render_caption_sprite(text, size, font_size, font_name, text_color, outline_color, position)
+    sprite.flags.writeable = False
+
+    with _sprite_cache_lock:
+        _sprite_cache[key] = (sprite, offset)
+        _sprite_cache.move_to_end(key)
+        while len(_sprite_cache) > CAPTION_CACHE_SIZE:
+            _sprite_cache.popitem(last=False)
+    return sprite, offset
+
+def create_caption_sprites(texts, size, font_size=100, font_name='Arial', text_color=(255, 255, 255, 255), outline_color=(0, 0, 0, 255), position='center'):
+    """
+    Caption sprites for a batch of captions on frames of one size.
+
+    All captions are laid out in one caption_layout.layout_captions call and drawn once each
+    (repeated and previously drawn captions come from the sprite cache).
+
+    Returns:
+        list: One (read-only RGBA sprite, (x, y) offset) per caption, in input order
+    """
+    results = [None] * len(texts)
+    missing = []
+    with _sprite_cache_lock:
+        for i, text in enumerate(texts):
+            cached = _sprite_cache.get(_sprite_key(text, size, font_size, font_name, text_color, outline_color, position))
+            if cached is not None:
+                _sprite_cache_stats["hits"] += 1
+                results[i] = cached
+            else:
+                missing.append(i)
+    if not missing:
+        return results
+
+    layouts = caption_layout.layout_captions([texts[i] for i in missing], size, font_size, font_name, position,
+                                             pad=OUTLINE_WIDTH)
+    drawn = {}
+    for i, layout in zip(missing, layouts):
+        if texts[i] not in drawn:
+            sprite, offset = draw_layout(layout, font_name, text_color, outline_color)
+            sprite.flags.writeable = False
+            drawn[texts[i]] = (sprite, offset)
+        results[i] = drawn[texts[i]]
+
+    with _sprite_cache_lock:
+        _sprite_cache_stats["misses"] += len(drawn)
+        for text, value in drawn.items():
+            key = _sprite_key(text, size, font_size, font_name, text_color, outline_color, position)
+            _sprite_cache[key] = value
+            _sprite_cache.move_to_end(key)
+        while len(_sprite_cache) > CAPTION_CACHE_SIZE:
+            _sprite_cache.popitem(last=False)
+    return results
+
+def caption_cache_info():
+    with _sprite_cache_lock:
+        return dict(_sprite_cache_stats, size=len(_sprite_cache), maxsize=CAPTION_CACHE_SIZE,
+                    layout_cache=caption_layout.cache_info())
+
+def clear_caption_cache():
+    with _sprite_cache_lock:
+        _sprite_cache.clear()
+        _sprite_cache_stats.update(hits=0, misses=0)
+    caption_layout.cache_clear()
+
+def create_text_clip(text, size, font_size=100, font_name='Arial', text_color=(255, 255, 255, 255), outline_color=(0, 0, 0, 255), position='center'):
+    # full-frame transparent image with the caption, for compositing with ImageClip
+    img = np.zeros((size[1], size[0], 4), dtype=np.uint8)
+    sprite, (x, y) = create_caption_sprite(text, size, font_size, font_name, text_color, outline_color, position)
+    img[y:y + sprite.shape[0], x:x + sprite.shape[1]] = sprite
+    return img
+
+def fade_table(n_frames, fps, duration, fade_duration):
+    # caption opacity for every frame index, same curve as crossfadein/crossfadeout
+    t = np.arange(n_frames, dtype=np.float32) / fps
+    if fade_duration <= 0:
+        return np.ones(n_frames, dtype=np.float32)
+    fade_in = t / fade_duration
+    fade_out = (duration - t) / fade_duration
+    return np.clip(np.minimum(fade_in, fade_out), 0.0, 1.0)
+
+def blend_sprite(frame, sprite_rgb, sprite_alpha, offset, opacity=1.0):
+    # alpha-blend the sprite into the frame in place, touching only the sprite's box
+    x, y = offset
+    h, w = sprite_alpha.shape[:2]
+    region = frame[y:y + h, x:x + w]
+    alpha = sprite_alpha if opacity >= 1.0 else sprite_alpha * opacity
+    blended = region * (1.0 - alpha) + sprite_rgb * alpha
+    np.copyto(region, blended, casting='unsafe')
+    return frame
+
+def writer_params(profile, audiofile=None, output_params=None, scale=True):
+    # ffmpeg_params for a moviepy writer fed raw frames, with the source audio as a second input
+    params = []
+    if audiofile is not None:
+        # take the audio stream from the source instead of decoding and re-encoding it
+        params = ['-map', '0:v:0', '-map', '1:a?']
+        if encoding.get_profile(profile)["audio"] == 'aac':
+            params += encoding.audio_args(profile)
+    return params + encoding.moviepy_params(profile, output_params or [], scale=scale)
+
+def writer_threads(profile, threads):
+    profile = encoding.get_profile(profile)
+    return profile["threads"] if profile["threads"] is not None else threads
+
+class VariantEncoder:
+    """
+    One output of a multi-caption render.
+
+    The decoded frames are shared by every variant; each variant blends its own caption into
+    a copy (in place when it is the only variant, shared=False) and feeds its own encoder pipe
+    (and previews) from a thread, so the encoders of one source run side by side.
+    """
+
+    def __init__(self, size, fps, duration, output_path, caption_text, font_size=100,
+                 text_color=(255, 255, 255, 255), outline_color=(0, 0, 0, 255), audiofile=None, profile=None,
+                 threads=None, ffmpeg_params=None, preview_paths=None, sprite=None, position='center',
+                 shared=True):
+        self.shared = shared
+        # sprite: the caption's (sprite, offset) when it was already laid out with the rest of the batch
+        sprite, self.offset = sprite or create_caption_sprite(caption_text, size, font_size, 'Arial', text_color,
+                                                              outline_color, position)
+        self.has_caption = bool(sprite.size)
+        self.sprite_alpha = sprite[:, :, 3:4].astype(np.float32) / 255.0
+        self.sprite_rgb = sprite[:, :, :3].astype(np.float32)
+
+        # frames are already decoded at the output size, see add_captions_to_video
+        profile = encoding.get_profile(profile)
+        params = writer_params(profile, audiofile, ffmpeg_params, scale=False)
+        self.writer = FFMPEG_VideoWriter(output_path, size, fps, codec=profile["codec"], preset=profile["preset"],
+                                         audiofile=audiofile, threads=writer_threads(profile, threads),
+                                         ffmpeg_params=params)
+        # poster and preview clip are cut from the captioned frames on their way to the encoder
+        self.tap = previews.FrameTap(preview_paths["poster"], preview_paths["preview"], size, fps,
+                                     duration) if preview_paths else None
+        self.error = None
+        self._queue = queue.Queue(maxsize=VARIANT_QUEUE_SIZE)
+        self._thread = threading.Thread(target=tracing.wrap(self._run), name=f"encode-{os.path.basename(str(output_path))}",
+                                        daemon=True)
+        self._thread.start()
+
+    def put(self, index, frame, opacity):
+        if self.error is not None:
+            raise self.error
+        self._queue.put((index, frame, opacity))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # keep draining so the decoder never blocks on a full queue
+                continue
+            index, frame, opacity = item
+            try:
+                if self.has_caption and opacity > 0:
+                    # the decoded frame may be shared with the other variants, or a read-only decoder buffer
+                    if self.shared or not frame.flags.writeable:
+                        frame = frame.copy()
+                    blend_sprite(frame, self.sprite_rgb, self.sprite_alpha, self.offset, opacity)
+                self.writer.write_frame(frame)
+                if self.tap is not None:
+                    self.tap.write(index, frame)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        # flush the queue and close the encoder; returns the error the variant failed with, if any
+        self._queue.put(None)
+        self._thread.join()
+        self.writer.close()
+        if self.tap is not None:
+            self.tap.close()
+        return self.error
+
+def add_captions_fast(video, variants, font_size=100,
+                      text_color=(255, 255, 255, 255), outline_color=(0, 0, 0, 255),
+                      fade_duration=0.5, audiofile=None, profile=None,
+                      threads=None, ffmpeg_params=None, position='center'):
+    # single pass overlay: decode each frame once, blend each variant's caption box, pipe the frames to ffmpeg
+    fps = video.fps
+    n_frames = int(video.duration * fps)
+    opacity = fade_table(n_frames, fps, video.duration, fade_duration)
+
+    # every caption of the source is laid out for the frame size in one batch
+    sprites = create_caption_sprites([variant["caption"] for variant in variants], video.size, font_size, 'Arial',
+                                     text_color, outline_color, position)
+    encoders = []
     try:
-        font = ImageFont.truetype(font_name, font_size)
-    except:
-        font = ImageFont.load_default()
+        for variant, sprite in zip(variants, sprites):
+            encoders.append(VariantEncoder(video.size, fps, video.duration, variant["output_path"], variant["caption"],
+                                           font_size, text_color, outline_color, audiofile=audiofile, profile=profile,
+                                           threads=threads, ffmpeg_params=ffmpeg_params,
+                                           preview_paths=variant.get("preview_paths"), sprite=sprite,
+                                           shared=len(variants) > 1))
+        for i, frame in enumerate(video.iter_frames(fps=fps, dtype='uint8')):
+            if i >= n_frames:
+                break
+            for encoder in encoders:
+                encoder.put(i, frame, opacity[i])
+    finally:
+        errors = [encoder.close() for encoder in encoders]
+
+    for error in errors:
+        if error is not None:
+            raise error
+    return n_frames
 
-    left, top, right, bottom = font.getbbox(text)
-    text_width = right - left
-    text_height = bottom - top
+def add_caption_fast(video, output_path, caption_text, font_size=100,
+                     text_color=(255, 255, 255, 255), outline_color=(0, 0, 0, 255),
+                     fade_duration=0.5, audiofile=None, profile=None,
+                     threads=None, ffmpeg_params=None, preview_paths=None, position='center'):
+    return add_captions_fast(video, [{"caption": caption_text, "output_path": output_path,
+                                      "preview_paths": preview_paths}],
+                             font_size, text_color, outline_color, fade_duration, audiofile=audiofile,
+                             profile=profile, threads=threads, ffmpeg_params=ffmpeg_params, position=position)
 
-    x = (size[0] - text_width) // 2
-    y = (size[1] - text_height) // 2
+def add_captions_to_video(video_path, variants, font_size = 100,
+                          text_color = (255, 255, 255, 255), outline_color = (0, 0, 0, 255),
+                          fade_duration = 0.5, backend = 'moviepy', threads = None,
+                          output_params = None, profile = None, position = 'center'):
+    """
+    Render several caption variants of one video, decoding the source only once.
 
-    # outline
-    offsets = [(2,0), (-2,0), (0,2), (0,-2), (2,2), (-2,-2), (2,-2), (-2,2), (1,2), (-1,2), (2,1), (2,-1), (-2,1), (-2,-1), (1,-2), (-1,-2)]
-    for offset_x, offset_y in offsets:
-        draw.text((x + offset_x, y + offset_y), text, font=font, fill=outline_color)
-    draw.text((x, y), text, font=font, fill=text_color)
+    Args:
+        variants (list): One dict per output with "caption", "output_path" and optional
+            "preview_paths" ({"poster": path, "preview": path})
+        position (str): Where the captions sit in the frame's safe area, one of caption_layout.POSITIONS
+        threads (int): Encoder threads per variant
+        profile: Encoding profile name or settings (see encoding.PROFILES)
+    """
+    if backend not in ffmpeg_backend.BACKENDS:
+        raise ValueError(f"Unknown render backend '{backend}', expected one of {ffmpeg_backend.BACKENDS}")
+    # encoder settings (preset, crf, proxy size, audio), see encoding.PROFILES
+    profile = encoding.get_profile(profile)
+    keep_audio = profile["audio"] != 'none'
 
-    return np.array(img)
+    with tracing.span("overlay.encode", backend=backend, mode='fast', profile=profile["name"],
+                      variants=len(variants)) as span:
+        if backend == 'ffmpeg':
+            # ffmpeg does the decode, overlay and encode in one filter graph, no frames pass through python
+            info = ffmpeg_backend.probe(video_path)
+            size = info["size"]
+            outputs = []
+            sprites = create_caption_sprites([variant["caption"] for variant in variants], size, font_size, 'Arial',
+                                             text_color, outline_color, position)
+            for variant, (sprite, offset) in zip(variants, sprites):
+                outputs.append({"output_path": variant["output_path"], "sprite": sprite, "offset": offset,
+                                "preview_paths": variant.get("preview_paths")})
+            ffmpeg_backend.overlay_captions(video_path, outputs, fade_duration, profile=profile,
+                                            threads=threads, output_params=output_params)
+            span.set(frames=int((info["duration"] or 0) * (info["fps"] or 0)) * len(variants))
+            return
+
+        video = VideoFileClip(video_path, audio=False)
+        width, height = encoding.scaled_size(video.size, profile)
+        if (width, height) != tuple(video.size):
+            # proxies are decoded at the output size by ffmpeg, so every later step touches fewer pixels
+            font_size = max(1, int(round(font_size * height / video.size[1])))
+            video.close()
+            video = VideoFileClip(video_path, audio=False, target_resolution=(height, width))
+        # the caption is laid out in the frame's safe area, same as the composite path
+        try:
+            audiofile = video_path if keep_audio and ffmpeg_backend.has_audio(video_path) else None
+            frames = add_captions_fast(video, variants, font_size, text_color, outline_color, fade_duration,
+                                       audiofile=audiofile, profile=profile, threads=threads,
+                                       ffmpeg_params=output_params, position=position)
+        finally:
+            video.close()
+        span.set(frames=frames * len(variants))
 
 def add_caption_to_video(video_path, output_path, caption_text, 
                      font_size = 100, position = 'center',
                      text_color = (255, 255, 255, 255), outline_color = (0, 0, 0, 255),
-                     fade_duration = 0.5):
-    # load the video
-    video = VideoFileClip(video_path)
-
-    # set caption to show for the entire video duration
-    start_time = 0
-    duration = video.duration
-
-    # create text frame - always using Arial font
-    text_frame = create_text_clip(caption_text, video.size, font_size, 'Arial', text_color, outline_color)
-
-    # create text clip
-    txt_clip = (ImageClip(text_frame)
-                .set_duration(duration)
-                .set_position(position)
-                .set_start(start_time)
-                .crossfadein(fade_duration)
-                .crossfadeout(fade_duration))
-
-    # overlay text on video
-    final = CompositeVideoClip([video, txt_clip])
-
-    # write output keeping original format
-    final.write_videofile(output_path, codec='libx264')
-
-    # clean up
-    video.close()
-    final.close()
-
-def text_overlay(s3, bucket_name, s3_url, caption, font_size = 100, position = 'center'):
-    filename = s3_url.split("/")[-1]
-    local_input = f"/tmp/{filename}"
-    processed_filename = f"overlaid_{filename.split('.')[0]}.mp4"
-    local_output = f"/tmp/{processed_filename}"
-
-    # download video from s3
-    s3_key = "/".join(s3_url.split("/")[-2:])
-    s3.download_file(bucket_name, s3_key, local_input)
-
-    # add caption to video
-    add_caption_to_video(local_input, local_output, caption, font_size, position)
-
-    # upload processed video to s3
-    s3.upload_file(local_output, bucket_name, f"overlaid/{s3_key}")
-    
-    processed_s3_url = f"https://{bucket_name}.s3.amazonaws.com/overlaid/{s3_key}"
-    return processed_s3_url
+                     fade_duration = 0.5, mode = 'fast', backend = 'moviepy', threads = None,
+                     output_params = None, profile = None, preview_paths = None):
+    # preview_paths: optional {"poster": path, "preview": path}, written from the frames of this render
+    if backend not in ffmpeg_backend.BACKENDS:
+        raise ValueError(f"Unknown render backend '{backend}', expected one of {ffmpeg_backend.BACKENDS}")
+    if backend == 'ffmpeg' or mode == 'fast':
+        # a single variant of the multi-output render
+        add_captions_to_video(video_path, [{"caption": caption_text, "output_path": output_path,
+                                            "preview_paths": preview_paths}],
+                              font_size, text_color, outline_color, fade_duration, backend=backend,
+                              threads=threads, output_params=output_params, profile=profile, position=position)
+        return
+
+    # encoder settings (preset, crf, proxy size, audio), see encoding.PROFILES
+    profile = encoding.get_profile(profile)
+    keep_audio = profile["audio"] != 'none'
+
+    with tracing.span("overlay.encode", backend=backend, mode=mode, profile=profile["name"]) as span:
+        # load the video
+        video = VideoFileClip(video_path, audio=False)
+        final = None
+        try:
+            # set caption to show for the entire video duration
+            start_time = 0
+            duration = video.duration
+
+            # create text frame - always using Arial font, laid out at position in the safe area
+            text_frame = create_text_clip(caption_text, video.size, font_size, 'Arial', text_color, outline_color,
+                                          position)
+
+            # create text clip, it covers the whole frame
+            txt_clip = (ImageClip(text_frame)
+                        .set_duration(duration)
+                        .set_start(start_time)
+                        .crossfadein(fade_duration)
+                        .crossfadeout(fade_duration))
+
+            # overlay text on video
+            final = CompositeVideoClip([video, txt_clip])
+
+            # write output keeping original format, the source audio is muxed in directly (no temp audio file)
+            audiofile = video_path if keep_audio and ffmpeg_backend.has_audio(video_path) else None
+            writer = FFMPEG_VideoWriter(output_path, final.size, video.fps, codec=profile["codec"],
+                                        preset=profile["preset"], audiofile=audiofile,
+                                        threads=writer_threads(profile, threads),
+                                        ffmpeg_params=writer_params(profile, audiofile, output_params))
+            tap = previews.FrameTap(preview_paths["poster"], preview_paths["preview"], final.size, video.fps,
+                                    duration) if preview_paths else None
+            try:
+                for i, frame in enumerate(final.iter_frames(fps=video.fps, dtype='uint8')):
+                    writer.write_frame(frame)
+                    if tap is not None:
+                        tap.write(i, frame)
+            finally:
+                writer.close()
+                if tap is not None:
+                    tap.close()
+            span.set(frames=int(duration * video.fps))
+        finally:
+            # clean up, also when the encode fails
+            video.close()
+            if final is not None:
+                final.close()
+
+def source_key(s3_url):
+    # s3 key of the source video, from its url (or a bare key)
+    return storage.key_from_url(s3_url)
+
+def overlay_url(bucket_name, output_key):
+    return storage.object_url(output_key, bucket_name)
+
+def plan_overlay(s3, bucket_name, s3_url, caption, font_size=100, position='center', profile=None, streaming=False):
+    # content address of the captioned render, and its url if it has already been rendered; streamed renders
+    # are fragmented MP4s without faststart, so they never answer for a regular render (or the other way round)
+    s3_key = source_key(s3_url)
+    etag = s3.head_object(Bucket=bucket_name, Key=s3_key)["ETag"]
+    key = render_cache.render_key(etag, caption, font_size=font_size, position=position,
+                                  text_color=(255, 255, 255, 255), outline_color=(0, 0, 0, 255),
+                                  fade_duration=0.5,
+                                  output_params=s3_stream.FRAGMENTED_MP4_PARAMS if streaming else None,
+                                  **encoding.cache_settings(profile))
+    return {
+        "source_key": s3_key,
+        "output_key": render_cache.output_key(key),
+        "preview_keys": render_cache.preview_keys(key),
+        "metadata": render_cache.object_metadata(key, etag),
+        "key": key,
+        "cached_url": render_cache.render_cache.lookup(s3, bucket_name, key),
+    }
+
+def render_overlay(s3, bucket_name, s3_url, caption, font_size = 100, position = 'center', streaming = False,
+                   profile = None):
+    """
+    Caption a video stored in S3 and upload the render with its poster JPEG and preview clip.
+
+    Returns:
+        dict: "s3_url" of the render, "poster_url", "preview_url", and whether it was "cached"
+    """
+    plan = plan_overlay(s3, bucket_name, s3_url, caption, font_size, position, profile, streaming)
+    if plan["cached_url"]:
+        # identical source, caption and style were already rendered (previews are uploaded before the render)
+        return dict(s3_url=plan["cached_url"], cached=True, **previews.urls(bucket_name, plan["preview_keys"]))
+    s3_key, output_key = plan["source_key"], plan["output_key"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = s3_url.split("/")[-1]
+        processed_filename = f"overlaid_{filename.split('.')[0]}.mp4"
+        local_output = os.path.join(tmp, processed_filename)
+        preview_paths = previews.local_paths(local_output)
+
+        if streaming:
+            # read the source through a ranged/presigned url and upload the output while it is encoded
+            with s3_stream.open_source(s3, bucket_name, s3_key) as source, \
+                    s3_stream.pipe_to_s3(s3, bucket_name, output_key, metadata=plan["metadata"]) as output:
+                add_caption_to_video(source, output, caption, font_size, position,
+                                     output_params=s3_stream.FRAGMENTED_MP4_PARAMS, profile=profile,
+                                     preview_paths=preview_paths)
+                # the render is only complete (and a cache hit) once the upload finishes, after its previews
+                preview_urls = previews.upload(s3, bucket_name, preview_paths, plan["preview_keys"])
+        else:
+            local_input = os.path.join(tmp, filename)
+
+            # download video from s3
+            storage.download_file(s3_key, local_input, bucket=bucket_name, client=s3)
+
+            # add caption to video
+            add_caption_to_video(local_input, local_output, caption, font_size, position, profile=profile,
+                                 preview_paths=preview_paths)
+
+            # upload previews, then the processed video to s3
+            preview_urls = previews.upload(s3, bucket_name, preview_paths, plan["preview_keys"])
+            storage.upload_file(local_output, output_key, bucket=bucket_name, metadata=plan["metadata"], client=s3)
+
+    processed_s3_url = overlay_url(bucket_name, output_key)
+    render_cache.render_cache.remember(plan["key"], processed_s3_url)
+    return dict(s3_url=processed_s3_url, cached=False, **preview_urls)
+
+def text_overlay(s3, bucket_name, s3_url, caption, font_size = 100, position = 'center', streaming = False,
+                 profile = None):
+    # url of the captioned video, see render_overlay for its poster and preview clip
+    return render_overlay(s3, bucket_name, s3_url, caption, font_size, position, streaming, profile)["s3_url"]
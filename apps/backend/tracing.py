@@ -0,0 +1,298 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# when set, every finished trace is written to this directory as a Chrome trace file
+# (open it in chrome://tracing or https://ui.perfetto.dev)
+TRACE_DIR = os.getenv("TRACE_DIR")
+
+# upper bounds in seconds of the span duration histogram buckets
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# numeric span attributes that are summed per span name
+COUNTERS = ("bytes", "frames", "bytes_saved")
+
+_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_span: contextvars.ContextVar = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """One timed operation: a pipeline stage, an encode or a call to an external service."""
+
+    def __init__(self, name: str, parent: Optional[str] = None, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.parent = parent
+        self.attrs: Dict[str, Any] = attrs
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "parent": self.parent,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+            "attrs": self.attrs,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+        }
+
+
+def _intervals_length(intervals: List[List[float]]) -> float:
+    # wall time covered by possibly overlapping intervals, so parallel spans are not double counted
+    total = 0.0
+    end = None
+    for start, stop in sorted(intervals):
+        if end is None or start > end:
+            total += stop - start
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+
+class Trace:
+    """Every span recorded while handling one job or request."""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None):
+        self.id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Dict[str, Any]):
+        with self._lock:
+            self.spans.append(span)
+
+    def breakdown(self) -> Dict[str, Any]:
+        """
+        Summarize the trace per span name.
+
+        Returns:
+            Dict[str, Any]: Total seconds and, per span name, the call count, summed seconds,
+            wall seconds (overlapping calls counted once), slowest call, errors, and the
+            bytes/frames moved with the resulting throughput and the upload bytes saved
+        """
+        with self._lock:
+            spans = list(self.spans)
+
+        summary: Dict[str, Dict[str, Any]] = {}
+        intervals: Dict[str, List[List[float]]] = {}
+        for span in spans:
+            stats = summary.setdefault(span["name"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "errors": 0})
+            duration = span["duration"] or 0.0
+            stats["count"] += 1
+            stats["seconds"] += duration
+            stats["max_seconds"] = max(stats["max_seconds"], duration)
+            stats["errors"] += 1 if span["error"] else 0
+            for counter in COUNTERS:
+                if isinstance(span["attrs"].get(counter), (int, float)):
+                    stats[counter] = stats.get(counter, 0) + span["attrs"][counter]
+            intervals.setdefault(span["name"], []).append([span["start"], span["start"] + duration])
+
+        for name, stats in summary.items():
+            stats["wall_seconds"] = _intervals_length(intervals[name])
+            if stats.get("frames") and stats["seconds"]:
+                stats["fps"] = stats["frames"] / stats["seconds"]
+            if stats.get("bytes") and stats["seconds"]:
+                stats["bytes_per_sec"] = stats["bytes"] / stats["seconds"]
+            for key, value in stats.items():
+                if isinstance(value, float):
+                    stats[key] = round(value, 4)
+
+        root = next((span for span in spans if span["name"] == self.name and span["parent"] is None), None)
+        return {
+            "trace_id": self.id,
+            "total_seconds": round(root["duration"], 4) if root else None,
+            "spans": summary,
+        }
+
+    def to_chrome(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        events = [
+            {
+                "name": span["name"],
+                "cat": "lookbk",
+                "ph": "X",
+                "ts": span["start"] * 1e6,
+                "dur": (span["duration"] or 0.0) * 1e6,
+                "pid": span["pid"],
+                "tid": span["thread"],
+                "args": dict(span["attrs"], error=span["error"]) if span["error"] else span["attrs"],
+            }
+            for span in spans
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace_id": self.id, "name": self.name}}
+
+    def dump(self, path: str) -> str:
+        """
+        Write the trace as a Chrome trace file.
+
+        Args:
+            path (str): File to write, or a directory to write <trace_id>.json into
+
+        Returns:
+            str: Path of the written file
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, f"{self.id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome(), f, default=str)
+        return path
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """Process-wide totals of every finished span, rendered in the Prometheus text format."""
+
+    def __init__(self, prefix: str = "lookbk"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._spans: Dict[str, Dict[str, Any]] = {}
+
+    def observe(self, span: Dict[str, Any]):
+        duration = span["duration"] or 0.0
+        with self._lock:
+            stats = self._spans.setdefault(span["name"], {
+                "count": 0, "errors": 0, "seconds": 0.0, "buckets": [0] * len(BUCKETS),
+                **{counter: 0 for counter in COUNTERS},
+            })
+            stats["count"] += 1
+            stats["seconds"] += duration
+            stats["errors"] += 1 if span["error"] else 0
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    stats["buckets"][i] += 1
+            for counter in COUNTERS:
+                if isinstance(span["attrs"].get(counter), (int, float)):
+                    stats[counter] += span["attrs"][counter]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: dict(stats, buckets=list(stats["buckets"])) for name, stats in self._spans.items()}
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+
+    def render(self) -> str:
+        spans = self.snapshot()
+        name = f"{self.prefix}_span_duration_seconds"
+        lines = [
+            f"# HELP {name} Duration of pipeline stages, encodes and external calls.",
+            f"# TYPE {name} histogram",
+        ]
+        for span_name, stats in sorted(spans.items()):
+            label = f'span="{_escape(span_name)}"'
+            for bound, count in zip(BUCKETS, stats["buckets"]):
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{label},le="+Inf"}} {stats["count"]}')
+            lines.append(f"{name}_sum{{{label}}} {stats['seconds']}")
+            lines.append(f"{name}_count{{{label}}} {stats['count']}")
+
+        for counter, description in (("errors", "Spans that raised."),
+                                     ("bytes", "Bytes moved inside spans."),
+                                     ("frames", "Video frames encoded inside spans."),
+                                     ("bytes_saved", "Upload bytes saved inside spans, e.g. by compacting images.")):
+            name = f"{self.prefix}_span_{counter}_total"
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            for span_name, stats in sorted(spans.items()):
+                if counter == "errors" or stats[counter]:
+                    lines.append(f'{name}{{span="{_escape(span_name)}"}} {stats[counter]}')
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def _record(span: Dict[str, Any]):
+    registry.observe(span)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(span)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time the enclosed block as a span of the current trace (if any) and of the process metrics.
+
+    Yields the Span, so attributes known only later (bytes, frames, status) can be added with set().
+    """
+    parent = _span.get()
+    current = Span(name, parent.id if parent is not None else None, **attrs)
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = str(e) or type(e).__name__
+        raise
+    finally:
+        _span.reset(token)
+        current.finish()
+        _record(current.to_dict())
+
+
+@contextmanager
+def trace(name: str, trace_id: Optional[str] = None, dump: bool = True):
+    """
+    Collect every span recorded in the enclosed block (and in threads started through wrap()).
+
+    The block itself is timed as the root span. With TRACE_DIR set the finished trace is
+    written there for offline analysis.
+    """
+    current = Trace(name, trace_id)
+    trace_token = _trace.set(current)
+    span_token = _span.set(None)
+    try:
+        with span(name):
+            yield current
+    finally:
+        _span.reset(span_token)
+        _trace.reset(trace_token)
+        if dump and TRACE_DIR:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            current.dump(TRACE_DIR)
+
+
+def wrap(fn: Callable) -> Callable:
+    """Bind fn to the current trace and span, for work handed to a thread pool."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        # one copy per call, a context cannot be entered by two threads at once
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+def import_spans(spans: Iterable[Dict[str, Any]]):
+    """Record spans collected in another process (e.g. an encoder worker) under the current span."""
+    parent = _span.get()
+    for span_dict in spans:
+        if span_dict["parent"] is None and parent is not None:
+            span_dict = dict(span_dict, parent=parent.id)
+        _record(span_dict)
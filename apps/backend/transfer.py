@@ -0,0 +1,453 @@
+import base64
+import binascii
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+import urllib3
+from botocore.exceptions import ClientError
+from requests.adapters import HTTPAdapter
+
+import services
+import storage
+import tracing
+from s3_stream import MIN_PART_SIZE
+
+# multipart uploads in progress, so a transfer cut short by a crash picks up where it stopped
+TRANSFER_DB_PATH = os.getenv("TRANSFER_DB_PATH", "transfers.sqlite3")
+TRANSFER_PART_SIZE = int(os.getenv("TRANSFER_PART_SIZE", 8 * 1024 * 1024))
+# ranged GETs (and part uploads) in flight per transfer
+TRANSFER_WORKERS = int(os.getenv("TRANSFER_WORKERS", 4))
+# attempts per part (or per whole transfer when the source does not support ranges)
+TRANSFER_RETRIES = int(os.getenv("TRANSFER_RETRIES", 5))
+TRANSFER_BACKOFF = float(os.getenv("TRANSFER_BACKOFF", 0.5))
+TRANSFER_MAX_BACKOFF = float(os.getenv("TRANSFER_MAX_BACKOFF", 15.0))
+# connect and read timeout of every provider request
+TRANSFER_TIMEOUT = float(os.getenv("TRANSFER_TIMEOUT", 60))
+# unfinished uploads older than this are aborted, S3 bills for their parts until then
+TRANSFER_STALE_AFTER = float(os.getenv("TRANSFER_STALE_AFTER", 24 * 3600))
+# a copy holds its key for this long after its last heartbeat; other copies to the key wait for it
+TRANSFER_LEASE = float(os.getenv("TRANSFER_LEASE", 120))
+# compare ETags with the MD5 of the data; turn off for SSE-KMS buckets, whose ETags are not MD5s
+# (S3 still checks every part against its Content-MD5)
+TRANSFER_VERIFY_ETAG = os.getenv("TRANSFER_VERIFY_ETAG", "1") != "0"
+
+# S3 refuses multipart uploads of more parts than this
+MAX_PARTS = 10000
+
+_MD5_ETAG = re.compile(r"^[0-9a-f]{32}$")
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class TransferError(Exception):
+    """A transfer that cannot succeed by retrying: the source changed or the stored object does not match."""
+
+
+class _PartError(Exception):
+    """A failed part download or upload worth retrying."""
+
+
+def _backoff(attempt: int) -> float:
+    # full jitter, so parts that failed together do not retry together
+    return random.uniform(0, min(TRANSFER_MAX_BACKOFF, TRANSFER_BACKOFF * 2 ** attempt))
+
+
+def _etag(etag: str) -> str:
+    return etag.strip().strip('"').lower()
+
+
+def _source_id(response: requests.Response) -> Optional[str]:
+    # strong validator of the provider object, weak ETags may not be used with If-Range
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def part_size_for(size: int, part_size: int = TRANSFER_PART_SIZE) -> int:
+    # at least the S3 minimum, and large enough to stay under MAX_PARTS
+    return max(part_size, MIN_PART_SIZE, -(-size // MAX_PARTS))
+
+
+def multipart_etag(md5s: List[bytes]) -> str:
+    # ETag S3 gives a multipart object: MD5 of the concatenated part MD5s and the part count
+    return f"{hashlib.md5(b''.join(md5s)).hexdigest()}-{len(md5s)}"
+
+
+class TransferStore:
+    """
+    SQLite record of the multipart uploads a transfer has started and not finished.
+
+    Keyed by destination, not by source URL: provider URLs are presigned and change
+    between attempts, so the source is recognised by its size and ETag/Last-Modified.
+    A copy in progress holds a lease on its key, so a concurrent copy to the same key
+    waits instead of aborting the upload under it.
+    """
+
+    def __init__(self, path: str = TRANSFER_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS transfers (
+                    bucket TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    upload_id TEXT NOT NULL,
+                    source_id TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    part_size INTEGER NOT NULL,
+                    started REAL NOT NULL,
+                    PRIMARY KEY (bucket, key)
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS leases (
+                    bucket TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    heartbeat REAL NOT NULL,
+                    PRIMARY KEY (bucket, key)
+                )"""
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # one connection per thread (and per process), sqlite connections must not be shared
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, bucket: str, key: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM transfers WHERE bucket = ? AND key = ?", (bucket, key)).fetchone()
+        return dict(row) if row is not None else None
+
+    def put(self, bucket: str, key: str, upload_id: str, source_id: str, size: int, part_size: int):
+        with self._transaction() as conn:
+            conn.execute(
+                """INSERT INTO transfers (bucket, key, upload_id, source_id, size, part_size, started)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(bucket, key) DO UPDATE SET upload_id = excluded.upload_id,
+                   source_id = excluded.source_id, size = excluded.size, part_size = excluded.part_size,
+                   started = excluded.started""",
+                (bucket, key, upload_id, source_id, size, part_size, time.time()),
+            )
+
+    def delete(self, bucket: str, key: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM transfers WHERE bucket = ? AND key = ?", (bucket, key))
+
+    def take_stale(self, older_than: float = TRANSFER_STALE_AFTER, lease: float = TRANSFER_LEASE) -> List[Dict[str, Any]]:
+        # forget the uploads nobody resumed in time and return them, so the caller can abort them;
+        # an upload whose copy is still running is never stale
+        with self._transaction() as conn:
+            now = time.time()
+            where = """started < ? AND NOT EXISTS (SELECT 1 FROM leases WHERE leases.bucket = transfers.bucket
+                       AND leases.key = transfers.key AND leases.heartbeat >= ?)"""
+            params = (now - older_than, now - lease)
+            rows = [dict(row) for row in conn.execute(f"SELECT * FROM transfers WHERE {where}", params)]
+            conn.execute(f"DELETE FROM transfers WHERE {where}", params)
+        return rows
+
+    def claim(self, bucket: str, key: str, owner: str, lease: float = TRANSFER_LEASE) -> bool:
+        """Take the lease on a key for owner; False while another owner heartbeated it within lease seconds."""
+        with self._transaction() as conn:
+            now = time.time()
+            conn.execute("DELETE FROM leases WHERE bucket = ? AND key = ? AND heartbeat < ?", (bucket, key, now - lease))
+            conn.execute("INSERT OR IGNORE INTO leases (bucket, key, owner, heartbeat) VALUES (?, ?, ?, ?)",
+                         (bucket, key, owner, now))
+            row = conn.execute("SELECT owner FROM leases WHERE bucket = ? AND key = ?", (bucket, key)).fetchone()
+        return row["owner"] == owner
+
+    def heartbeat(self, bucket: str, key: str, owner: str):
+        with self._transaction() as conn:
+            conn.execute("UPDATE leases SET heartbeat = ? WHERE bucket = ? AND key = ? AND owner = ?",
+                         (time.time(), bucket, key, owner))
+
+    def release(self, bucket: str, key: str, owner: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE bucket = ? AND key = ? AND owner = ?", (bucket, key, owner))
+
+
+@contextmanager
+def _leased(store: TransferStore, bucket: str, key: str, lease: float = TRANSFER_LEASE):
+    # hold the key for the whole copy: wait for a running copy to finish (or die and let its lease lapse),
+    # then heartbeat from a thread so slow parts never let the lease expire
+    owner = uuid.uuid4().hex
+    with tracing.span("transfer.lease", key=key):
+        while not store.claim(bucket, key, owner, lease):
+            time.sleep(min(1.0, lease / 10))
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(lease / 4):
+            store.heartbeat(bucket, key, owner)
+
+    thread = threading.Thread(target=beat, name=f"lease-{key}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        store.release(bucket, key, owner)
+
+
+def _abort(s3, bucket: str, key: str, upload_id: str):
+    try:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+    except ClientError:
+        pass
+
+
+def _uploaded_parts(s3, bucket: str, key: str, upload_id: str) -> Optional[Dict[int, Dict[str, Any]]]:
+    # parts S3 already holds for an upload, or None if the upload is gone (completed or aborted)
+    parts: Dict[int, Dict[str, Any]] = {}
+    marker = 0
+    while True:
+        try:
+            response = s3.list_parts(Bucket=bucket, Key=key, UploadId=upload_id, PartNumberMarker=marker)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "NoSuchUpload":
+                return None
+            raise
+        for part in response.get("Parts", []):
+            parts[part["PartNumber"]] = part
+        if not response.get("IsTruncated"):
+            return parts
+        marker = response["NextPartNumberMarker"]
+
+
+def _session(workers: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _probe(session: requests.Session, url: str) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Size of the provider object, if it can be fetched in ranges, and its validator.
+
+    A one-byte ranged GET rather than a HEAD: presigned URLs are usually signed for GET only.
+    """
+    for attempt in range(TRANSFER_RETRIES):
+        try:
+            with session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=TRANSFER_TIMEOUT) as response:
+                if response.status_code == 416:
+                    # an empty object has no first byte
+                    return None, None
+                response.raise_for_status()
+                match = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+                if response.status_code != 206 or not match or match.group(3) == "*":
+                    return None, None
+                return int(match.group(3)), _source_id(response)
+        except requests.RequestException as e:
+            status = e.response.status_code if getattr(e, "response", None) is not None else None
+            if status is not None and status < 500 and status != 429:
+                raise
+            if attempt == TRANSFER_RETRIES - 1:
+                raise
+            time.sleep(_backoff(attempt))
+    return None, None
+
+
+def _copy_part(session: requests.Session, s3, url: str, bucket: str, key: str, upload_id: str, number: int,
+               start: int, end: int, source_id: Optional[str]) -> Dict[str, Any]:
+    # one byte range from the provider into one S3 part, retried on network errors, short reads and bad digests
+    expected = end - start + 1
+    headers = {"Range": f"bytes={start}-{end}"}
+    if source_id:
+        # a changed source answers with the whole new object instead of mixing two versions
+        headers["If-Range"] = source_id
+    for attempt in range(TRANSFER_RETRIES):
+        try:
+            with tracing.span("transfer.get_part", key=key, part=number) as span:
+                response = session.get(url, headers=headers, timeout=TRANSFER_TIMEOUT)
+                if response.status_code == 200:
+                    raise TransferError(f"Source of {key} changed during the transfer")
+                if response.status_code >= 500 or response.status_code == 429:
+                    raise _PartError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                data = response.content
+                span.set(bytes=len(data))
+            if len(data) != expected:
+                raise _PartError(f"part {number} is {len(data)} bytes, expected {expected}")
+            md5 = hashlib.md5(data)
+
+            begin = time.monotonic()
+            with tracing.span("s3.put_part", key=key, part=number, bytes=len(data)):
+                uploaded = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data,
+                                          ContentMD5=base64.b64encode(md5.digest()).decode("ascii"))
+            storage.metrics.record("put_part", len(data), time.monotonic() - begin)
+            etag = _etag(uploaded["ETag"])
+            if TRANSFER_VERIFY_ETAG and etag != md5.hexdigest():
+                raise _PartError(f"part {number} was stored with ETag {etag}, expected {md5.hexdigest()}")
+            return {"PartNumber": number, "ETag": uploaded["ETag"], "md5": md5.digest()}
+        except (requests.RequestException, ClientError, _PartError) as e:
+            if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code < 500:
+                raise
+            if attempt == TRANSFER_RETRIES - 1:
+                raise
+            print(f"Retrying part {number} of {key} ({e})")
+            time.sleep(_backoff(attempt))
+
+
+def _copy_ranges(s3, session: requests.Session, url: str, bucket: str, key: str, size: int, source_id: Optional[str],
+                 content_type: str, metadata: Optional[Dict[str, str]], workers: int, part_size: int,
+                 store: TransferStore, span) -> None:
+    part_size = part_size_for(size, part_size)
+    ranges = [(number, start, min(start + part_size, size) - 1)
+              for number, start in enumerate(range(0, size, part_size), start=1)]
+
+    upload_id, done = None, {}
+    state = store.get(bucket, key)
+    if state is not None:
+        if (state["source_id"], state["size"], state["part_size"]) == (source_id or "", size, part_size):
+            parts = _uploaded_parts(s3, bucket, key, state["upload_id"])
+            if parts is not None:
+                upload_id = state["upload_id"]
+                # a part of the wrong length was cut short, it is uploaded again
+                done = {number: parts[number] for number, start, end in ranges
+                        if number in parts and parts[number]["Size"] == end - start + 1}
+        else:
+            # the lease is ours, so the old upload belongs to a copy that is no longer running
+            _abort(s3, bucket, key, state["upload_id"])
+    if upload_id is None:
+        extra: Dict[str, Any] = {"ContentType": content_type}
+        if metadata:
+            extra["Metadata"] = metadata
+        upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, **extra)["UploadId"]
+        store.put(bucket, key, upload_id, source_id or "", size, part_size)
+    span.set(parts=len(ranges), resumed=len(done), bytes=sum(end - start + 1 for number, start, end in ranges
+                                                                    if number not in done))
+
+    completed = {number: {"PartNumber": number, "ETag": part["ETag"],
+                          "md5": binascii.unhexlify(_etag(part["ETag"])) if _MD5_ETAG.match(_etag(part["ETag"])) else b""}
+                 for number, part in done.items()}
+    try:
+        todo = [part for part in ranges if part[0] not in done]
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo) or 1))) as executor:
+            futures = [executor.submit(tracing.wrap(_copy_part), session, s3, url, bucket, key, upload_id,
+                                       number, start, end, source_id)
+                       for number, start, end in todo]
+            for future in futures:
+                part = future.result()
+                completed[part["PartNumber"]] = part
+    except TransferError:
+        # the parts belong to a version of the source that no longer exists
+        _abort(s3, bucket, key, upload_id)
+        store.delete(bucket, key)
+        raise
+    # any other failure leaves the upload and its record in place, the next attempt resumes it
+
+    parts = [completed[number] for number, _, _ in ranges]
+    response = s3.complete_multipart_upload(
+        Bucket=bucket, Key=key, UploadId=upload_id,
+        MultipartUpload={"Parts": [{"PartNumber": part["PartNumber"], "ETag": part["ETag"]} for part in parts]},
+    )
+    store.delete(bucket, key)
+
+    length = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    if length != size:
+        s3.delete_object(Bucket=bucket, Key=key)
+        raise TransferError(f"s3://{bucket}/{key} is {length} bytes, the source is {size}")
+    if TRANSFER_VERIFY_ETAG and all(part["md5"] for part in parts):
+        expected = multipart_etag([part["md5"] for part in parts])
+        if _etag(response["ETag"]) != expected:
+            s3.delete_object(Bucket=bucket, Key=key)
+            raise TransferError(f"s3://{bucket}/{key} has ETag {_etag(response['ETag'])}, expected {expected}")
+
+
+def _copy_stream(s3, session: requests.Session, url: str, bucket: str, key: str, content_type: str,
+                 metadata: Optional[Dict[str, str]], span) -> None:
+    # sources without range support: one streaming GET per attempt, nothing is stored unless it is complete
+    for attempt in range(TRANSFER_RETRIES):
+        try:
+            # identity encoding, so Content-Length counts the bytes that are stored
+            with session.get(url, stream=True, timeout=TRANSFER_TIMEOUT,
+                             headers={"Accept-Encoding": "identity"}) as response:
+                response.raise_for_status()
+                expected = response.headers.get("Content-Length")
+                storage.put_stream(response.raw, key, content_type, bucket, metadata, client=s3,
+                                   content_length=int(expected) if expected is not None else None)
+            span.set(parts=1, resumed=0, bytes=s3.head_object(Bucket=bucket, Key=key)["ContentLength"])
+            return
+        except (requests.RequestException, urllib3.exceptions.HTTPError, ClientError, IOError) as e:
+            if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code < 500:
+                raise
+            if attempt == TRANSFER_RETRIES - 1:
+                raise
+            print(f"Retrying transfer of {key} ({e})")
+            time.sleep(_backoff(attempt))
+
+
+def copy_url_to_s3(url: str, key: str, content_type: str = "video/mp4", bucket: Optional[str] = None,
+                   metadata: Optional[Dict[str, str]] = None, client=None, workers: int = TRANSFER_WORKERS,
+                   part_size: int = TRANSFER_PART_SIZE, store: Optional[TransferStore] = None) -> str:
+    """
+    Copy an HTTP(S) object into S3 without touching the disk, verified end to end.
+
+    The object is fetched with parallel ranged GETs, each range uploaded as one part of a
+    multipart upload with its Content-MD5, and retried on its own when the download or the
+    upload fails. The finished object must have the source's length and the multipart ETag
+    of the parts that were sent, otherwise it is deleted. An interrupted transfer leaves its
+    upload recorded in the TransferStore, and the next copy to the same key uploads only the
+    missing parts, as long as the source is unchanged. Sources that do not support ranges
+    are streamed in one request and only stored once their Content-Length is met. Copies
+    to the same key run one at a time, the later one waiting for the earlier to finish.
+
+    Args:
+        url (str): Source URL, e.g. a presigned provider URL
+        key (str): Destination object key
+        workers (int): Ranges transferred at once
+        part_size (int): Bytes per part, raised to the S3 minimum and to stay under MAX_PARTS
+        store (Optional[TransferStore]): Where unfinished uploads are recorded (default: the shared store)
+
+    Returns:
+        str: URL of the uploaded object
+
+    Raises:
+        TransferError: If the source changed mid-transfer or the stored object failed verification
+    """
+    s3 = client or storage.get_client()
+    bucket = bucket or storage.S3_BUCKET
+    store = store or services.get_transfer_store()
+    for stale in store.take_stale():
+        _abort(s3, stale["bucket"], stale["key"], stale["upload_id"])
+
+    start = time.monotonic()
+    with tracing.span("transfer.copy", key=key) as span, _leased(store, bucket, key), _session(workers) as session:
+        size, source_id = _probe(session, url)
+        if size is None:
+            _copy_stream(s3, session, url, bucket, key, content_type, metadata, span)
+        else:
+            _copy_ranges(s3, session, url, bucket, key, size, source_id, content_type, metadata, workers, part_size,
+                         store, span)
+        nbytes = span.attrs.get("bytes", 0)
+    storage.metrics.record("transfer", nbytes, time.monotonic() - start)
+    return storage.object_url(key, bucket)
@@ -1,15 +1,27 @@
 from runwayml import RunwayML
 import os
 import time
-import requests
-import boto3
 import uuid
-from botocore.config import Config
-import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+import image_prep
+import services
+import tracing
+import transfer
 load_dotenv()
 
+#runwayml model used for every hook
+HOOK_MODEL = 'gen3a_turbo'
 
+#task statuses after which runwayml will not change the task any more
+TERMINAL_STATUSES = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+
+#concurrency and polling settings for hook generation
+MAX_IN_FLIGHT = int(os.getenv('RUNWAYML_MAX_IN_FLIGHT', 5))
+TASK_TIMEOUT = float(os.getenv('RUNWAYML_TASK_TIMEOUT', 600))
+POLL_INITIAL_DELAY = float(os.getenv('RUNWAYML_POLL_INITIAL_DELAY', 2.0))
+POLL_MAX_DELAY = float(os.getenv('RUNWAYML_POLL_MAX_DELAY', 30.0))
 
 def runwayml_login():
   RUNWAYML_API_KEY = os.getenv('RUNWAYML_API_KEY')
@@ -23,70 +35,142 @@ def generate_files_array():
   return files_array
 
 def grab_video(link, names3):
-  #s3 bucket information and access
-  S3_BUCKET = "lookbk-video-bucket"
-  S3_REGION = "us-west-1"
-  AWS_ACCESS_KEY = os.getenv('AWS_ACCESS_KEY')
-  AWS_SECRET_KEY = os.getenv('AWS_SECRET_KEY')
-  #video_filename = os.path.join(output_folder, link.split("/")[-1].split("?")[0])
-
-  if not AWS_ACCESS_KEY or not AWS_SECRET_KEY:
-    raise ValueError("AWS credentials not found. Check your .env file or environment variables.")
-
-  s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_KEY,
-    region_name=S3_REGION,
-    config=Config(signature_version="s3v4")
-  )
-
-  # Stream video from URL
-  response = requests.get(link, stream=True)
-  response.raise_for_status()
-
-  # Upload directly to S3
-  s3_client.upload_fileobj(response.raw, S3_BUCKET, names3, ExtraArgs={"ContentType": "video/mp4"})
-
-  # Construct and return the S3 URL
-  s3_url = f"https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{names3}"
+  with tracing.span("grab_video", key=names3):
+    #copy the video from the provider straight into s3 in parallel ranges, verified against the source's length
+    #and checksummed part by part; an interrupted copy resumes from the parts already uploaded
+    s3_url = transfer.copy_url_to_s3(link, names3, content_type="video/mp4")
   print(f"Upload complete: {s3_url}")
   return s3_url
 
 
-def encode_image(image_path):
-  with open(image_path, "rb") as img_file:
-    return "data:image/png;base64," + base64.b64encode(img_file.read()).decode('utf-8')
-
-def generate_hooks(client, prompt, files_array): #add the demo video portion later
-
-  final_hooks = []
-    #need an array of files
-  for file in files_array:
-    image_path = os.path.join('stockimages', file)
-    encoded_image = encode_image(image_path)
-    task = client.image_to_video.create(
-      model='gen3a_turbo',
+def encode_image(image_path, model=None):
+  #prompt image as a data uri: cropped to the model's aspect ratio, scaled down and re-encoded with its real mime type
+  #prepared once per image content, repeated requests are served from memory
+  return image_prep.prompt_images.prompt_image(image_path, model or HOOK_MODEL)["data_uri"]
+
+def client_key(client):
+  #api key of a runwayml client, rate limits are kept per key
+  return getattr(client, 'api_key', None)
+
+def cancel_task(client, task_id):
+  #cancel a pending or running runwayml task; a failed cancel is logged, the caller is already giving up
+  try:
+    with tracing.span("runwayml.cancel", task=task_id):
+      services.get_rate_limiter().call('runwayml.poll', client_key(client), client.tasks.delete, task_id)
+  except Exception as e:
+    print(f"Could not cancel RunwayML task {task_id}: {e}")
+
+def wait_for_task(client, task_id, timeout=TASK_TIMEOUT, initial_delay=POLL_INITIAL_DELAY, max_delay=POLL_MAX_DELAY):
+  #poll a runwayml task with exponential backoff until it is done or the timeout expires
+  #polls share the per-key rate limit with every other worker, throttled polls back off instead of spinning
+  #the span covers the time the task spends queued and running at runwayml
+  limiter = services.get_rate_limiter()
+  with tracing.span("runwayml.wait", task=task_id) as span:
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    polls = 0
+    while True:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        #cancel the task so it stops using credits after nobody waits for it any more
+        cancel_task(client, task_id)
+        raise TimeoutError(f"RunwayML task {task_id} did not finish within {timeout} seconds")
+      time.sleep(min(delay, remaining))
+      with tracing.span("runwayml.retrieve", task=task_id):
+        task = limiter.call('runwayml.poll', client_key(client), client.tasks.retrieve, task_id)
+      polls += 1
+      if task.status in TERMINAL_STATUSES:
+        span.set(status=task.status, polls=polls)
+        return task
+      delay = min(delay * 2, max_delay)
+
+def image_hash(image_path):
+  #content hash of a stock image, so renamed or re-uploaded copies still match the index
+  #only re-read when the file's size or mtime changes
+  return image_prep.prompt_images.digest(image_path)
+
+def hook_key(image_digest, prompt, model=HOOK_MODEL):
+  #s3 key for the hook made from one image and prompt, so runs no longer overwrite each other
+  prompt_digest = hashlib.sha256(f"{model}:{prompt}".encode("utf-8")).hexdigest()
+  return f"hooks/{image_digest[:16]}-{prompt_digest[:16]}.mp4"
+
+def generate_hook(client, prompt, file, timeout=TASK_TIMEOUT, key=None, encoded_image=None):
+  #submit one image to runwayml, wait for it and move the result into s3
+  if encoded_image is None:
+    encoded_image = encode_image(os.path.join('stockimages', file))
+  with tracing.span("runwayml.create", model=HOOK_MODEL, image=file):
+    #waits for a token of this api key's task budget, retries if runwayml still answers 429
+    task = services.get_rate_limiter().call(
+      'runwayml', client_key(client), client.image_to_video.create,
+      model=HOOK_MODEL,
       prompt_image=encoded_image,
       prompt_text=prompt,
     )
-    print(task.id)
-    task_id = task.id 
-
-    time.sleep(10)  # Wait for a second before polling
-    task = client.tasks.retrieve(task_id)
-    while task.status not in ['SUCCEEDED', 'FAILED']:
-      time.sleep(10)  # Wait for ten seconds before polling
-      task = client.tasks.retrieve(task_id)
-
-    #print(task)
-
-    if task.status == 'SUCCEEDED':
-      url = task.output[0]
-      s3_url = grab_video(url, file)
-      if s3_url:
-        final_hooks.append(s3_url)
+  print(task.id)
+
+  task = wait_for_task(client, task.id, timeout=timeout)
+  if task.status != 'SUCCEEDED':
+    print(f"RunwayML task {task.id} ended with status {task.status}")
+    return None
+
+  url = task.output[0]
+  return grab_video(url, key or file)
+
+def iter_hooks(client, prompt, files_array, max_in_flight=MAX_IN_FLIGHT, timeout=TASK_TIMEOUT, hook_index=None):
+  #yields every hook as soon as it is ready: reused hooks first, then new ones in the order their tasks finish,
+  #so later stages can start on the first hook while the slowest task is still running
+  #every hook carries its "index" in files_array; failed hooks are left out
+  if not files_array:
+    return
+
+  with tracing.span("hooks.hash_images", images=len(files_array)):
+    hashes = [image_hash(os.path.join('stockimages', file)) for file in files_array]
+  existing = hook_index.lookup(prompt, HOOK_MODEL, hashes) if hook_index is not None else {}
+
+  missing = []
+  for i, (file, digest) in enumerate(zip(files_array, hashes)):
+    if digest in existing:
+      yield {"index": i, "filename": file, "image_hash": digest, "model": HOOK_MODEL, "s3_url": existing[digest].s3_url,
+             "cached": True, "record": existing[digest]}
     else:
-      print()
+      missing.append(i)
+  if not missing:
+    return
+
+  #prompt images are prepared before any task is submitted; bytes is the upload size, bytes_saved what
+  #cropping and re-encoding took off the raw files
+  with tracing.span("hooks.prepare_images", images=len(missing)) as span:
+    with ThreadPoolExecutor(max_workers=max(1, min(os.cpu_count() or 1, len(missing)))) as executor:
+      prepared = list(executor.map(
+        lambda i: image_prep.prompt_images.prompt_image(os.path.join('stockimages', files_array[i]), HOOK_MODEL),
+        missing))
+    span.set(bytes=sum(image["bytes"] for image in prepared),
+             bytes_saved=sum(image["bytes_saved"] for image in prepared),
+             cached=sum(image["cached"] for image in prepared))
+
+  with ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(missing)))) as executor:
+    futures = {
+      executor.submit(tracing.wrap(generate_hook), client, prompt, files_array[i], timeout, hook_key(hashes[i], prompt),
+                      image["data_uri"]): i
+      for i, image in zip(missing, prepared)
+    }
+    for future in as_completed(futures):
+      i = futures[future]
+      try:
+        s3_url = future.result()
+      except Exception as e:
+        #one failed or timed out task should not throw away the rest of the batch
+        print(f"Hook generation failed for {files_array[i]}: {e}")
+        continue
+      if s3_url:
+        yield {"index": i, "filename": files_array[i], "image_hash": hashes[i], "model": HOOK_MODEL, "s3_url": s3_url,
+               "cached": False, "record": None}
+
+def generate_hooks(client, prompt, files_array, max_in_flight=MAX_IN_FLIGHT, timeout=TASK_TIMEOUT, hook_index=None): #add the demo video portion later
+  #every task is submitted right away (up to max_in_flight at once) and polled in its own thread,
+  #so a batch takes about as long as its slowest task instead of the sum of all of them
+  #with a hook_index, (image, prompt, model) combinations generated before are reused instead
+  hooks = list(iter_hooks(client, prompt, files_array, max_in_flight, timeout, hook_index))
 
-  return final_hooks
\ No newline at end of file
+  #keep the hooks in the same order as the input images
+  return sorted(hooks, key=lambda hook: hook["index"])